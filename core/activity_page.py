@@ -0,0 +1,60 @@
+# core/activity_page.py
+
+# Loader for the activity detail page. The page used to need ~10 queries: latest id, details,
+# laps, ride date, recent list, prev, next, 12-month best curve, fitness and TSB zone.
+# SQL_ACTIVITY_PAGE returns all of it as one row (side lists as JSON columns), so a page view is
+# one round trip. Zone descriptions come from the cached percentage zones (core/analysis.py),
+# the best curve from the maintained envelope (core/power_envelope.py).
+#   ./venv/bin/python3 -u -m scripts.bench_activity_page <athlete_id>  compares both paths
+
+from datetime import datetime
+from core.database import run_query
+from core.queries import SQL_ACTIVITY_PAGE
+from core.power_envelope import get_power_envelope, envelope_since
+
+PAGE_COLUMNS = ('page_laps', 'page_recent', 'page_prev_id', 'page_next_id',
+                'page_best_power', 'page_best_stale', 'page_fitness', 'page_tsb_zone')
+
+def load_activity_page(athlete_id, strava_id=None):
+    """
+    Returns the template context of the activity page, or None if the activity (or, without
+    strava_id, any activity of the athlete) does not exist.
+    """
+    rows = run_query(SQL_ACTIVITY_PAGE, {'athlete_id': athlete_id, 'strava_id': strava_id, 'best_since': envelope_since()})
+    if not rows:
+        return None
+
+    activity = rows[0]
+    page = {k: activity.pop(k) for k in PAGE_COLUMNS}
+
+    # JSON columns carry dates as text; the template formats them
+    recent = page['page_recent'] or []
+    for r in recent:
+        r['start_date_local'] = datetime.fromisoformat(r['start_date_local'])
+
+    fitness_rows = page['page_fitness'] or []
+    fitness_data = fitness_rows[0] if len(fitness_rows) > 0 else {}
+    yesterday_data = fitness_rows[1] if len(fitness_rows) > 1 else None
+
+    deltas = {}
+    if yesterday_data:
+        for metric in ['ctl', 'atl', 'tsb']:
+            if fitness_data.get(metric) is not None and yesterday_data.get(metric) is not None:
+                deltas[metric] = fitness_data[metric] - yesterday_data[metric]
+
+    best_power = {int(d): p for d, p in (page['page_best_power'] or {}).items()}
+    if page['page_best_stale']:
+        # A record holder aged out or was deleted: rebuild once, then it is a keyed read again
+        best_power = get_power_envelope(athlete_id)
+
+    return {
+        'activity': activity,
+        'laps': page['page_laps'] or [],
+        'recent_activities': recent,
+        'prev_id': page['page_prev_id'],
+        'next_id': page['page_next_id'],
+        'best_power': best_power,
+        'fitness': fitness_data,
+        'fitness_deltas': deltas,
+        'tsb_zone': page['page_tsb_zone'],
+    }
@@ -1,10 +1,28 @@
 # core/analysis.py
 
 import numpy as np
-from core.database import run_query
+from cachetools import cached, TTLCache
+from core.database import run_query, get_db_connection
+from psycopg2.extras import execute_values
 from datetime import datetime, timedelta
 import config
 
+ZONES_CACHE_TTL = getattr(config, 'ZONES_CACHE_TTL', 300)
+
+@cached(TTLCache(maxsize=16, ttl=ZONES_CACHE_TTL))
+def get_percentage_zones(category):
+    """
+    Percentage-based zone definitions for 'power' or 'hr', ordered by zone_no.
+    Cached: training_zones rarely changes but is read for every processed activity.
+    """
+    sql = """
+        SELECT category, zone_name, min_val, max_val 
+        FROM training_zones 
+        WHERE category = %s AND is_percentage = TRUE 
+        ORDER BY zone_no
+    """
+    return run_query(sql, (category,))
+
 def get_zone_descriptions(active_ftp, active_max_hr):
     """
     Calculates absolute min/max values for Power and HR zones.
@@ -13,14 +31,8 @@ def get_zone_descriptions(active_ftp, active_max_hr):
     active_ftp = active_ftp or config.DEFAULT_FTP
     active_max_hr = active_max_hr or config.DEFAULT_MAX_HR
     
-    # 1. Fetch all percentage-based zones from the DB
-    sql = """
-        SELECT category, zone_name, min_val, max_val 
-        FROM training_zones 
-        WHERE is_percentage = TRUE 
-        ORDER BY category, zone_no
-    """
-    db_zones = run_query(sql)
+    # 1. Fetch all percentage-based zones (cached)
+    db_zones = get_percentage_zones('hr') + get_percentage_zones('power')
     
     # 2. Reconstruct the dictionary format your template expects
     output = {'power': [], 'hr': []}
@@ -40,10 +52,12 @@ def get_zone_descriptions(active_ftp, active_max_hr):
             
     return output
 
-def sync_daily_fitness(athlete_id, start_date):
+def sync_daily_fitness(athlete_id, start_date, estimate_missing=False):
     """
     Re-computes CTL/ATL/TSB from start_date forward to today.
     Fills in gaps for days with 0 TSS.
+    With estimate_missing, activities without analytics get a TSS estimated from their
+    summary (NP or avg HR vs. the current baselines), so a ledger exists before streams do.
     """
     # 1. Get the 'Seed' values from the day before the change
     seed_sql = """
@@ -58,20 +72,40 @@ def sync_daily_fitness(athlete_id, start_date):
     
     # 2. Fetch all known TSS from rides and a generated calendar of days
     # This ensures we have a row for every single day, even rest days.
-    calendar_sql = """
+    if estimate_missing:
+        baselines = run_query(
+            "SELECT COALESCE(manual_ftp, detected_ftp) as ftp, COALESCE(manual_max_hr, detected_max_hr) as max_hr FROM users WHERE athlete_id = %s",
+            (athlete_id,)
+        )
+        ftp = float((baselines[0]['ftp'] if baselines else None) or config.DEFAULT_FTP)
+        max_hr = float((baselines[0]['max_hr'] if baselines else None) or config.DEFAULT_MAX_HR)
+
+        # Summary TSS: power-based (t * NP^2 / (FTP^2 * 36)) or HRSS fallback (hours * IF^2 * 100)
+        tss_expr = """COALESCE(aa.training_stress_score, CASE
+                WHEN a.weighted_average_watts > 0 AND NOT (a.type = ANY(%s))
+                    THEN a.moving_time * a.weighted_average_watts ^ 2 / (%s ^ 2 * 36.0)
+                WHEN a.average_heartrate > 0
+                    THEN (a.moving_time / 3600.0) * (a.average_heartrate / %s) ^ 2 * 100
+                ELSE 0 END)"""
+        tss_params = (list(config.IGNORE_POWER_ACTIVITY), ftp, max_hr)
+    else:
+        tss_expr = "aa.training_stress_score"
+        tss_params = ()
+
+    calendar_sql = f"""
         WITH calendar AS (
             SELECT generate_series(%s::date, NOW()::date, '1 day')::date AS day
         )
         SELECT 
             c.day,
-            COALESCE(SUM(aa.training_stress_score), 0) as daily_tss
+            COALESCE(SUM({tss_expr}), 0) as daily_tss
         FROM calendar c
         LEFT JOIN activities a ON a.start_date_local::date = c.day AND a.athlete_id = %s
         LEFT JOIN activity_analytics aa ON a.strava_id = aa.strava_id
         GROUP BY c.day
         ORDER BY c.day
     """
-    daily_tss_data = run_query(calendar_sql, (start_date, athlete_id))
+    daily_tss_data = run_query(calendar_sql, (start_date,) + tss_params + (athlete_id,))
 
     # 3. Process the chain
     results = []
@@ -89,16 +123,24 @@ def sync_daily_fitness(athlete_id, start_date):
             round(current_ctl, 2), round(current_atl, 2), round(current_tsb, 2)
         ))
 
-    # 4. Batch Save
+    if not results:
+        return 0
+
+    # 4. Batch Save (one statement, one connection)
     save_sql = """
         INSERT INTO athlete_daily_metrics (athlete_id, date, tss, ctl, atl, tsb)
-        VALUES (%s, %s, %s, %s, %s, %s)
+        VALUES %s
         ON CONFLICT (athlete_id, date) DO UPDATE SET
             tss = EXCLUDED.tss, ctl = EXCLUDED.ctl, 
             atl = EXCLUDED.atl, tsb = EXCLUDED.tsb
     """
-    for record in results:
-        run_query(save_sql, record)
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            execute_values(cur, save_sql, results, page_size=1000)
+        conn.commit()
+    finally:
+        conn.close()
         
     return len(results)
 
@@ -187,8 +229,15 @@ def calculate_aerobic_decoupling(watts_series, hr_series):
 def get_best_power_curve(athlete_id, months=12):
     """
     Computes the 'Best' envelope based on a rolling number of months history.
-    Default is 12 months.
+    Default is 12 months, served from the maintained athlete_power_envelope table.
     """
+    from core.power_envelope import get_power_envelope, ENVELOPE_MONTHS
+    if months == ENVELOPE_MONTHS:
+        return get_power_envelope(athlete_id)
+    return scan_best_power_curve(athlete_id, months)
+
+def scan_best_power_curve(athlete_id, months=12):
+    """Best envelope merged from every power_curve in the window (no materialized table)."""
     # Calculate the date 'X' months ago
     # Using roughly 30 days per month for the SQL filter
     since_date = (datetime.now() - timedelta(days=months * 30)).strftime('%Y-%m-%d')
@@ -217,76 +266,11 @@ def get_best_power_curve(athlete_id, months=12):
     return overall_best
 
 def get_performance_summary(athlete_id, months_limit=12):
-    from core.queries import SQL_POWER_PROGRESSION, SQL_YEARLY_PEAKS
-    from core.database import run_query
-    from datetime import datetime, timedelta
-    
-    intervals = {
-        '5s': '5', 
-        '1m': '60', 
-        '5m': '300', 
-        '10m': '600', 
-        '20m': '1200', 
-        '60m': '3600'
-    }
-    all_progression, all_time_peaks, recent_peaks = {}, {}, {}
-    
-    today = datetime.now().date()
-    # Radar chart looks at last 30 days of actual data
-    global_recent_cutoff = today - timedelta(days=30)
-    
-    for label, json_key in intervals.items():
-        query = SQL_POWER_PROGRESSION
-        # Pass the json_key into the query placeholders
-        raw_data = run_query(query, (
-            json_key,       # For SELECT
-            athlete_id, 
-            json_key,       # For IS NOT NULL check
-            json_key,       # For > 0 check
-            months_limit, 
-            months_limit
-        ))
-        
-        if not raw_data:
-            all_progression[label], all_time_peaks[label], recent_peaks[label] = [], 0, 0
-            continue
+    from core.queries import SQL_YEARLY_PEAKS
+    from core.power_progression import build_progression
 
-        # Convert dates once
-        for r in raw_data:
-            if hasattr(r['date'], 'date'): r['date'] = r['date'].date()
-        
-        raw_data.sort(key=lambda x: x['date'])
-        
-        current_max = 0
-        processed = []
-        
-        for i, row in enumerate(raw_data):
-            pwr = row['power'] or 0
-            ride_date = row['date']
-            
-            if pwr > current_max: current_max = pwr
-            
-            # Efficient Seasonal Max: Look back in the already sorted raw_data
-            window_start = ride_date - timedelta(days=30)
-            seasonal_max = 0
-            # Only iterate backwards until we leave the 30-day window
-            for j in range(i, -1, -1):
-                if raw_data[j]['date'] < window_start: break
-                val = raw_data[j]['power'] or 0
-                if val > seasonal_max: seasonal_max = val
-
-            processed.append({
-                'x': ride_date.isoformat(),
-                'y': pwr,
-                'seasonal_record': seasonal_max,
-                'ftp': row.get('baseline_ftp') or 0,
-                'name': row['activity_name'],
-                'id': str(row['strava_id'])
-            })
-            
-        all_progression[label] = processed
-        all_time_peaks[label] = current_max
-        recent_peaks[label] = max([r['power'] for r in raw_data if r['date'] >= global_recent_cutoff] or [0])
+    # One cached, incrementally refreshed set of rides for all intervals (core/power_progression.py)
+    all_progression, all_time_peaks, recent_peaks = build_progression(athlete_id, months_limit)
 
     yearly_bests = run_query(SQL_YEARLY_PEAKS, (athlete_id,))
     return {
@@ -304,14 +288,8 @@ def calculate_time_in_zones(series, baseline, category):
     if not series or not baseline:
         return {}
 
-    # Fetch zones for this category from the DB
-    sql = """
-        SELECT zone_name, min_val, max_val 
-        FROM training_zones 
-        WHERE category = %s AND is_percentage = TRUE 
-        ORDER BY zone_no
-    """
-    zones = run_query(sql, (category,))
+    # Fetch zones for this category (cached)
+    zones = get_percentage_zones(category)
     
     series = np.array(series)
     tiz = {}
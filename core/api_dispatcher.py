@@ -0,0 +1,177 @@
+# core/api_dispatcher.py
+
+# Priority lanes for the shared Strava API budget (one app-wide 15-min and daily limit).
+#   webhook > onboarding > backfill > refresh
+# Every Strava call goes through acquire_lane_slot() / record_api_call() (see strava_api.strava_request).
+#   - each lane may only use its quota share of the window, so a backfill burst
+#     can never eat the budget a webhook or a new athlete needs
+#   - a lower lane waits while a higher lane has work in flight, and gives up
+#     (StravaLaneBlocked) after STRAVA_LANE_MAX_WAIT so batch jobs stop cleanly
+# The calling job sets its lane once:  with api_lane('backfill'): ...
+# DB traffic per call stays off the hot path: calls are buffered in-process and written in batches,
+# and the window usage and active lanes are read at most once per STRAVA_LANE_POLL_SECONDS, with
+# this process's own calls since the read counted locally (Strava's headers cover the rest).
+
+import atexit, contextvars, threading, time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from psycopg2.extras import execute_values
+from core.database import run_query, get_db_connection
+from core.queries import SQL_API_WINDOW_USAGE, SQL_API_ACTIVE_LANES, SQL_INSERT_API_CALLS, SQL_PURGE_API_CALLS
+import config
+
+LANES = ('webhook', 'onboarding', 'backfill', 'refresh')
+
+# Share of each rate limit window a lane may consume (counting all lanes' calls)
+STRAVA_LANE_QUOTAS = getattr(config, 'STRAVA_LANE_QUOTAS', {
+    'webhook': 1.0,
+    'onboarding': 0.9,
+    'backfill': 0.7,
+    'refresh': 0.5,
+})
+STRAVA_LIMIT_15M = getattr(config, 'STRAVA_LIMIT_15M', 100)
+STRAVA_LIMIT_1D = getattr(config, 'STRAVA_LIMIT_1D', 1000)
+STRAVA_LANE_MAX_WAIT = getattr(config, 'STRAVA_LANE_MAX_WAIT', 60)
+STRAVA_LANE_POLL_SECONDS = getattr(config, 'STRAVA_LANE_POLL_SECONDS', 5)
+# A webhook claim older than this is treated as abandoned (drain crashed or was killed)
+WEBHOOK_CLAIM_TIMEOUT = getattr(config, 'WEBHOOK_CLAIM_TIMEOUT', 600)
+API_CALL_FLUSH_SIZE = getattr(config, 'API_CALL_FLUSH_SIZE', 20)
+
+_current_lane = contextvars.ContextVar('strava_lane', default='refresh')
+_active_cache = {'at': 0.0, 'lanes': set()}
+# DB window usage as of 'at', plus this process's calls since then
+_usage_cache = {'at': 0.0, 'window': None, 'usage_15m': 0, 'usage_1d': 0, 'local': 0}
+_pending_calls = []
+_calls_lock = threading.Lock()
+_calls_since_purge = 0
+
+class StravaLaneBlocked(Exception):
+    """The lane could not get an API slot in time. Batch callers should stop, not retry."""
+
+    def __init__(self, lane, reason):
+        super().__init__(f"Strava lane '{lane}' blocked: {reason}")
+        self.lane = lane
+        self.reason = reason
+
+@contextmanager
+def api_lane(lane):
+    """Runs the block's Strava calls in the given lane."""
+    token = _current_lane.set(lane)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+def current_lane():
+    return _current_lane.get()
+
+def _active_lanes():
+    """Lanes with work in flight, cached for one poll interval."""
+    now = time.monotonic()
+    if now - _active_cache['at'] >= STRAVA_LANE_POLL_SECONDS:
+        row = run_query(SQL_API_ACTIVE_LANES, (WEBHOOK_CLAIM_TIMEOUT,))
+        row = row[0] if row else {}
+        _active_cache['lanes'] = {lane for lane in ('webhook', 'onboarding') if row.get(lane)}
+        _active_cache['at'] = now
+    return _active_cache['lanes']
+
+def _logged_usage():
+    """(usage_15m, usage_1d) from api_calls, re-read once per poll interval or window change."""
+    now = time.monotonic()
+    window = int(time.time() // 900)
+    with _calls_lock:
+        fresh = now - _usage_cache['at'] < STRAVA_LANE_POLL_SECONDS and _usage_cache['window'] == window
+        if fresh:
+            local = _usage_cache['local']
+            return _usage_cache['usage_15m'] + local, _usage_cache['usage_1d'] + local
+
+    flush_api_calls()  # the read must include this process's buffered calls
+    row = run_query(SQL_API_WINDOW_USAGE)
+    row = row[0] if row else {}
+    with _calls_lock:
+        _usage_cache.update({
+            'at': now, 'window': window, 'local': 0,
+            'usage_15m': row.get('usage_15m') or 0, 'usage_1d': row.get('usage_1d') or 0,
+        })
+        return _usage_cache['usage_15m'], _usage_cache['usage_1d']
+
+def window_usage():
+    """Calls used in the current 15-min window and UTC day, by our log or Strava's headers."""
+    from core.strava_api import rate_limit_state, header_usage
+
+    logged_15m, logged_1d = _logged_usage()
+    # Header figures only count until their window resets
+    seen_15m, seen_1d = header_usage()
+    usage_15m = max(logged_15m, seen_15m)
+    usage_1d = max(logged_1d, seen_1d)
+    limit_15m = rate_limit_state.get('limit_15m') or STRAVA_LIMIT_15M
+    limit_1d = rate_limit_state.get('limit_1d') or STRAVA_LIMIT_1D
+    return usage_15m, limit_15m, usage_1d, limit_1d
+
+def _blocking_reason(lane):
+    higher = LANES[:LANES.index(lane)]
+    active = _active_lanes() if higher else set()
+    for h in higher:
+        if h in active:
+            return f"preempted by {h}"
+
+    quota = STRAVA_LANE_QUOTAS.get(lane, 1.0)
+    usage_15m, limit_15m, usage_1d, limit_1d = window_usage()
+    if usage_15m >= limit_15m * quota:
+        return f"15-min quota ({usage_15m}/{int(limit_15m * quota)})"
+    if usage_1d >= limit_1d * quota:
+        return f"daily quota ({usage_1d}/{int(limit_1d * quota)})"
+    return None
+
+def acquire_lane_slot():
+    """Waits until the current lane may call Strava. Returns (lane, waited_ms)."""
+    lane = current_lane()
+    started = time.monotonic()
+
+    while True:
+        reason = _blocking_reason(lane)
+        if not reason:
+            break
+        if time.monotonic() - started >= STRAVA_LANE_MAX_WAIT:
+            raise StravaLaneBlocked(lane, reason)
+        time.sleep(STRAVA_LANE_POLL_SECONDS)
+
+    return lane, int((time.monotonic() - started) * 1000)
+
+def record_api_call(lane, endpoint, status_code, latency_ms, waited_ms):
+    """
+    Logs one call for the window counters and the admin lane stats. Buffered: written every
+    API_CALL_FLUSH_SIZE calls, before each usage read and at exit.
+    """
+    called_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    with _calls_lock:
+        _pending_calls.append((lane, endpoint, status_code, latency_ms, waited_ms, called_at))
+        _usage_cache['local'] += 1
+        full = len(_pending_calls) >= API_CALL_FLUSH_SIZE
+    if full:
+        flush_api_calls()
+
+def flush_api_calls():
+    """Writes the buffered calls in one statement."""
+    global _calls_since_purge
+    with _calls_lock:
+        rows = _pending_calls[:]
+        del _pending_calls[:]
+    if not rows:
+        return
+    try:
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                execute_values(cur, SQL_INSERT_API_CALLS, rows)
+            conn.commit()
+        finally:
+            conn.close()
+        _calls_since_purge += len(rows)
+        if _calls_since_purge >= 500:
+            _calls_since_purge = 0
+            run_query(SQL_PURGE_API_CALLS)
+    except Exception as e:
+        print(f"\t⚠️ Failed to record {len(rows)} API call(s): {e}")
+
+atexit.register(flush_api_calls)
@@ -0,0 +1,427 @@
+# core/archive_import.py
+
+# Bulk import of a Strava or Garmin export archive, without any API calls.
+# FIT/GPX/TCX files (optionally .gz, Garmin's nested zips included) are parsed in a process pool
+# into the same activity dicts / stream buffers the API path produces, written in bulk, and the
+# analytics ripple then runs once from the oldest imported ride.
+#   - Strava export: activities.csv gives the real activity id, name and type, so a later
+#     API sync updates the same rows instead of duplicating them
+#   - Garmin files get a stable negative id (the activity routes accept signed ids, the page hides
+#     the Strava link); rides already in the DB (same start +-2 min) are skipped
+#   - FIT is parsed with 'fitdecode' (requirements.txt); an install without it counts FIT files
+#     as 'fit-unsupported' and skips them
+#
+#   ./venv/bin/python3 -u -m core.archive_import <athlete_id> <export.zip> [workers]
+
+import csv, gzip, hashlib, io, os, sys, time, zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone, timedelta
+from zoneinfo import ZoneInfo
+import numpy as np
+import config
+
+IMPORT_WORKERS = getattr(config, 'IMPORT_WORKERS', max(1, (os.cpu_count() or 2) - 1))
+IMPORT_BATCH_SIZE = getattr(config, 'IMPORT_BATCH_SIZE', 200)
+IMPORT_TIMEZONE = getattr(config, 'IMPORT_TIMEZONE', 'Europe/Prague')
+
+SUPPORTED = ('.fit', '.gpx', '.tcx')
+
+FIT_SPORTS = {'cycling': 'Ride', 'running': 'Run', 'walking': 'Walk', 'hiking': 'Hike', 'swimming': 'Swim'}
+TCX_SPORTS = {'biking': 'Ride', 'running': 'Run'}
+
+# ------------------------------------------------------------------------------------------
+# Parsers (run in the worker processes). Each returns (sport, start_utc, local_offset, samples)
+# with samples as equal-length lists per channel; time is in seconds from the start.
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def _iso(text):
+    return datetime.fromisoformat(text.strip().replace('Z', '+00:00'))
+
+def parse_gpx(data):
+    root = ET.fromstring(data)
+    sport, points = None, []
+    for el in root.iter():
+        name = _local(el.tag)
+        if name == 'type' and sport is None and el.text:
+            sport = el.text.strip().lower()
+        elif name == 'trkpt':
+            p = {'lat': float(el.get('lat')), 'lng': float(el.get('lon'))}
+            for child in el.iter():
+                c = _local(child.tag)
+                if child.text is None:
+                    continue
+                if c == 'time':
+                    p['time'] = _iso(child.text)
+                elif c == 'ele':
+                    p['altitude'] = float(child.text)
+                elif c == 'hr':
+                    p['heartrate'] = float(child.text)
+                elif c in ('cad', 'cadence'):
+                    p['cadence'] = float(child.text)
+                elif c in ('power', 'PowerInWatts'):
+                    p['watts'] = float(child.text)
+                elif c in ('atemp', 'temp'):
+                    p['temp'] = float(child.text)
+            if 'time' in p:
+                points.append(p)
+    sport = {'cycling': 'Ride', '1': 'Ride', 'running': 'Run', '9': 'Run'}.get(sport, sport)
+    return sport, points, None
+
+def parse_tcx(data):
+    root = ET.fromstring(data)
+    sport, points = None, []
+    for el in root.iter():
+        name = _local(el.tag)
+        if name == 'Activity' and sport is None:
+            sport = TCX_SPORTS.get((el.get('Sport') or '').lower())
+        elif name == 'Trackpoint':
+            p = {}
+            for child in el.iter():
+                c = _local(child.tag)
+                if child.text is None or not child.text.strip():
+                    continue
+                if c == 'Time':
+                    p['time'] = _iso(child.text)
+                elif c == 'LatitudeDegrees':
+                    p['lat'] = float(child.text)
+                elif c == 'LongitudeDegrees':
+                    p['lng'] = float(child.text)
+                elif c == 'AltitudeMeters':
+                    p['altitude'] = float(child.text)
+                elif c == 'DistanceMeters':
+                    p['distance'] = float(child.text)
+                elif c == 'Value':
+                    p['heartrate'] = float(child.text)
+                elif c == 'Cadence':
+                    p['cadence'] = float(child.text)
+                elif c == 'Watts':
+                    p['watts'] = float(child.text)
+                elif c == 'Speed':
+                    p['velocity_smooth'] = float(child.text)
+            if 'time' in p:
+                points.append(p)
+    return sport, points, None
+
+def parse_fit(data):
+    import fitdecode
+
+    sport, sub_sport, offset, points = None, None, None, []
+    semicircle = 180.0 / 2 ** 31
+    with fitdecode.FitReader(io.BytesIO(data)) as fit:
+        for frame in fit:
+            if not isinstance(frame, fitdecode.FitDataMessage):
+                continue
+            if frame.name in ('sport', 'session') and sport is None:
+                sport = frame.get_value('sport', fallback=None)
+                sub_sport = frame.get_value('sub_sport', fallback=None)
+            elif frame.name == 'activity' and frame.has_field('local_timestamp'):
+                ts, local_ts = frame.get_value('timestamp'), frame.get_value('local_timestamp')
+                if ts and local_ts:
+                    offset = (local_ts.replace(tzinfo=None) - ts.replace(tzinfo=None)).total_seconds()
+            elif frame.name == 'record':
+                ts = frame.get_value('timestamp', fallback=None)
+                if ts is None:
+                    continue
+                p = {'time': ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)}
+                lat, lng = frame.get_value('position_lat', fallback=None), frame.get_value('position_long', fallback=None)
+                if lat is not None and lng is not None:
+                    p['lat'], p['lng'] = lat * semicircle, lng * semicircle
+                for channel, fields in (
+                    ('altitude', ('enhanced_altitude', 'altitude')), ('distance', ('distance',)),
+                    ('velocity_smooth', ('enhanced_speed', 'speed')), ('heartrate', ('heart_rate',)),
+                    ('cadence', ('cadence',)), ('watts', ('power',)), ('temp', ('temperature',)),
+                ):
+                    for field in fields:
+                        value = frame.get_value(field, fallback=None)
+                        if value is not None:
+                            p[channel] = float(value)
+                            break
+                points.append(p)
+
+    kind = FIT_SPORTS.get(str(sport)) if sport is not None else None
+    if kind == 'Ride' and str(sub_sport) == 'virtual_activity':
+        kind = 'VirtualRide'
+    return kind, points, offset
+
+# ------------------------------------------------------------------------------------------
+# Points -> stream buffers + Strava-shaped summary
+
+def _haversine_cumulative(lat, lng):
+    lat1, lat2 = np.radians(lat[:-1]), np.radians(lat[1:])
+    dlat, dlng = lat2 - lat1, np.radians(lng[1:] - lng[:-1])
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlng / 2) ** 2
+    steps = 2 * 6371000 * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+    return np.concatenate([[0.0], np.cumsum(steps)])
+
+def build_streams(points):
+    """Equal-length NumPy channels; a channel exists only if some point carried it."""
+    start = points[0]['time']
+    streams = {'time': np.array([(p['time'] - start).total_seconds() for p in points], dtype=np.int64)}
+
+    for channel in ('altitude', 'distance', 'velocity_smooth', 'heartrate', 'cadence', 'watts', 'temp'):
+        if any(channel in p for p in points):
+            values = np.array([p.get(channel, np.nan) for p in points], dtype=np.float64)
+            # Sensor dropouts: carry the last reading forward
+            if np.isnan(values).any():
+                idx = np.where(~np.isnan(values), np.arange(len(values)), 0)
+                np.maximum.accumulate(idx, out=idx)
+                values = np.nan_to_num(values[idx])
+            streams[channel] = values
+
+    if any('lat' in p for p in points):
+        latlng = np.array([(p.get('lat', np.nan), p.get('lng', np.nan)) for p in points], dtype=np.float64)
+        valid = ~np.isnan(latlng[:, 0])
+        if valid.any():
+            idx = np.where(valid, np.arange(len(latlng)), np.argmax(valid))
+            np.maximum.accumulate(idx, out=idx)
+            streams['latlng'] = latlng[idx]
+
+    if 'distance' not in streams and 'latlng' in streams:
+        streams['distance'] = _haversine_cumulative(streams['latlng'][:, 0], streams['latlng'][:, 1])
+    if 'velocity_smooth' not in streams and 'distance' in streams and len(points) > 1:
+        step_t = np.diff(streams['time']).astype(np.float64)
+        step_d = np.diff(streams['distance'])
+        speed = np.where(step_t > 0, step_d / np.maximum(step_t, 1), 0.0)
+        streams['velocity_smooth'] = np.clip(np.concatenate([[0.0], speed]), 0, None)
+
+    for channel in ('heartrate', 'cadence', 'watts', 'temp'):
+        if channel in streams:
+            streams[channel] = np.rint(streams[channel]).astype(np.int64)
+    return streams
+
+def summarize(streams):
+    t = streams['time']
+    dt = np.diff(t, prepend=t[0])
+    if 'velocity_smooth' in streams:
+        moving = streams['velocity_smooth'] > 0.5
+    elif 'watts' in streams or 'cadence' in streams:
+        moving = (streams.get('watts', np.zeros(len(t))) > 0) | (streams.get('cadence', np.zeros(len(t))) > 0)
+    else:
+        moving = np.ones(len(t), dtype=bool)
+    moving &= dt <= 30  # pauses are not moving time
+    streams['moving'] = moving
+
+    moving_time = int(dt[moving].sum())
+    distance = float(streams['distance'][-1]) if 'distance' in streams else 0.0
+    summary = {
+        'distance': round(distance, 1),
+        'moving_time': moving_time,
+        'elapsed_time': int(t[-1]),
+        'average_speed': round(distance / moving_time, 3) if moving_time else 0,
+        'max_speed': round(float(streams['velocity_smooth'].max()), 3) if 'velocity_smooth' in streams else None,
+        'total_elevation_gain': None,
+        'device_watts': 'watts' in streams,
+    }
+    if 'altitude' in streams and len(t) > 5:
+        smooth = np.convolve(streams['altitude'], np.ones(5) / 5, mode='valid')
+        summary['total_elevation_gain'] = round(float(np.clip(np.diff(smooth), 0, None).sum()), 1)
+    if 'watts' in streams:
+        w = streams['watts']
+        summary.update({
+            'average_watts': round(float(w[moving].mean()), 1) if moving.any() else 0,
+            'max_watts': int(w.max()),
+            'kilojoules': round(float((w * np.minimum(dt, 30)).sum()) / 1000, 1),
+        })
+    for channel, prefix in (('heartrate', 'heartrate'), ('cadence', 'cadence')):
+        if channel in streams:
+            v = streams[channel]
+            nonzero = v[v > 0]
+            summary[f'average_{prefix}'] = round(float(nonzero.mean()), 1) if len(nonzero) else None
+            if channel == 'heartrate':
+                summary['max_heartrate'] = int(v.max())
+    return summary
+
+def parse_archive_file(athlete_id, filename, data, meta):
+    """Worker entry point: one file -> (activity dict, streams dict) or (None, reason)."""
+    try:
+        if filename.endswith('.gz'):
+            data = gzip.decompress(data)
+            filename = filename[:-3]
+        ext = os.path.splitext(filename)[1].lower()
+
+        if ext == '.fit':
+            try:
+                import fitdecode  # noqa: F401
+            except ImportError:
+                return None, 'fit-unsupported'
+            sport, points, offset = parse_fit(data)
+        elif ext == '.gpx':
+            sport, points, offset = parse_gpx(data)
+        else:
+            sport, points, offset = parse_tcx(data.strip())
+
+        if len(points) < 2:
+            return None, 'empty'
+
+        streams = build_streams(points)
+        summary = summarize(streams)
+
+        start_utc = points[0]['time'].astimezone(timezone.utc)
+        if offset is not None:
+            start_local = start_utc.replace(tzinfo=None) + timedelta(seconds=offset)
+        else:
+            start_local = start_utc.astimezone(ZoneInfo(IMPORT_TIMEZONE)).replace(tzinfo=None)
+
+        activity_id = meta.get('id') or -int(hashlib.sha1(f"{athlete_id}:{int(start_utc.timestamp())}".encode()).hexdigest()[:15], 16)
+        kind = meta.get('type') or sport or 'Workout'
+
+        summary_polyline = None
+        if 'latlng' in streams:
+            import polyline
+            step = max(1, len(streams['latlng']) // 500)
+            summary_polyline = polyline.encode([tuple(p) for p in streams['latlng'][::step].round(5)])
+
+        activity = {
+            'id': activity_id, 'resource_state': 3, 'athlete': {'id': athlete_id},
+            'name': meta.get('name') or f"Imported {kind}", 'type': kind, 'sport_type': kind,
+            'start_date': start_utc.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'start_date_local': start_local.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'timezone': IMPORT_TIMEZONE, 'trainer': kind == 'VirtualRide', 'manual': False,
+            'device_name': 'Archive import', 'map': {'summary_polyline': summary_polyline},
+            'external_id': os.path.basename(filename),
+            **summary,
+        }
+        return activity, {k: {'data': v} for k, v in streams.items()}
+    except Exception as e:
+        return None, f"error: {e}"
+
+# ------------------------------------------------------------------------------------------
+# Archive walking and bulk writes (main process)
+
+def _strava_metadata(zf):
+    """activities.csv of a Strava export: filename -> id, name, type."""
+    names = [n for n in zf.namelist() if n.endswith('activities.csv')]
+    if not names:
+        return {}
+    meta = {}
+    with zf.open(names[0]) as f:
+        for row in csv.DictReader(io.TextIOWrapper(f, encoding='utf-8')):
+            filename = (row.get('Filename') or '').strip()
+            if not filename:
+                continue
+            meta[os.path.basename(filename)] = {
+                'id': int(row['Activity ID']) if row.get('Activity ID', '').isdigit() else None,
+                'name': row.get('Activity Name'),
+                'type': (row.get('Activity Type') or '').replace(' ', '') or None,
+            }
+    return meta
+
+def iter_archive_files(zf):
+    """(filename, bytes) for every supported file, descending into nested zips (Garmin)."""
+    for name in zf.namelist():
+        lower = name.lower()
+        if lower.endswith('.zip'):
+            with zipfile.ZipFile(io.BytesIO(zf.read(name))) as inner:
+                yield from iter_archive_files(inner)
+        elif lower.removesuffix('.gz').endswith(SUPPORTED):
+            yield os.path.basename(name), zf.read(name)
+
+def _known_starts(athlete_id):
+    from core.database import run_query
+    rows = run_query("SELECT strava_id, start_date_local FROM activities WHERE athlete_id = %s", (athlete_id,))
+    ids = {r['strava_id'] for r in rows}
+    minutes = set()
+    for r in rows:
+        if r['start_date_local']:
+            m = int(r['start_date_local'].timestamp() // 60)
+            minutes.update((m - 2, m - 1, m, m + 1, m + 2))
+    return ids, minutes
+
+def _flush(athlete_id, activities, streams):
+    from core.database import get_db_connection, save_db_activities, save_db_encoded_streams, encode_activity_stream
+    conn = get_db_connection()
+    try:
+        save_db_activities(conn, athlete_id, activities)
+        save_db_encoded_streams(conn, [
+            encode_activity_stream(a['id'], s, sorted(s)) for a, s in zip(activities, streams)
+        ])
+    finally:
+        conn.close()
+
+def import_archive(athlete_id, path, workers=IMPORT_WORKERS):
+    """Imports every activity file of an export archive. Returns the number of activities stored."""
+    from core.database import invalidate_analytics_from_date
+    from core.crawl_analytics import sync_local_analytics
+    from core.run_locks import athlete_run_lock
+
+    with athlete_run_lock(athlete_id, 'sync') as acquired:
+        if not acquired:
+            print(f"🔒 A sync for {athlete_id} is running, try the import again later.")
+            return 0
+
+        started = time.monotonic()
+        known_ids, known_minutes = _known_starts(athlete_id)
+        skipped = {}
+        stored, oldest = 0, None
+        batch_activities, batch_streams = [], []
+
+        with zipfile.ZipFile(path) as zf, ProcessPoolExecutor(max_workers=workers) as pool:
+            meta = _strava_metadata(zf)
+            print(f"📦 {os.path.basename(path)}: {len(meta)} activities listed, parsing with {workers} workers...")
+
+            pending = []
+
+            def collect(future):
+                nonlocal stored, oldest
+                activity, streams = future.result()
+                if activity is None:
+                    skipped[streams] = skipped.get(streams, 0) + 1
+                    return
+                minute = int(datetime.fromisoformat(activity['start_date_local'].rstrip('Z')).timestamp() // 60)
+                if activity['id'] in known_ids or minute in known_minutes:
+                    skipped['already in DB'] = skipped.get('already in DB', 0) + 1
+                    return
+                known_ids.add(activity['id'])
+                known_minutes.update((minute - 2, minute - 1, minute, minute + 1, minute + 2))
+
+                batch_activities.append(activity)
+                batch_streams.append(streams)
+                if oldest is None or activity['start_date_local'] < oldest:
+                    oldest = activity['start_date_local']
+                if len(batch_activities) >= IMPORT_BATCH_SIZE:
+                    _flush(athlete_id, batch_activities, batch_streams)
+                    stored += len(batch_activities)
+                    print(f"\t💾 {stored} activities stored ({time.monotonic() - started:.0f}s)")
+                    batch_activities.clear()
+                    batch_streams.clear()
+
+            for filename, data in iter_archive_files(zf):
+                pending.append(pool.submit(parse_archive_file, athlete_id, filename, data, meta.get(filename, {})))
+                # Bounded in-flight work: the archive is never fully in memory
+                if len(pending) >= workers * 4:
+                    collect(pending.pop(0))
+            for future in pending:
+                collect(future)
+
+        if batch_activities:
+            _flush(athlete_id, batch_activities, batch_streams)
+            stored += len(batch_activities)
+
+        print(f"✅ Stored {stored} activities in {time.monotonic() - started:.0f}s. Skipped: {skipped or 'none'}")
+        if skipped.get('fit-unsupported'):
+            print("\tℹ️ Install 'fitdecode' to import FIT files.")
+
+        if stored:
+            # One chronological ripple over everything imported
+            invalidate_analytics_from_date(athlete_id, oldest.replace('T', ' ').rstrip('Z'))
+            sync_local_analytics(batch_size_per_user=stored + config.ANALYTICS_RECALC_SIZE, target_athlete_id=athlete_id)
+            print(f"🚩 Analytics recalculated from {oldest[:10]}.")
+
+        return stored
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python -m core.archive_import <athlete_id> <export.zip> [workers]")
+        sys.exit(1)
+
+    print(f"\n{'='*60}")
+    print(f"Archive Import Started: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    import_archive(int(sys.argv[1]), sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else IMPORT_WORKERS)
+
+    print(f"Archive Import Finished: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"{'='*60}\n")
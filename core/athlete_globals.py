@@ -0,0 +1,114 @@
+# core/athlete_globals.py
+
+# Per-athlete cache of the values every template needs (name, FTP, last activity, counts), plus
+# users.data_version, the key of core/response_cache.py.
+# Entries live until something touches the athlete:
+#   - the DB triggers on activities / activity_streams / users NOTIFY 'athlete_globals' with the
+#     athlete id, so syncs in the scheduler or webhook workers reach the web processes too
+#   - routes that change the athlete call invalidate_athlete_globals() so the redirect is fresh
+# While the listener is down the cache is bypassed, so a lost connection never serves stale data.
+
+import select, threading, time
+from core.database import run_query, get_db_connection
+from core.queries import SQL_ATHLETE_GLOBALS
+import config
+
+GLOBALS_CACHE_MAX_AGE = getattr(config, 'GLOBALS_CACHE_MAX_AGE', 3600)  # safety net only
+GLOBALS_CHANNEL = 'athlete_globals'
+
+_cache = {}         # athlete_id -> (loaded_at, values)
+_generation = {}    # athlete_id -> invalidation counter (a load racing an invalidation is dropped)
+_lock = threading.Lock()
+_listener = None
+_listening = threading.Event()
+
+def invalidate_athlete_globals(athlete_id=None):
+    """Drops one athlete's entry, or all of them."""
+    with _lock:
+        if athlete_id is None:
+            _cache.clear()
+            for key in _generation:
+                _generation[key] += 1
+        else:
+            _cache.pop(athlete_id, None)
+            _generation[athlete_id] = _generation.get(athlete_id, 0) + 1
+
+def _listen_loop():
+    while True:
+        conn = None
+        try:
+            conn = get_db_connection()
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {GLOBALS_CHANNEL};")
+            # Anything cached before the LISTEN may have missed a notification
+            invalidate_athlete_globals()
+            _listening.set()
+
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    note = conn.notifies.pop(0)
+                    try:
+                        invalidate_athlete_globals(int(note.payload))
+                    except ValueError:
+                        invalidate_athlete_globals()
+        except Exception as e:
+            _listening.clear()
+            invalidate_athlete_globals()
+            print(f"⚠️ athlete_globals listener lost ({e}), reconnecting...")
+            time.sleep(5)
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+def _ensure_listener():
+    global _listener
+    if _listener is not None and _listener.is_alive():
+        return
+    with _lock:
+        if _listener is None or not _listener.is_alive():
+            _listener = threading.Thread(target=_listen_loop, name='athlete-globals-listener', daemon=True)
+            _listener.start()
+
+def _load(athlete_id):
+    res = run_query(SQL_ATHLETE_GLOBALS, (athlete_id,))
+    if not res:
+        return {'name': "Athlete", 'ftp': 200, 'last_activity_id': None, 'activity_count': 0, 'stream_count': 0,
+                'data_version': None}
+    row = res[0]
+    return {
+        'name': row['firstname'],
+        # Priority: Manual -> Detected -> Default
+        'ftp': row.get('manual_ftp') or row.get('detected_ftp') or 200,
+        'last_activity_id': row['last_activity_id'],
+        'activity_count': row['activity_count'] or 0,
+        'stream_count': row['stream_count'] or 0,
+        'data_version': row['data_version'],
+    }
+
+def get_athlete_globals(athlete_id):
+    """Cached template globals for an athlete (one query on a miss)."""
+    _ensure_listener()
+
+    if _listening.is_set():
+        with _lock:
+            cached = _cache.get(athlete_id)
+            generation = _generation.get(athlete_id, 0)
+        if cached and time.monotonic() - cached[0] < GLOBALS_CACHE_MAX_AGE:
+            return dict(cached[1])
+    else:
+        generation = None
+
+    values = _load(athlete_id)
+
+    if generation is not None and _listening.is_set():
+        with _lock:
+            if _generation.get(athlete_id, 0) == generation:
+                _cache[athlete_id] = (time.monotonic(), values)
+    return dict(values)
@@ -0,0 +1,137 @@
+# core/chart_streams.py
+
+# Chart-ready streams for the activity page (GET /api/activity/<id>/streams).
+# The page used to inline every raw series and smooth/downsample them in the browser. Here each
+# channel is smoothed like the chart did (trailing mean) and reduced with Largest-Triangle-
+# Three-Buckets, which keeps the peaks that a plain every-nth-sample pick drops.
+#   - requests snap up to one of STREAM_RESOLUTIONS, so a handful of variants per activity exist
+#   - variants are cached in-process, keyed by activity_streams.updated_at (a re-sync is a new key)
+#   - the response is columnar per channel: {"t": [...seconds], "v": [...values]}
+
+import threading
+import numpy as np
+from cachetools import LRUCache
+from core.database import run_query
+import config
+
+STREAM_RESOLUTIONS = getattr(config, 'STREAM_RESOLUTIONS', (300, 1200, 4000))
+STREAM_CACHE_SIZE = getattr(config, 'STREAM_CACHE_SIZE', 256)
+
+# channel -> (activity_streams column, trailing smoothing window in samples, decimals)
+CHART_CHANNELS = {
+    'watts':           ('watts_series', 30, 0),
+    'heartrate':       ('heartrate_series', 3, 0),
+    'cadence':         ('cadence_series', 30, 0),
+    'altitude':        ('altitude_series', 0, 1),
+    'velocity_smooth': ('velocity_series', 5, 2),
+    'distance':        ('distance_series', 0, 0),
+    'temp':            ('temp_series', 0, 0),
+}
+DEFAULT_CHANNELS = ('watts', 'heartrate', 'cadence', 'altitude')
+
+_cache = LRUCache(maxsize=STREAM_CACHE_SIZE)  # (strava_id, updated_at, resolution, channel) -> dict
+_cache_lock = threading.Lock()
+
+def snap_resolution(points):
+    """Smallest precomputed resolution that covers the requested number of points."""
+    for r in STREAM_RESOLUTIONS:
+        if points <= r:
+            return r
+    return STREAM_RESOLUTIONS[-1]
+
+def smooth(values, window):
+    """Trailing mean over the current and previous `window` samples (the old chart's smoothData)."""
+    if window <= 0 or len(values) == 0:
+        return values
+    csum = np.concatenate([[0.0], np.cumsum(values)])
+    idx = np.arange(1, len(values) + 1)
+    start = np.maximum(idx - window - 1, 0)
+    return (csum[idx] - csum[start]) / (idx - start)
+
+def lttb_indices(x, y, n):
+    """Indices of the n points Largest-Triangle-Three-Buckets keeps (first and last always)."""
+    size = len(x)
+    if n >= size or n < 3:
+        return np.arange(size)
+
+    edges = np.linspace(1, size - 1, n - 1).astype(np.int64)
+    out = np.empty(n, dtype=np.int64)
+    out[0], out[-1] = 0, size - 1
+
+    a = 0
+    for i in range(n - 2):
+        start, end = edges[i], edges[i + 1]
+        if i < n - 3:
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = size - 1, size
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        ax, ay = x[a], y[a]
+        area = np.abs((ax - avg_x) * (y[start:end] - ay) - (ax - x[start:end]) * (avg_y - ay))
+        a = start + int(area.argmax())
+        out[i + 1] = a
+    return out
+
+def downsample_channel(time_series, values, channel, points):
+    """One channel smoothed and LTTB-reduced to at most `points` samples."""
+    _, window, decimals = CHART_CHANNELS[channel]
+    n = min(len(time_series), len(values))
+    x = np.asarray(time_series[:n], dtype=np.float64)
+    y = np.nan_to_num(np.array(values[:n], dtype=np.float64))  # NULL samples -> 0
+    y = smooth(y, window)
+
+    keep = lttb_indices(x, y, points)
+    v = np.round(y[keep], decimals)
+    return {
+        't': x[keep].astype(np.int64).tolist(),
+        'v': (v.astype(np.int64) if decimals == 0 else v).tolist(),
+    }
+
+def get_chart_streams(strava_id, athlete_id, points=1200, channels=DEFAULT_CHANNELS):
+    """
+    Returns {'strava_id', 'points', 'length', 'version', 'channels': {name: {'t', 'v'}}},
+    or None if the activity has no streams or is not the athlete's. Unknown or missing channels
+    are left out.
+    """
+    resolution = snap_resolution(points)
+    channels = [c for c in channels if c in CHART_CHANNELS]
+
+    meta = run_query("""
+        SELECT s.updated_at, array_length(s.time_series, 1) as length
+        FROM activity_streams s JOIN activities a ON a.strava_id = s.strava_id
+        WHERE s.strava_id = %s AND a.athlete_id = %s
+    """, (strava_id, athlete_id))
+    if not meta:
+        return None
+    version = meta[0]['updated_at'].isoformat() if meta[0]['updated_at'] else '0'
+
+    result, missing = {}, []
+    with _cache_lock:
+        for c in channels:
+            hit = _cache.get((strava_id, version, resolution, c))
+            if hit is not None:
+                result[c] = hit
+            else:
+                missing.append(c)
+
+    if missing:
+        columns = ", ".join(CHART_CHANNELS[c][0] for c in missing)
+        rows = run_query(f"SELECT time_series, {columns} FROM activity_streams WHERE strava_id = %s", (strava_id,))
+        row = rows[0] if rows else {}
+        time_series = row.get('time_series') or []
+        for c in missing:
+            values = row.get(CHART_CHANNELS[c][0])
+            data = downsample_channel(time_series, values, c, resolution) if values and time_series else None
+            with _cache_lock:
+                _cache[(strava_id, version, resolution, c)] = data or {}
+            result[c] = data or {}
+
+    return {
+        'strava_id': strava_id,
+        'points': resolution,
+        'length': meta[0]['length'] or 0,
+        'version': version,
+        'channels': {c: d for c, d in result.items() if d},
+    }
@@ -0,0 +1,107 @@
+# core/circuit_breaker.py
+
+# Retry policy and per-endpoint circuit breaker for Strava calls (used by strava_api.strava_request).
+#   - transient failures (timeouts, 5xx, 429) are retried with exponential backoff + full jitter,
+#     honouring Retry-After when Strava sends one
+#   - BREAKER_FAILURE_THRESHOLD consecutive failures open the endpoint's breaker for
+#     BREAKER_OPEN_SECONDS; after that a single worker probes it (half_open) and either closes it
+#     or opens it again. A probe without a verdict (429) is released back to open, and one whose
+#     worker died is taken over after BREAKER_PROBE_TIMEOUT, so half_open never sticks
+# Breaker state lives in api_breakers, so the web app, webhook workers and the scheduler all
+# stop hammering Strava together. Trips and recoveries are counted there for the admin page.
+
+import random, time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from core.database import run_query, run_query_returning
+from core.queries import (SQL_GET_API_BREAKER, SQL_API_BREAKER_PROBE, SQL_API_BREAKER_RELEASE_PROBE,
+                          SQL_API_BREAKER_FAILURE, SQL_API_BREAKER_SUCCESS)
+from core.api_dispatcher import StravaLaneBlocked, current_lane
+import config
+
+STRAVA_MAX_RETRIES = getattr(config, 'STRAVA_MAX_RETRIES', 3)
+STRAVA_BACKOFF_BASE = getattr(config, 'STRAVA_BACKOFF_BASE', 2)
+STRAVA_BACKOFF_MAX = getattr(config, 'STRAVA_BACKOFF_MAX', 60)
+BREAKER_FAILURE_THRESHOLD = getattr(config, 'BREAKER_FAILURE_THRESHOLD', 5)
+BREAKER_OPEN_SECONDS = getattr(config, 'BREAKER_OPEN_SECONDS', 120)
+BREAKER_PROBE_TIMEOUT = getattr(config, 'BREAKER_PROBE_TIMEOUT', 300)  # longer than any single call
+BREAKER_CACHE_SECONDS = getattr(config, 'BREAKER_CACHE_SECONDS', 5)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# endpoint -> (checked_at, state, consecutive_failures)
+_breaker_cache = {}
+
+class StravaCircuitOpen(StravaLaneBlocked):
+    """The endpoint's breaker is open. Handled like a blocked lane: batch jobs stop, webhooks wait."""
+
+    def __init__(self, endpoint):
+        super().__init__(current_lane(), f"circuit open for '{endpoint}'")
+        self.endpoint = endpoint
+
+def backoff_delay(attempt):
+    """Full jitter: uniform in [0, min(max, base * 2^attempt)]."""
+    return random.uniform(0, min(STRAVA_BACKOFF_MAX, STRAVA_BACKOFF_BASE * (2 ** attempt)))
+
+def retry_after_seconds(res):
+    """Seconds from a Retry-After header (delta or HTTP date), or None."""
+    value = res.headers.get('Retry-After') if res is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def check_breaker(endpoint):
+    """
+    Raises StravaCircuitOpen unless a call to this endpoint may go out now. Returns True when
+    this call is the half-open probe: the caller must then report record_success, record_failure
+    or release_probe.
+    """
+    cached = _breaker_cache.get(endpoint)
+    if cached and time.monotonic() - cached[0] < BREAKER_CACHE_SECONDS and cached[1] == 'closed':
+        return False
+
+    row = run_query(SQL_GET_API_BREAKER, (BREAKER_PROBE_TIMEOUT, endpoint))
+    row = row[0] if row else {'state': 'closed', 'consecutive_failures': 0, 'probe_due': False}
+    _breaker_cache[endpoint] = (time.monotonic(), row['state'], row['consecutive_failures'])
+
+    if row['state'] == 'closed':
+        return False
+    if row['probe_due'] and run_query_returning(SQL_API_BREAKER_PROBE, {'endpoint': endpoint, 'probe_timeout': BREAKER_PROBE_TIMEOUT}):
+        print(f"\t🔌 Breaker '{endpoint}': half-open, probing Strava.")
+        return True
+    raise StravaCircuitOpen(endpoint)
+
+def release_probe(endpoint):
+    """The probe ended without a verdict: reopen the breaker so the next call probes again."""
+    _breaker_cache.pop(endpoint, None)
+    try:
+        run_query(SQL_API_BREAKER_RELEASE_PROBE, (endpoint,))
+    except Exception as e:
+        print(f"\t⚠️ Failed to release breaker probe for {endpoint}: {e}")
+
+def record_success(endpoint):
+    cached = _breaker_cache.get(endpoint)
+    if cached and cached[1] == 'closed' and not cached[2]:
+        return
+    _breaker_cache.pop(endpoint, None)
+    if run_query_returning(SQL_API_BREAKER_SUCCESS, (endpoint,)) and cached and cached[1] != 'closed':
+        print(f"\t🔌 Breaker '{endpoint}': recovered, closed.")
+
+def record_failure(endpoint, error):
+    _breaker_cache.pop(endpoint, None)
+    try:
+        rows = run_query_returning(SQL_API_BREAKER_FAILURE, {
+            'endpoint': endpoint, 'error': str(error)[:500],
+            'threshold': BREAKER_FAILURE_THRESHOLD, 'open_seconds': BREAKER_OPEN_SECONDS,
+        })
+        if rows and rows[0]['state'] == 'open':
+            print(f"\t🔌 Breaker '{endpoint}': open for {BREAKER_OPEN_SECONDS}s (trip #{rows[0]['trips']}).")
+    except Exception as e:
+        print(f"\t⚠️ Failed to record breaker failure for {endpoint}: {e}")
@@ -11,6 +11,8 @@ from core.database import get_db_connection, get_db_all_athletes, run_query
 from core.processor import process_activity_metrics
 from core.analysis import sync_daily_fitness
 from core.queries import SQL_RECALC_QUEUE
+from core.work_leases import claim_analytics_lease, renew_analytics_lease, release_analytics_lease
+from core.run_locks import athlete_run_lock, defer_run
 from config import ANALYTICS_RECALC_SIZE
 
 
@@ -18,6 +20,7 @@ def sync_local_analytics(batch_size_per_user = 50, target_athlete_id=None, prior
     """
     Loop through users, and recalculate all analytics that needs recalc up to given batch size.
     Strictly in chronological order.
+    Each athlete is locked and leased to one worker at a time; busy athletes are deferred.
     """
 
     athletes = [{'athlete_id': target_athlete_id, 'firstname': 'Targeted'}] if target_athlete_id else get_db_all_athletes()
@@ -30,41 +33,56 @@ def sync_local_analytics(batch_size_per_user = 50, target_athlete_id=None, prior
         a_id = athlete['athlete_id']
         name = athlete['firstname']
 
-        to_process = run_query(SQL_RECALC_QUEUE, (a_id, batch_size_per_user, priority_sid))
+        with athlete_run_lock(a_id, 'analytics') as acquired:
+            if not acquired:
+                # Nothing is lost: the needs_recalculation flags stay set for the re-run
+                defer_run(a_id, 'analytics', 'sync_local_analytics')
+                continue
+
+            if not claim_analytics_lease(a_id):
+                print(f"\t🔒 {name} ({a_id}): Analytics leased by another worker, skipping.")
+                continue
 
-        # 1. Process pending activities if they exist
-        if to_process:
-            print(f"\t🔄  {name} ({a_id}): Recomputing {len(to_process)} activities...")
-            processed = 0
-            first_date_in_batch = None
             try:
-                for row in to_process:
-                    sid = row['strava_id']
-                    ride_date = row['start_date_local']
-                    success = process_activity_metrics(sid, force=True)
-                    if success:
-                        run_query("UPDATE activities SET needs_recalculation = FALSE WHERE strava_id = %s", (sid,))
-                        processed += 1
-                        if not first_date_in_batch or ride_date < first_date_in_batch:
-                            first_date_in_batch = ride_date
+                to_process = run_query(SQL_RECALC_QUEUE, (a_id, batch_size_per_user, priority_sid))
+
+                # 1. Process pending activities if they exist
+                if to_process:
+                    print(f"\t🔄  {name} ({a_id}): Recomputing {len(to_process)} activities...")
+                    processed = 0
+                    first_date_in_batch = None
+                    try:
+                        for row in to_process:
+                            sid = row['strava_id']
+                            ride_date = row['start_date_local']
+                            success = process_activity_metrics(sid, force=True)
+                            if success:
+                                run_query("UPDATE activities SET needs_recalculation = FALSE WHERE strava_id = %s", (sid,))
+                                renew_analytics_lease(a_id)
+                                processed += 1
+                                if not first_date_in_batch or ride_date < first_date_in_batch:
+                                    first_date_in_batch = ride_date
                 
-                if processed > 0 and first_date_in_batch:
-                    sync_daily_fitness(a_id, first_date_in_batch)
-                    print(f"\t✨ Completed syncing fitness from {first_date_in_batch.date()} ...")
-            except Exception as user_err:
-                print(f"  ⚠️ Error processing {name}: {user_err}")
-        else:
-            print(f"\t{name} ({a_id}): Analytics are up to date.")
-
-        # 2. ALWAYS refresh the last 3 days to ensure "Today" exists in the ledger
-        try:
-            fitness_refresh_history = datetime.now() - timedelta(days=3)
-            sync_daily_fitness(a_id, fitness_refresh_history.date())
+                        if processed > 0 and first_date_in_batch:
+                            sync_daily_fitness(a_id, first_date_in_batch)
+                            print(f"\t✨ Completed syncing fitness from {first_date_in_batch.date()} ...")
+                    except Exception as user_err:
+                        print(f"  ⚠️ Error processing {name}: {user_err}")
+                else:
+                    print(f"\t{name} ({a_id}): Analytics are up to date.")
+
+                # 2. ALWAYS refresh the last 3 days to ensure "Today" exists in the ledger
+                try:
+                    fitness_refresh_history = datetime.now() - timedelta(days=3)
+                    sync_daily_fitness(a_id, fitness_refresh_history.date())
             
-            # turning off logging here: maybe move this to run only once per day later ...
-            #print(f"\t{name} ({a_id}) fitness data refreshed up to today.")
-        except Exception as e:
-            print(f"  ⚠️ Error marching fitness for {name}: {e}")
+                    # turning off logging here: maybe move this to run only once per day later ...
+                    #print(f"\t{name} ({a_id}) fitness data refreshed up to today.")
+                except Exception as e:
+                    print(f"  ⚠️ Error marching fitness for {name}: {e}")
+
+            finally:
+                release_analytics_lease(a_id)
 
 
 if __name__ == "__main__":
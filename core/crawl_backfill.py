@@ -1,21 +1,29 @@
 # core/crawl_backfill.py
 
-# cron setup: 
+# cron setup (legacy, superseded by the resident scheduler in core/scheduler.py): 
 # 0,30 * * * * cd /home/ubuntu/apps/cycling_stats && ./venv/bin/python3 -u -m core.crawl_backfill >> logs/crawler_log.log 2>&1
 
 import time, sys, os
 from datetime import datetime, timedelta
 from psycopg2.extras import RealDictCursor
 from core.database import get_db_connection, get_db_all_athletes, run_query, save_db_activities
-from core.strava_api import get_valid_access_token, fetch_activities_list
+from core.strava_api import get_valid_access_token, fetch_activities_pages
 from run_sync import sync_single_activity
-from core.queries import SQL_CRAWLER_BACKLOG
+from core.work_leases import claim_crawler_backlog, release_crawler_leases
+from core.run_locks import athlete_run_lock, defer_run
+from core.api_dispatcher import api_lane, StravaLaneBlocked
 from config import CRAWL_BACKFILL_SIZE, CRAWL_HISTORY_DAYS, ANALYTICS_RECALC_SIZE
+import config
 
-def crawl_backfill(batch_size_per_user=3, history_days=365, sleep_time=1):
+HISTORY_PAGES_PER_RUN = getattr(config, 'HISTORY_PAGES_PER_RUN', 10)
+
+@api_lane('backfill')
+def crawl_backfill(batch_size_per_user=3, history_days=365, sleep_time=1, target_athlete_id=None):
     """
     Cycles through ALL users in the DB and backfills a few historical 
     cycling activities for each, respecting a 1-year hard stop.
+    Athletes with another sync running are deferred (see core/run_locks.py).
+    Runs in the 'backfill' API lane and stops when the lane runs out of budget.
     """
 
     # 1. Hard Stop: Only process rides from the last 365 days
@@ -23,6 +31,8 @@ def crawl_backfill(batch_size_per_user=3, history_days=365, sleep_time=1):
 
     # 2. Get all athletes currently in our system
     athletes = get_db_all_athletes()
+    if target_athlete_id:
+        athletes = [a for a in athletes if a['athlete_id'] == target_athlete_id]
 
     if not athletes:
         print("∅ No users found in database.")
@@ -34,65 +44,93 @@ def crawl_backfill(batch_size_per_user=3, history_days=365, sleep_time=1):
         a_id = athlete['athlete_id']
         name = athlete['firstname']
 
-        # ===============================================================================================================
-        # 1. Fetch all activity summaries from history (Run only if not already completed):
-        history_done = athlete.get('history_summaries_synced', False)
-        if not history_done:
-            res = run_query("SELECT MIN(start_date_local) as oldest FROM activities WHERE athlete_id = %s", (a_id,))
-            db_oldest = res[0]['oldest'] if res and res[0]['oldest'] else None
-
-            if db_oldest:
-                print(f"\t📜 {name}: Oldest activity is {db_oldest.date()}. Fetching older summaries...")
-                conn = get_db_connection()
-                try:
-                    tokens_dict = get_valid_access_token(conn, a_id)
-                    before_ts = int(db_oldest.timestamp()) - 3600*9
-                    older_summaries = fetch_activities_list(tokens_dict['access_token'], {"before": before_ts, "per_page": 200})
-                    
-                    if older_summaries:
-
-                        rows_inserted = save_db_activities(conn, a_id, older_summaries)
-                        print(f"\t✅ Added {len(older_summaries)} historical summaries.")
-
-                    else:
-                        # No more activities found on Strava -> We are finished forever.
-                        print(f"\t🏁 Reached end of Strava history for {name}. Marking as synced.")
-                        run_query("UPDATE users SET history_summaries_synced = TRUE WHERE athlete_id = %s", (a_id,))
-                finally:
-                    conn.close()
-        # ===============================================================================================================
-
-        to_process = run_query(SQL_CRAWLER_BACKLOG, (a_id, max_look_back_date, batch_size_per_user))
-
-        if not to_process:
-            print(f"\t✅ {name} ({a_id}): Fully caught up.")
-            continue
+        with athlete_run_lock(a_id, 'sync') as acquired:
+            if not acquired:
+                defer_run(a_id, 'sync', 'crawl_backfill')
+                continue
+
+            # ===============================================================================================================
+            # 1. Fetch all activity summaries from history (Run only if not already completed):
+            #    several pages per run, resuming from the per-athlete cursor (oldest UTC start seen)
+            history_done = athlete.get('history_summaries_synced', False)
+            if not history_done:
+                before_ts = athlete.get('history_cursor')
+                if not before_ts:
+                    res = run_query("SELECT MIN(start_date_local) as oldest FROM activities WHERE athlete_id = %s", (a_id,))
+                    db_oldest = res[0]['oldest'] if res and res[0]['oldest'] else None
+                    # start_date_local is local time: step back 9h so no timezone can skip a ride
+                    before_ts = int(db_oldest.timestamp()) - 3600*9 if db_oldest else None
+
+                if before_ts:
+                    print(f"\t📜 {name}: Fetching summaries before {datetime.fromtimestamp(before_ts).date()} ({HISTORY_PAGES_PER_RUN} pages max)...")
+                    conn = get_db_connection()
+                    try:
+                        tokens_dict = get_valid_access_token(conn, a_id)
+                        older_summaries, reached_end = fetch_activities_pages(
+                            tokens_dict['access_token'], {"before": before_ts}, max_pages=HISTORY_PAGES_PER_RUN
+                        )
+
+                        if older_summaries:
+                            save_db_activities(conn, a_id, older_summaries)
+                            cursor = min(
+                                int(datetime.fromisoformat(a['start_date'].replace('Z', '+00:00')).timestamp())
+                                for a in older_summaries
+                            )
+                            run_query("UPDATE users SET history_cursor = %s WHERE athlete_id = %s", (cursor, a_id))
+                            print(f"\t✅ Added {len(older_summaries)} historical summaries.")
+
+                        if reached_end:
+                            # No more activities found on Strava -> We are finished forever.
+                            print(f"\t🏁 Reached end of Strava history for {name}. Marking as synced.")
+                            run_query("UPDATE users SET history_summaries_synced = TRUE WHERE athlete_id = %s", (a_id,))
+                    finally:
+                        conn.close()
+            # ===============================================================================================================
+
+            # Leased, so a parallel crawler gets the next rows instead of the same ones
+            to_process = claim_crawler_backlog(a_id, max_look_back_date, batch_size_per_user)
+
+            if not to_process:
+                print(f"\t✅ {name} ({a_id}): Fully caught up.")
+                continue
         
-        latest_date = to_process[-1]['start_date_local']
-        date_str = latest_date.strftime('%Y-%m-%d') if hasattr(latest_date, 'strftime') else str(latest_date)
-        print(f"\n🔄 {name} ({a_id}): Syncing {len(to_process)} activities (starting from {date_str})...")
+            latest_date = to_process[-1]['start_date_local']
+            date_str = latest_date.strftime('%Y-%m-%d') if hasattr(latest_date, 'strftime') else str(latest_date)
+            print(f"\n🔄 {name} ({a_id}): Syncing {len(to_process)} activities (starting from {date_str})...")
 
-        # 4. Process the batch for this user
-        try:
-            oldest_date = to_process[-1]['start_date_local']
+            # 4. Process the batch for this user
+            try:
+                # Only activities whose content changed move the analytics ripple start
+                changed_dates = []
 
-            for row in to_process:
-                s_id = row['strava_id']
+                for row in to_process:
+                    s_id = row['strava_id']
                 
-                sync_single_activity(a_id, s_id, run_analytics=False)
-                time.sleep(sleep_time)
+                    if sync_single_activity(a_id, s_id, run_analytics=False):
+                        changed_dates.append(row['start_date_local'])
+                    time.sleep(sleep_time)
+
+                oldest_date = min(changed_dates) if changed_dates else None
+                if not oldest_date:
+                    print(f"\t⏭️ {name} ({a_id}): no content changes in this batch, analytics untouched.")
             
-            if oldest_date:
-                safety_date = (oldest_date - timedelta(days=1)).strftime('%Y-%m-%d')
-                from core.database import invalidate_analytics_from_date
-                invalidate_analytics_from_date(a_id, safety_date)
-                print(f"\n\t🚩Invalidated analytics for {name} ({a_id}) from {safety_date} forward.")
+                if oldest_date:
+                    safety_date = (oldest_date - timedelta(days=1)).strftime('%Y-%m-%d')
+                    from core.database import invalidate_analytics_from_date
+                    invalidate_analytics_from_date(a_id, safety_date)
+                    print(f"\n\t🚩Invalidated analytics for {name} ({a_id}) from {safety_date} forward.")
 
-                from core.crawl_analytics import sync_local_analytics
-                sync_local_analytics(batch_size_per_user=ANALYTICS_RECALC_SIZE,target_athlete_id=a_id)
+                    from core.crawl_analytics import sync_local_analytics
+                    sync_local_analytics(batch_size_per_user=ANALYTICS_RECALC_SIZE,target_athlete_id=a_id)
 
-        except Exception as user_err:
-            print(f"⚠️ Error processing {name}: {user_err}")
+            except StravaLaneBlocked as blocked:
+                # Higher lanes need the budget: stop the whole run, the next one resumes
+                print(f"⏸️ Backfill stopped at {name}: {blocked}")
+                return
+            except Exception as user_err:
+                print(f"⚠️ Error processing {name}: {user_err}")
+            finally:
+                release_crawler_leases([row['strava_id'] for row in to_process])
 
 
 if __name__ == "__main__":
@@ -106,6 +144,10 @@ if __name__ == "__main__":
         batch_size_per_user = CRAWL_BACKFILL_SIZE, 
         history_days = history_days
         )
+
+    # Re-run whatever lost a lock since the last crawl
+    from core.run_locks import drain_run_deferrals
+    drain_run_deferrals()
     
     print(f"Crawl Backfill Finished: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"{'='*60}\n")
\ No newline at end of file
@@ -1,6 +1,6 @@
 # core/database.py
 
-import psycopg2
+import psycopg2, hashlib, json, threading
 from psycopg2.extras import execute_batch, Json
 from datetime import datetime
 from zoneinfo import ZoneInfo
@@ -33,7 +33,88 @@ register_adapter(np.int64, adapt_numpy_int64)
 register_adapter(np.float32, adapt_numpy_float64)
 register_adapter(np.int32, adapt_numpy_int64)
 
+def adapt_numpy_array(arr):
+    """1-D stream buffers (core/stream_parser.py) as a Postgres array literal, without a list of numbers."""
+    values = np.ma.getdata(arr)
+    if values.dtype == bool:
+        text = np.where(values, 't', 'f')
+        nulls = np.ma.getmaskarray(arr)
+    else:
+        text = values.astype(str)
+        nulls = np.ma.getmaskarray(arr) | (np.isnan(values) if values.dtype.kind == 'f' else False)
+    if nulls.any():
+        text = np.where(nulls, 'NULL', text)
+    return AsIs("'{" + ",".join(text.tolist()) + "}'")
+
+register_adapter(np.ndarray, adapt_numpy_array)
+register_adapter(np.ma.MaskedArray, adapt_numpy_array)
+
+# Optional connection pool, enabled by long-running processes (core/scheduler.py).
+# Short-lived scripts and the web app keep opening one connection per call.
+# ThreadedConnectionPool.getconn() raises PoolError when exhausted instead of blocking, so a
+# semaphore sized to the pool makes callers wait (up to DB_POOL_WAIT seconds) for a free slot.
+DB_POOL_WAIT = getattr(config, 'DB_POOL_WAIT', 30)
+
+_pool = None
+_pool_slots = None
+
+class PooledConnection:
+    """Thin proxy around a pooled connection: close() hands it back to the pool."""
+
+    def __init__(self, pool, conn):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_returned', False)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def close(self):
+        if self._returned:
+            return
+        object.__setattr__(self, '_returned', True)
+        conn = self._conn
+        try:
+            if conn.closed:
+                self._pool.putconn(conn, close=True)
+                return
+            if conn.autocommit:
+                conn.autocommit = False
+            else:
+                conn.rollback()
+            self._pool.putconn(conn)
+        finally:
+            _pool_slots.release()
+
+def enable_connection_pool(minconn=1, maxconn=10):
+    global _pool, _pool_slots
+    if _pool is None:
+        from psycopg2.pool import ThreadedConnectionPool
+        _pool = ThreadedConnectionPool(
+            minconn, maxconn,
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASS,
+            host=DB_HOST,
+            port=DB_PORT
+        )
+        _pool_slots = threading.BoundedSemaphore(maxconn)
+    return _pool
+
 def get_db_connection():
+    if _pool is not None:
+        if not _pool_slots.acquire(timeout=DB_POOL_WAIT):
+            from psycopg2.pool import PoolError
+            raise PoolError(f"no pooled connection free after {DB_POOL_WAIT}s")
+        try:
+            return PooledConnection(_pool, _pool.getconn())
+        except Exception:
+            _pool_slots.release()
+            raise
+
     return psycopg2.connect(
         dbname=DB_NAME,
         user=DB_USER,
@@ -81,6 +162,41 @@ def run_query(query, params=None):
     finally:
         conn.close()
 
+def run_query_returning(query, params=None):
+    """Executor for writes with a RETURNING clause: fetches the rows and commits."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(query, params)
+            rows = cur.fetchall()
+        conn.commit()
+        return rows
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        conn.close()
+
+def stream_query(query, params=None, itersize=2000):
+    """
+    Yields the rows of a SELECT one by one from a server-side (named) cursor, fetching
+    `itersize` at a time, so large exports never hold the full result in memory.
+    The connection is released when the generator is exhausted or closed.
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor(name=f"stream_{id(conn):x}", cursor_factory=RealDictCursor) as cur:
+            cur.itersize = itersize
+            cur.execute(query, params)
+            for row in cur:
+                yield row
+        conn.rollback()  # read-only transaction opened for the named cursor
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        conn.close()
+
 def get_db_zone_for_value(category, value):
     """
     Fetches the zone name, description, and color for a specific metric value.
@@ -117,6 +233,15 @@ def get_db_user_tokens(conn, athlete_id):
         )
         return cur.fetchone()
 
+def lock_db_user_tokens(conn, athlete_id):
+    """Re-reads the tokens under a row lock held until the caller commits (single-flight refresh)."""
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT access_token, refresh_token, expires_at FROM users WHERE athlete_id = %s FOR UPDATE",
+            (athlete_id,)
+        )
+        return cur.fetchone()
+
 def save_db_user_tokens(conn, athlete_id, tokens):
     """Updates only the token-related fields for an existing user."""
     with conn.cursor() as cur:
@@ -182,6 +307,31 @@ def save_db_user_profile(conn, athlete_data, tokens):
     conn.commit()
     return is_insert
 
+# Fields that change the streams or anything derived from them. Present in both list
+# summaries and the detail payload, so the hash is comparable across the two.
+FINGERPRINT_FIELDS = (
+    'type', 'sport_type', 'start_date', 'distance', 'moving_time', 'elapsed_time',
+    'total_elevation_gain', 'average_watts', 'max_watts', 'weighted_average_watts',
+    'kilojoules', 'average_heartrate', 'max_heartrate', 'average_cadence',
+    'device_watts', 'trainer', 'manual'
+)
+
+def activity_fingerprint(a):
+    """Content hash of a Strava activity payload; name, description, gear, kudos are ignored."""
+    material = {k: a.get(k) for k in FINGERPRINT_FIELDS}
+    material['polyline'] = (a.get('map') or {}).get('summary_polyline') or None
+    return hashlib.sha1(json.dumps(material, sort_keys=True, default=str).encode()).hexdigest()
+
+def get_db_activity_state(conn, strava_id):
+    """Stored fingerprint and stream status of an activity, or None if it is not in the DB."""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT a.content_fingerprint, a.streams_missing,
+                   EXISTS (SELECT 1 FROM activity_streams s WHERE s.strava_id = a.strava_id) AS has_streams
+            FROM activities a WHERE a.strava_id = %s
+        """, (strava_id,))
+        return cur.fetchone()
+
 def save_db_activities(conn, athlete_id, activities):
     insert_sql = """
         INSERT INTO activities (
@@ -192,17 +342,9 @@ def save_db_activities(conn, athlete_id, activities):
             max_heartrate, average_cadence, suffer_score,
             achievement_count, kudos_count, map_polyline, device_name, 
             device_watts, raw_json, resource_state,
-            summary_polyline, min_lat, max_lat, min_lng, max_lng
-        ) VALUES (
-            %(id)s, %(athlete_id)s, %(name)s, %(type)s, %(start_date)s,
-            %(dist)s, %(mov_t)s, %(ela_t)s, %(elev)s,
-            %(avg_s)s, %(max_s)s, %(avg_w)s, %(max_w)s,
-            %(weighted_w)s, %(kj)s, %(avg_hr)s,
-            %(max_hr)s, %(avg_cad)s, %(suffer)s,
-            %(achieve)s, %(kudos)s, %(poly)s, %(device)s, 
-            %(device_watts)s, %(raw)s, %(res_state)s,
-            %(sum_poly)s, %(mi_lat)s, %(ma_lat)s, %(mi_lng)s, %(ma_lng)s
-        ) 
+            summary_polyline, min_lat, max_lat, min_lng, max_lng,
+            content_fingerprint
+        ) VALUES %s
         ON CONFLICT (strava_id) DO UPDATE SET
             name = EXCLUDED.name, 
             type = EXCLUDED.type,
@@ -223,7 +365,7 @@ def save_db_activities(conn, athlete_id, activities):
             suffer_score = EXCLUDED.suffer_score,
             achievement_count = EXCLUDED.achievement_count,
             kudos_count = EXCLUDED.kudos_count,
-            map_polyline = EXCLUDED.map_polyline,
+            map_polyline = EXCLUDED.map_polyline, -- a changed track is swapped in the heatmap (core/heatmap.py)
             device_name = EXCLUDED.device_name, 
             device_watts = EXCLUDED.device_watts,
             raw_json = EXCLUDED.raw_json,
@@ -233,8 +375,25 @@ def save_db_activities(conn, athlete_id, activities):
             max_lat = EXCLUDED.max_lat,
             min_lng = EXCLUDED.min_lng, 
             max_lng = EXCLUDED.max_lng,
+            content_fingerprint = EXCLUDED.content_fingerprint,
             updated_at = NOW();
     """
+    # Row template for execute_values (one multi-row INSERT per page instead of one per activity)
+    insert_template = """(
+            %(id)s, %(athlete_id)s, %(name)s, %(type)s, %(start_date)s,
+            %(dist)s, %(mov_t)s, %(ela_t)s, %(elev)s,
+            %(avg_s)s, %(max_s)s, %(avg_w)s, %(max_w)s,
+            %(weighted_w)s, %(kj)s, %(avg_hr)s,
+            %(max_hr)s, %(avg_cad)s, %(suffer)s,
+            %(achieve)s, %(kudos)s, %(poly)s, %(device)s, 
+            %(device_watts)s, %(raw)s, %(res_state)s,
+            %(sum_poly)s, %(mi_lat)s, %(ma_lat)s, %(mi_lng)s, %(ma_lng)s,
+            %(fingerprint)s
+        )"""
+
+    # A single INSERT ... ON CONFLICT cannot touch the same row twice: keep the last copy per id
+    activities = list({a['id']: a for a in activities}.values())
+
     data = []
     for a in activities:
         # 1. Clean the original polyline ('' to None)
@@ -294,11 +453,12 @@ def save_db_activities(conn, athlete_id, activities):
             # The extra "Pirate" payload
             'sum_poly': sum_p, 
             'mi_lat': mi_lat, 'ma_lat': ma_lat, 
-            'mi_lng': mi_lng, 'ma_lng': ma_lng
+            'mi_lng': mi_lng, 'ma_lng': ma_lng,
+            'fingerprint': activity_fingerprint(a)
         })
 
     with conn.cursor() as cur:
-        execute_batch(cur, insert_sql, data)
+        execute_values(cur, insert_sql, data, template=insert_template, page_size=500)
 
         for a in activities:
             laps = a.get('laps')
@@ -356,44 +516,49 @@ def save_activity_laps(cur, strava_id, laps_json):
 
     execute_values(cur, insert_sql, lap_data)
 
-def save_db_activity_stream(conn, activity_id, streams_dict):
+SQL_UPSERT_ACTIVITY_STREAM = """
+    INSERT INTO activity_streams (
+        strava_id, time_series, distance_series, velocity_series, 
+        heartrate_series, cadence_series, watts_series, 
+        temp_series, moving_series, latlng_series, altitude_series, stream_keys, updated_at
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
+    ON CONFLICT(strava_id) DO UPDATE SET
+        time_series=EXCLUDED.time_series,
+        distance_series=EXCLUDED.distance_series,
+        velocity_series=EXCLUDED.velocity_series,
+        heartrate_series=EXCLUDED.heartrate_series,
+        cadence_series=EXCLUDED.cadence_series,
+        watts_series=EXCLUDED.watts_series,
+        temp_series=EXCLUDED.temp_series,
+        moving_series=EXCLUDED.moving_series,
+        latlng_series=EXCLUDED.latlng_series,
+        altitude_series=EXCLUDED.altitude_series,
+        stream_keys=EXCLUDED.stream_keys,
+        updated_at=NOW();
+"""
+
+def stream_channel_value(streams_dict, type_key):
+    """One channel of Strava's key_by_type streams, ready for its activity_streams column."""
+    data = streams_dict[type_key]['data'] if type_key in streams_dict and 'data' in streams_dict[type_key] else None
+    if type_key == 'latlng' and isinstance(data, np.ndarray):
+        # (n, 2) buffer from the streaming parser: JSON text built column-wise
+        if not len(data):
+            return None
+        pairs = np.char.add(np.char.add('[', data[:, 0].astype(str)), np.char.add(',', np.char.add(data[:, 1].astype(str), ']')))
+        return '[' + ','.join(pairs.tolist()) + ']'
+    if type_key == 'latlng':
+        return Json(data) if data else None
+    return data
+
+def encode_activity_stream(activity_id, streams_dict, stream_keys=None):
     """
-    Inserts stream data into activity_streams table.
-    Uses native Postgres arrays for series and Jsonb for latlng.
+    Turns Strava's key_by_type streams into the activity_streams row parameters.
+    stream_keys records which channels were requested (None = all of them).
     """
-    from psycopg2.extras import Json
-    
     def get_stream_data(type_key):
-        if type_key in streams_dict and 'data' in streams_dict[type_key]:
-            return streams_dict[type_key]['data']
-        return None
-
-    sql = """
-        INSERT INTO activity_streams (
-            strava_id, time_series, distance_series, velocity_series, 
-            heartrate_series, cadence_series, watts_series, 
-            temp_series, moving_series, latlng_series, altitude_series, updated_at
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
-        ON CONFLICT(strava_id) DO UPDATE SET
-            time_series=EXCLUDED.time_series,
-            distance_series=EXCLUDED.distance_series,
-            velocity_series=EXCLUDED.velocity_series,
-            heartrate_series=EXCLUDED.heartrate_series,
-            cadence_series=EXCLUDED.cadence_series,
-            watts_series=EXCLUDED.watts_series,
-            temp_series=EXCLUDED.temp_series,
-            moving_series=EXCLUDED.moving_series,
-            latlng_series=EXCLUDED.latlng_series,
-            altitude_series=EXCLUDED.altitude_series,
-            updated_at=NOW();
-    """
-    
-    latlng_raw = get_stream_data('latlng')
-    latlng_value = Json(latlng_raw) if latlng_raw else None
-
+        return stream_channel_value(streams_dict, type_key)
 
-
-    params = (
+    return (
         activity_id,
         get_stream_data('time'),
         get_stream_data('distance'),
@@ -403,14 +568,35 @@ def save_db_activity_stream(conn, activity_id, streams_dict):
         get_stream_data('watts'),
         get_stream_data('temp'),
         get_stream_data('moving'),
-        latlng_value,
-        get_stream_data('altitude') # This is the 11th param
+        get_stream_data('latlng'),
+        get_stream_data('altitude'), # This is the 11th param
+        stream_keys
     )
 
+def save_db_encoded_stream(conn, params):
+    """Writes one row prepared by encode_activity_stream."""
     with conn.cursor() as cur:
-        cur.execute(sql, params)
+        cur.execute(SQL_UPSERT_ACTIVITY_STREAM, params)
     conn.commit()
 
+def save_db_encoded_streams(conn, rows):
+    """Bulk version of save_db_encoded_stream (archive imports): one multi-row INSERT per page."""
+    if not rows:
+        return
+    sql = SQL_UPSERT_ACTIVITY_STREAM.replace(
+        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())", "VALUES %s"
+    )
+    with conn.cursor() as cur:
+        execute_values(cur, sql, rows, template="(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())", page_size=50)
+    conn.commit()
+
+def save_db_activity_stream(conn, activity_id, streams_dict, stream_keys=None):
+    """
+    Inserts stream data into activity_streams table.
+    Uses native Postgres arrays for series and Jsonb for latlng.
+    """
+    save_db_encoded_stream(conn, encode_activity_stream(activity_id, streams_dict, stream_keys))
+
 def save_db_daily_tss(athlete_id, ride_date):
     """
     Standalone helper to ensure the daily ledger reflects the SUM of TSS 
@@ -442,6 +628,7 @@ def update_user_manual_settings(athlete_id, ftp=None, max_hr=None, weight=None,
             SET manual_ftp = NULL, 
                 manual_max_hr = NULL, 
                 manual_ftp_updated_at = NULL,
+                data_version = data_version + 1,
                 updated_at = NOW()
             WHERE athlete_id = %s
         """
@@ -455,6 +642,7 @@ def update_user_manual_settings(athlete_id, ftp=None, max_hr=None, weight=None,
             weight = COALESCE(%s, weight),
             manual_ftp_updated_at = CASE WHEN %s IS NOT NULL THEN NOW() ELSE manual_ftp_updated_at END,
             manual_max_hr_updated_at = CASE WHEN %s IS NOT NULL THEN NOW() ELSE manual_max_hr_updated_at END, -- Added this
+            data_version = data_version + 1, -- cached pages (core/response_cache.py) depend on FTP / max HR
             updated_at = NOW()
         WHERE athlete_id = %s
     """
@@ -520,4 +708,41 @@ def get_athlete_ftp(athlete_id):
     if res:
         # Priority logic: Manual -> Detected -> Default
         return res[0].get('manual_ftp') or res[0].get('detected_ftp') or 200
-    return 200
\ No newline at end of file
+    return 200
+def save_db_webhook_event(event):
+    """
+    Persists a raw Strava webhook event. Idempotent on (object_id, aspect_type, event_time),
+    so Strava retries are stored only once.
+    Returns the new event id, or None if the event was already recorded.
+    """
+    from core.queries import SQL_INSERT_WEBHOOK_EVENT
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(SQL_INSERT_WEBHOOK_EVENT, (
+                event.get('object_id'),
+                event.get('object_type'),
+                event.get('aspect_type'),
+                event.get('owner_id'),
+                event.get('event_time'),
+                Json(event.get('updates') or {}),
+                Json(event)
+            ))
+            row = cur.fetchone()
+        conn.commit()
+        return row[0] if row else None
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        conn.close()
+
+def claim_db_webhook_events(activity_id, debounce_seconds):
+    """
+    Atomically moves the pending create/update events of an activity to 'processing',
+    but only if no new event arrived within the debounce window.
+    Returns the claimed rows (empty if the burst is still active or nothing is pending).
+    """
+    from core.queries import SQL_CLAIM_WEBHOOK_EVENTS
+    return run_query_returning(SQL_CLAIM_WEBHOOK_EVENTS, (activity_id, activity_id, debounce_seconds))
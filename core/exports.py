@@ -0,0 +1,92 @@
+# core/exports.py
+
+# Streaming export bodies (activities list, activity detail, /dump-raw).
+# Rows come from any iterable, normally core.database.stream_query (a server-side cursor),
+# and are encoded into ~EXPORT_CHUNK_BYTES chunks, so worker memory stays flat and the first
+# bytes leave before the query has finished, however many years are exported.
+#   - csv: header from the first row; ndjson: one object per line; json: one array, streamed
+#   - json/ndjson rows are encoded by the caller's `dumps` (the web app passes Flask's JSON
+#     provider, so dates and Decimals come out exactly as jsonify wrote them)
+#   - markdown: the /dump table (core/processor.py iter_markdown_lines)
+#   - gzip_chunks() wraps any of them for Content-Encoding: gzip
+
+import csv, io, json, zlib
+from core.processor import iter_markdown_lines
+import config
+
+EXPORT_CHUNK_BYTES = getattr(config, 'EXPORT_CHUNK_BYTES', 64 * 1024)
+EXPORT_GZIP = getattr(config, 'EXPORT_GZIP', True)
+EXPORT_GZIP_LEVEL = getattr(config, 'EXPORT_GZIP_LEVEL', 6)
+
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+    'markdown': 'text/plain',
+}
+
+def _json_line(row):
+    return json.dumps(row, default=str, separators=(',', ':'))  # used without a caller's dumps
+
+def _chunked(pieces):
+    """Joins small string pieces into utf-8 chunks of about EXPORT_CHUNK_BYTES."""
+    buf, size = [], 0
+    for piece in pieces:
+        buf.append(piece)
+        size += len(piece)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield "".join(buf).encode()
+            buf, size = [], 0
+    if buf:
+        yield "".join(buf).encode()
+
+def _csv_pieces(rows, dumps):
+    out = io.StringIO()
+    writer = None
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(out, fieldnames=row.keys())
+            writer.writeheader()
+        writer.writerow(row)
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
+
+def _ndjson_pieces(rows, dumps):
+    for row in rows:
+        yield dumps(row) + "\n"
+
+def _json_array_pieces(rows, dumps):
+    yield "["
+    first = True
+    for row in rows:
+        yield ("" if first else ",") + dumps(row)
+        first = False
+    yield "]"
+
+def _markdown_pieces(rows, dumps):
+    for line in iter_markdown_lines(rows):
+        yield line + "\n"
+
+_ENCODERS = {
+    'csv': _csv_pieces,
+    'ndjson': _ndjson_pieces,
+    'json': _json_array_pieces,
+    'markdown': _markdown_pieces,
+}
+
+def iter_export(rows, export_format, dumps=None):
+    """
+    Byte chunks of `rows` encoded as export_format (one of EXPORT_MIMETYPES). `dumps` encodes
+    one json/ndjson row (default: compact json.dumps, str() for dates and Decimals).
+    """
+    return _chunked(_ENCODERS[export_format](rows, dumps or _json_line))
+
+def gzip_chunks(chunks):
+    """Gzip-compresses a chunk stream incrementally (one member, flushed per output block)."""
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,281 @@
+# core/heatmap.py
+
+# Personal heatmap tiles (/tiles/heat/<z>/<x>/<y>, routes/map.py).
+# Every activity's map_polyline is rasterized once into per-tile density grids (visits per pixel,
+# a ride counts once per pixel) for zooms HEATMAP_MIN_ZOOM..HEATMAP_MAX_ZOOM, with NumPy doing the
+# projection, densification and accumulation. Grids live in the local tile cache:
+#   HEATMAP_DIR/<athlete_id>/<z>/<x>/<y>.npz   density grid (uint32, 256x256)
+#   HEATMAP_DIR/<athlete_id>/<z>/<x>/<y>.png   rendered tile, re-rendered when older than the grid
+# New activities (activities.heatmap_at IS NULL) only touch the tiles their track crosses.
+# activities.heatmap_polyline keeps the track that was counted, so a changed map_polyline (e.g. a
+# re-sync swapping the summary track for the detailed one) is subtracted and re-added in place.
+# Deleted activities cannot be subtracted (their track is gone), so a shrinking activity count
+# triggers a rebuild. Rasterizing runs in the scheduler's heatmap task, never in a web worker.
+# Leaflet upsamples past HEATMAP_MAX_ZOOM (maxNativeZoom).
+#   ./venv/bin/python3 -u -m core.heatmap <athlete_id> [--rebuild]
+
+import io, json, os, shutil, sys
+import numpy as np
+import polyline
+from core.database import run_query
+from core.run_locks import athlete_run_lock
+import config
+
+HEATMAP_DIR = getattr(config, 'HEATMAP_DIR', os.path.join(config.BASE_PATH, 'cache', 'heatmap'))
+HEATMAP_MIN_ZOOM = getattr(config, 'HEATMAP_MIN_ZOOM', 3)
+HEATMAP_MAX_ZOOM = getattr(config, 'HEATMAP_MAX_ZOOM', 14)
+HEATMAP_SATURATION = getattr(config, 'HEATMAP_SATURATION', 30)  # visits rendered at full colour
+HEATMAP_BATCH_SIZE = getattr(config, 'HEATMAP_BATCH_SIZE', 100)
+
+TILE = 256
+
+# New tracks, and counted tracks that changed since (heatmap_polyline is what the tiles hold)
+_PENDING_WHERE = """
+    athlete_id = %s AND type != 'VirtualRide'
+    AND ((heatmap_at IS NULL AND map_polyline IS NOT NULL AND map_polyline != '')
+      OR (heatmap_at IS NOT NULL AND heatmap_polyline IS DISTINCT FROM NULLIF(map_polyline, '')))
+"""
+
+SQL_HEATMAP_PENDING = f"""
+    SELECT strava_id, NULLIF(map_polyline, '') as map_polyline, heatmap_at IS NOT NULL as counted, heatmap_polyline
+    FROM activities
+    WHERE {_PENDING_WHERE}
+    ORDER BY start_date_local
+    LIMIT %s
+"""
+
+SQL_HEATMAP_PENDING_COUNT = f"SELECT COUNT(*) as pending FROM activities WHERE {_PENDING_WHERE}"
+
+SQL_HEATMAP_MARK_DONE = """
+    UPDATE activities a
+    SET heatmap_at = NOW(), heatmap_polyline = v.poly
+    FROM (SELECT unnest(%s::bigint[]) as strava_id, unnest(%s::text[]) as poly) v
+    WHERE a.strava_id = v.strava_id
+"""
+
+SQL_HEATMAP_RESET = "UPDATE activities SET heatmap_at = NULL, heatmap_polyline = NULL WHERE athlete_id = %s"
+
+# ------------------------------------------------------------------------------------------
+# Rasterization
+
+def project(coords, zoom):
+    """lat/lng pairs -> global Web Mercator pixel coordinates (float) at zoom."""
+    lat = np.radians(np.clip(coords[:, 0], -85.0511, 85.0511))
+    scale = TILE * (1 << zoom)
+    x = (coords[:, 1] + 180.0) / 360.0 * scale
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0 * scale
+    return x, y
+
+def densify(x, y):
+    """Inserts points so consecutive samples are at most one pixel apart (continuous lines)."""
+    if len(x) < 2:
+        return x, y
+    steps = np.maximum(np.ceil(np.hypot(np.diff(x), np.diff(y))).astype(np.int64), 1)
+    seg = np.repeat(np.arange(len(steps)), steps)
+    frac = (np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)) / np.repeat(steps, steps)
+    dx = np.append(x[seg] + (x[seg + 1] - x[seg]) * frac, x[-1])
+    dy = np.append(y[seg] + (y[seg + 1] - y[seg]) * frac, y[-1])
+    return dx, dy
+
+def track_pixels(encoded):
+    """
+    {zoom: unique global pixel keys} for one track. Densified once at the max zoom; lower zooms
+    are the same pixels shifted down, so they stay continuous.
+    """
+    coords = np.array(polyline.decode(encoded), dtype=np.float64)
+    if len(coords) < 2:
+        return {}
+    x, y = densify(*project(coords, HEATMAP_MAX_ZOOM))
+    px, py = x.astype(np.int64), y.astype(np.int64)
+
+    pixels = {}
+    for z in range(HEATMAP_MAX_ZOOM, HEATMAP_MIN_ZOOM - 1, -1):
+        shift = HEATMAP_MAX_ZOOM - z
+        qx, qy = px >> shift, py >> shift
+        pixels[z] = np.unique((qx << (z + 8)) | qy)
+    return pixels
+
+# ------------------------------------------------------------------------------------------
+# Tile cache
+
+def _athlete_dir(athlete_id):
+    return os.path.join(HEATMAP_DIR, str(int(athlete_id)))
+
+def tile_path(athlete_id, z, x, y, ext):
+    return os.path.join(_athlete_dir(athlete_id), str(z), str(x), f"{y}.{ext}")
+
+def _load_grid(path):
+    if os.path.exists(path):
+        with np.load(path) as f:
+            return f['grid']
+    return np.zeros((TILE, TILE), dtype=np.uint32)
+
+def _save_grid(path, grid):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez_compressed(f, grid=grid)
+    os.replace(tmp, path)  # the web app never reads a half-written grid
+
+def accumulate(athlete_id, pixel_sets, removed_sets=()):
+    """
+    Adds a batch of tracks ({zoom: keys} each) to the grids and subtracts removed_sets (tracks
+    counted before). Returns the number of tiles touched.
+    """
+    touched = 0
+    for z in range(HEATMAP_MIN_ZOOM, HEATMAP_MAX_ZOOM + 1):
+        added = [p[z] for p in pixel_sets if z in p]
+        removed = [p[z] for p in removed_sets if z in p]
+        if not added and not removed:
+            continue
+        keys = np.concatenate(added + removed)
+        weights = np.concatenate([np.ones(len(k), dtype=np.int64) for k in added]
+                                 + [-np.ones(len(k), dtype=np.int64) for k in removed])
+        mask = (1 << (z + 8)) - 1
+        gx, gy = keys >> (z + 8), keys & mask
+        tiles = ((gx >> 8) << 32) | (gy >> 8)
+
+        order = np.argsort(tiles, kind='stable')
+        tiles, gx, gy, weights = tiles[order], gx[order], gy[order], weights[order]
+        bounds = np.flatnonzero(np.diff(tiles)) + 1
+        for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(tiles)]):
+            tx, ty = int(tiles[start] >> 32), int(tiles[start] & 0xFFFFFFFF)
+            path = tile_path(athlete_id, z, tx, ty, 'npz')
+            grid = _load_grid(path).astype(np.int64)
+            np.add.at(grid, (gy[start:end] & 255, gx[start:end] & 255), weights[start:end])
+            _save_grid(path, np.clip(grid, 0, None).astype(np.uint32))
+            touched += 1
+    return touched
+
+def _read_meta(athlete_id):
+    try:
+        with open(os.path.join(_athlete_dir(athlete_id), 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'activities': 0}
+
+def _write_meta(athlete_id, meta):
+    os.makedirs(_athlete_dir(athlete_id), exist_ok=True)
+    path = os.path.join(_athlete_dir(athlete_id), 'meta.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(path + '.tmp', path)
+
+def rebuild_heatmap(athlete_id):
+    shutil.rmtree(_athlete_dir(athlete_id), ignore_errors=True)
+    run_query(SQL_HEATMAP_RESET, (athlete_id,))
+    return update_heatmap(athlete_id)
+
+def pending_heatmap_count(athlete_id):
+    res = run_query(SQL_HEATMAP_PENDING_COUNT, (athlete_id,))
+    return res[0]['pending'] if res else 0
+
+def _pixels(strava_id, encoded):
+    try:
+        return track_pixels(encoded) if encoded else {}
+    except Exception as e:
+        print(f"\t⚠️ Heatmap: polyline of {strava_id} skipped: {e}")
+        return {}
+
+def update_heatmap(athlete_id):
+    """
+    Rasterizes activities not yet in the heatmap and swaps changed tracks.
+    Returns how many activities were processed.
+    """
+    with athlete_run_lock(athlete_id, 'heatmap') as acquired:
+        if not acquired:
+            return 0
+
+        rasterized = run_query("SELECT COUNT(*) as n FROM activities WHERE athlete_id = %s AND heatmap_at IS NOT NULL", (athlete_id,))[0]['n']
+        meta = _read_meta(athlete_id)
+        if rasterized < meta['activities']:
+            print(f"\t🗺️ Heatmap {athlete_id}: activities were deleted, rebuilding.")
+            shutil.rmtree(_athlete_dir(athlete_id), ignore_errors=True)
+            run_query(SQL_HEATMAP_RESET, (athlete_id,))
+            rasterized = 0
+
+        added = 0
+        while True:
+            rows = run_query(SQL_HEATMAP_PENDING, (athlete_id, HEATMAP_BATCH_SIZE))
+            if not rows:
+                break
+
+            pixel_sets = [_pixels(r['strava_id'], r['map_polyline']) for r in rows]
+            removed_sets = [_pixels(r['strava_id'], r['heatmap_polyline']) for r in rows if r['counted']]
+            touched = accumulate(athlete_id, pixel_sets, removed_sets)
+
+            # Store the exact track that was counted, even if map_polyline moved on meanwhile
+            run_query(SQL_HEATMAP_MARK_DONE, ([r['strava_id'] for r in rows], [r['map_polyline'] for r in rows]))
+            new = sum(1 for r in rows if not r['counted'])
+            added += len(rows)
+            rasterized += new
+            _write_meta(athlete_id, {'activities': rasterized})
+            print(f"\t🗺️ Heatmap {athlete_id}: +{new} activities, {len(rows) - new} tracks replaced, {touched} tiles updated.")
+
+        if added == 0 and meta['activities'] != rasterized:
+            _write_meta(athlete_id, {'activities': rasterized})
+        return added
+
+# ------------------------------------------------------------------------------------------
+# Rendering
+
+def _colorize(grid):
+    """Density -> RGBA: log scale against HEATMAP_SATURATION, red -> yellow -> white."""
+    # Thicken 1-px lines a little so single rides stay visible
+    padded = np.pad(grid, 1)
+    thick = np.maximum.reduce([padded[1:-1, 1:-1], padded[:-2, 1:-1], padded[2:, 1:-1], padded[1:-1, :-2], padded[1:-1, 2:]])
+
+    v = np.clip(np.log1p(thick) / np.log1p(HEATMAP_SATURATION), 0, 1)
+    rgba = np.zeros((TILE, TILE, 4), dtype=np.uint8)
+    rgba[..., 0] = 255
+    rgba[..., 1] = (np.clip(v * 2, 0, 1) * 255).astype(np.uint8)
+    rgba[..., 2] = (np.clip(v * 2 - 1, 0, 1) * 255).astype(np.uint8)
+    rgba[..., 3] = np.where(thick > 0, 110 + v * 145, 0).astype(np.uint8)
+    return rgba
+
+def _encode_png(rgba):
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.fromarray(rgba, 'RGBA').save(buf, format='PNG', optimize=True)
+    return buf.getvalue()
+
+_EMPTY_PNG = None
+
+def empty_tile_png():
+    global _EMPTY_PNG
+    if _EMPTY_PNG is None:
+        _EMPTY_PNG = _encode_png(np.zeros((TILE, TILE, 4), dtype=np.uint8))
+    return _EMPTY_PNG
+
+def get_tile_png(athlete_id, z, x, y):
+    """PNG bytes for a tile (transparent outside the athlete's tracks), rendered on demand."""
+    if not HEATMAP_MIN_ZOOM <= z <= HEATMAP_MAX_ZOOM:
+        return empty_tile_png()
+
+    grid_path = tile_path(athlete_id, z, x, y, 'npz')
+    if not os.path.exists(grid_path):
+        return empty_tile_png()
+
+    png_path = tile_path(athlete_id, z, x, y, 'png')
+    if os.path.exists(png_path) and os.path.getmtime(png_path) >= os.path.getmtime(grid_path):
+        with open(png_path, 'rb') as f:
+            return f.read()
+
+    data = _encode_png(_colorize(_load_grid(grid_path)))
+    with open(png_path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(png_path + '.tmp', png_path)
+    return data
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m core.heatmap <athlete_id> [--rebuild]")
+        sys.exit(1)
+
+    a_id = int(sys.argv[1])
+    if '--rebuild' in sys.argv:
+        added = rebuild_heatmap(a_id)
+    else:
+        added = update_heatmap(a_id)
+    print(f"✅ Heatmap {a_id}: {added} activities rasterized.")
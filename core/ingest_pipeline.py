@@ -0,0 +1,252 @@
+# core/ingest_pipeline.py
+
+# Staged ingest: fetch -> parse -> store -> analyze, each stage with its own worker threads
+# and a bounded queue in front of it. HTTP waits (fetch) overlap with NumPy work (analyze),
+# and a slow stage fills its queue and blocks the one before it (backpressure) instead of
+# letting downloaded streams pile up in memory.
+#
+# Stage sizes (config): INGEST_STAGE_WORKERS = {'fetch': 2, 'parse': 1, 'store': 1, 'analyze': 1}
+#                       INGEST_QUEUE_SIZE = 8
+# Per-stage stats (items, failures, busy time, throughput, queue depth) are printed at the end
+# of every run, stored in ingest_stage_stats and summarized on the admin overview for tuning.
+
+import contextvars, queue, threading, time
+from datetime import datetime
+from psycopg2.extras import execute_values
+from core.database import get_db_connection
+from core.queries import SQL_SAVE_INGEST_STAGE_STATS
+import config
+
+INGEST_STAGE_WORKERS = getattr(config, 'INGEST_STAGE_WORKERS', {'fetch': 2, 'parse': 1, 'store': 1, 'analyze': 1})
+INGEST_QUEUE_SIZE = getattr(config, 'INGEST_QUEUE_SIZE', 8)
+
+_DONE = object()
+
+# name -> stats of the most recent run in this process
+last_pipeline_stats = {}
+
+class Stage:
+    """
+    One step of the pipeline. func(item, state) returns the item for the next stage,
+    or None to drop it. setup() runs once per worker thread and its result is passed
+    as state (e.g. a DB connection); teardown(state) runs when the worker exits.
+    Exceptions listed in halt_on stop the intake of new items.
+    """
+
+    def __init__(self, name, func, workers=None, setup=None, teardown=None, halt_on=()):
+        self.name = name
+        self.func = func
+        self.workers = workers or INGEST_STAGE_WORKERS.get(name, 1)
+        self.setup = setup
+        self.teardown = teardown
+        self.halt_on = halt_on
+
+        self.inbox = None
+        self.lock = threading.Lock()
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.max_depth = 0
+        self.depth_samples = 0
+        self.depth_total = 0
+
+    def observe_depth(self):
+        depth = self.inbox.qsize()
+        with self.lock:
+            self.max_depth = max(self.max_depth, depth)
+            self.depth_samples += 1
+            self.depth_total += depth
+
+    def stats(self, wall_seconds):
+        return {
+            'workers': self.workers,
+            'processed': self.processed,
+            'failed': self.failed,
+            'busy_s': round(self.busy_seconds, 2),
+            'per_s': round(self.processed / wall_seconds, 2) if wall_seconds > 0 else 0,
+            'utilization': round(self.busy_seconds / (wall_seconds * self.workers), 2) if wall_seconds > 0 else 0,
+            'max_queue': self.max_depth,
+            'avg_queue': round(self.depth_total / self.depth_samples, 1) if self.depth_samples else 0,
+        }
+
+class IngestPipeline:
+    def __init__(self, name, stages, queue_size=INGEST_QUEUE_SIZE):
+        self.name = name
+        self.stages = stages
+        self.queue_size = queue_size
+        self.halted = threading.Event()
+
+    def _drain_failed(self, stage):
+        """Consumes the inbox up to _DONE, counting every item as failed (worker without state)."""
+        while stage.inbox.get() is not _DONE:
+            with stage.lock:
+                stage.failed += 1
+
+    def _worker(self, index, stage, outbox, remaining):
+        state, ready = None, False
+        try:
+            try:
+                state = stage.setup() if stage.setup else None
+                ready = True
+            except Exception as e:
+                # Keep the queues moving so the _DONE handoff still happens and run() returns
+                print(f"\t⚠️ {self.name}/{stage.name} worker setup failed: {e}")
+                self._drain_failed(stage)
+                return
+
+            while True:
+                item = stage.inbox.get()
+                if item is _DONE:
+                    break
+                stage.observe_depth()
+
+                # After a halt, items already in flight are drained without work
+                if self.halted.is_set() and index == 0:
+                    continue
+
+                started = time.monotonic()
+                try:
+                    result = stage.func(item, state)
+                except stage.halt_on as e:
+                    print(f"\t⏸️ {self.name}/{stage.name}: {e}. Stopping intake.")
+                    self.halted.set()
+                    result = None
+                except Exception as e:
+                    print(f"\t⚠️ {self.name}/{stage.name} failed on {item!r:.60}: {e}")
+                    with stage.lock:
+                        stage.failed += 1
+                    result = None
+                else:
+                    with stage.lock:
+                        stage.processed += 1
+                finally:
+                    with stage.lock:
+                        stage.busy_seconds += time.monotonic() - started
+
+                if result is not None and outbox is not None:
+                    outbox.put(result)  # blocks while the next stage is behind
+        finally:
+            if stage.teardown and ready:
+                stage.teardown(state)
+            # The last worker of a stage closes the next stage's queue
+            with stage.lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and outbox is not None:
+                for _ in range(self.stages[index + 1].workers):
+                    outbox.put(_DONE)
+
+    def run(self, items):
+        """Feeds items through all stages and returns the per-stage stats."""
+        for stage in self.stages:
+            stage.inbox = queue.Queue(maxsize=self.queue_size)
+
+        threads = []
+        started = time.monotonic()
+        for index, stage in enumerate(self.stages):
+            outbox = self.stages[index + 1].inbox if index + 1 < len(self.stages) else None
+            remaining = [stage.workers]
+            for n in range(stage.workers):
+                # copy_context: workers inherit the caller's context (e.g. the Strava API lane)
+                ctx = contextvars.copy_context()
+                t = threading.Thread(
+                    target=ctx.run, args=(self._worker, index, stage, outbox, remaining),
+                    name=f"{self.name}-{stage.name}-{n}", daemon=True
+                )
+                t.start()
+                threads.append(t)
+
+        head = self.stages[0]
+        for item in items:
+            if self.halted.is_set():
+                break
+            head.inbox.put(item)
+        for _ in range(head.workers):
+            head.inbox.put(_DONE)
+
+        for t in threads:
+            t.join()
+
+        wall = time.monotonic() - started
+        stats = {stage.name: stage.stats(wall) for stage in self.stages}
+        last_pipeline_stats[self.name] = {'finished_at': datetime.now(), 'wall_s': round(wall, 2), 'stages': stats}
+        self.print_stats(wall, stats)
+        self.save_stats(wall, stats)
+        return stats
+
+    def save_stats(self, wall, stats):
+        rows = [
+            (self.name, name, position, s['workers'], s['processed'], s['failed'], s['busy_s'],
+             round(wall, 2), s['utilization'], s['max_queue'], s['avg_queue'])
+            for position, (name, s) in enumerate(stats.items())
+        ]
+        try:
+            conn = get_db_connection()
+            try:
+                with conn.cursor() as cur:
+                    execute_values(cur, SQL_SAVE_INGEST_STAGE_STATS, rows)
+                conn.commit()
+            finally:
+                conn.close()  # the pool rolls back an unfinished transaction
+        except Exception as e:
+            print(f"\t⚠️ Pipeline {self.name}: stats not saved: {e}")
+
+    def print_stats(self, wall, stats):
+        print(f"\t📦 Pipeline {self.name}: {wall:.1f}s")
+        for name, s in stats.items():
+            print(f"\t   {name:<8} x{s['workers']}  {s['processed']} ok / {s['failed']} failed, "
+                  f"{s['per_s']}/s, busy {int(s['utilization'] * 100)}%, "
+                  f"queue avg {s['avg_queue']} max {s['max_queue']}")
+
+def ingest_activity_streams(access_token, strava_ids, analyze=True):
+    """
+    Streams + metrics for a batch of activities through the staged pipeline.
+    Returns the ids whose streams were stored.
+    """
+    from core.database import get_db_connection, encode_activity_stream, save_db_encoded_stream, run_query
+    from core.strava_api import fetch_activity_streams
+    from core.api_dispatcher import StravaLaneBlocked
+    from core.processor import process_activity_metrics
+    from core.stream_profiles import stream_keys_for
+
+    stored = []
+
+    def fetch(strava_id, state):
+        res = run_query("""
+            SELECT a.type, s.strava_id IS NOT NULL AS has_streams
+            FROM activities a LEFT JOIN activity_streams s ON s.strava_id = a.strava_id
+            WHERE a.strava_id = %s
+        """, (strava_id,))
+        if res and res[0]['has_streams']:
+            # Already stored: still worth (re)computing its metrics
+            return (strava_id, None, None)
+        keys = stream_keys_for(res[0]['type'] if res else None)
+        streams = fetch_activity_streams(access_token, strava_id, keys=keys)
+        return (strava_id, streams, keys) if streams is not None else None
+
+    def parse(item, state):
+        strava_id, streams, keys = item
+        return (strava_id, encode_activity_stream(strava_id, streams, keys) if streams else None)
+
+    def store(item, conn):
+        strava_id, params = item
+        if params:
+            save_db_encoded_stream(conn, params)
+            stored.append(strava_id)
+        return strava_id
+
+    def analyze_metrics(strava_id, state):
+        process_activity_metrics(strava_id, force=True)
+        print(f"\t  ✨ Activity {strava_id}: Stream saved & Metrics calculated")
+        return strava_id
+
+    stages = [
+        Stage('fetch', fetch, halt_on=(StravaLaneBlocked,)),
+        Stage('parse', parse),
+        Stage('store', store, setup=get_db_connection, teardown=lambda conn: conn.close()),
+    ]
+    if analyze:
+        stages.append(Stage('analyze', analyze_metrics))
+
+    IngestPipeline('streams', stages).run(strava_ids)
+    return stored
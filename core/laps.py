@@ -1,5 +1,6 @@
 # core/laps.py
 from core.database import run_query
+from core.render_payload import invalidate_render_payload
 from datetime import datetime
 
 def merge_activity_laps(strava_id, lap_ids):
@@ -80,6 +81,7 @@ def merge_activity_laps(strava_id, lap_ids):
             WHERE strava_id = %s AND lap_id = ANY(%s)
         """, (strava_id, lap_ids))
 
+        invalidate_render_payload(strava_id)
         return True, "Laps merged successfully."
     except Exception as e:
         return False, f"Merge failed: {str(e)}"
@@ -89,6 +91,7 @@ def reset_activity_laps(strava_id):
     try:
         run_query("DELETE FROM activity_laps WHERE strava_id = %s AND is_manual = TRUE", (strava_id,))
         run_query("UPDATE activity_laps SET is_hidden = FALSE WHERE strava_id = %s", (strava_id,))
+        invalidate_render_payload(strava_id)
         return True, "Laps reset to original."
     except Exception as e:
         return False, str(e)
\ No newline at end of file
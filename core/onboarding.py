@@ -0,0 +1,105 @@
+# core/onboarding.py
+
+# Staged first sync for a new athlete, so the dashboard fills up in minutes instead of
+# after the whole stream backlog:
+#   1. summaries, page by page, bulk-saved as they arrive
+#   2. fitness ledger estimated from summary data         -> first_dashboard_at
+#   3. streams + analytics for the most recent rides       -> first_analytics_at
+#   4. everything else is left to the crawler backlog (core/scheduler.py / crawl_backfill)
+
+import time
+from datetime import datetime, timedelta
+from dateutil import parser
+from core.database import run_query, save_db_activities, invalidate_analytics_from_date
+from core.strava_api import fetch_activities_list, sync_activity_streams
+from core.analysis import sync_daily_fitness
+from core.api_dispatcher import api_lane, StravaLaneBlocked
+import config
+
+NEW_USER_PAGES_TO_FETCH = getattr(config, 'NEW_USER_PAGES_TO_FETCH', 5)
+# Falls back to the pre-onboarding setting so existing installs keep their stream count
+NEW_USER_PRIORITY_STREAMS = getattr(config, 'NEW_USER_PRIORITY_STREAMS', getattr(config, 'NEW_USER_STREAMS_LOAD_COUNT', 10))
+PER_PAGE = 200
+
+def mark_onboarding(athlete_id, column):
+    """Stamps an onboarding milestone once (first time wins)."""
+    run_query(
+        f"UPDATE users SET {column} = COALESCE({column}, NOW()) WHERE athlete_id = %s",
+        (athlete_id,)
+    )
+
+def load_summaries(conn, token, athlete_id):
+    """Stage 1: list pages, each saved immediately so the dashboard is usable after page 1."""
+    loaded = []
+    for page in range(1, NEW_USER_PAGES_TO_FETCH + 1):
+        print(f"\t  Fetching page {page}...")
+        page_data = fetch_activities_list(token, {"page": page, "per_page": PER_PAGE})
+        if not page_data:
+            break
+
+        save_db_activities(conn, athlete_id, page_data)
+        loaded.extend(page_data)
+
+        # A short page is the last one, skip the extra empty request
+        if len(page_data) < PER_PAGE:
+            break
+
+    return loaded
+
+@api_lane('onboarding')
+def onboard_new_athlete(conn, athlete_id, token):
+    """Runs the staged pipeline. Returns the number of summaries loaded."""
+    from core.crawl_analytics import sync_local_analytics
+
+    mark_onboarding(athlete_id, 'onboarding_started_at')
+    print(f"\t🚀 New user, fetching last {NEW_USER_PAGES_TO_FETCH} pages (up to {NEW_USER_PAGES_TO_FETCH * PER_PAGE} activities)")
+
+    # 1. Summaries
+    activities = load_summaries(conn, token, athlete_id)
+    if not activities:
+        print("\t∅ No activities on Strava yet.")
+        mark_onboarding(athlete_id, 'first_dashboard_at')
+        return 0
+    print(f"\t✅ Loaded {len(activities)} activity summaries.")
+
+    # 2. Early fitness ledger from summaries (refined later by the analytics ripple)
+    oldest = min(parser.parse(a['start_date_local']).replace(tzinfo=None) for a in activities)
+    days = sync_daily_fitness(athlete_id, oldest.strftime('%Y-%m-%d'), estimate_missing=True)
+    mark_onboarding(athlete_id, 'first_dashboard_at')
+    print(f"\t📈 Estimated fitness ledger for {days} days from summaries.")
+
+    # 3. Streams for the most recent rides first
+    stabilization_cutoff = datetime.now() - timedelta(days=90)
+    recent = [
+        a for a in activities
+        if parser.parse(a['start_date_local']).replace(tzinfo=None) >= stabilization_cutoff
+    ]
+    recent.sort(key=lambda x: x['start_date_local'], reverse=True)
+    priority = recent[:NEW_USER_PRIORITY_STREAMS]
+
+    if priority:
+        print(f"\t🧬 Fetching streams for the {len(priority)} most recent of {len(recent)} activities in 90d...")
+        for activity in priority:
+            strava_id = activity['id']
+            try:
+                sync_activity_streams(conn, athlete_id, strava_id)
+                time.sleep(1)
+            except StravaLaneBlocked as blocked:
+                print(f"\t  ⏸️ {blocked}. Leaving the rest to the crawler.")
+                break
+            except Exception as stream_error:
+                print(f"\t  ⚠️ Could not sync streams for {strava_id}: {stream_error}")
+
+        # Analytics must run chronologically: invalidate from the oldest priority ride and ripple forward
+        earliest_date = min(a['start_date_local'] for a in priority)
+        invalidate_analytics_from_date(athlete_id, earliest_date)
+        sync_local_analytics(batch_size_per_user=config.ANALYTICS_RECALC_SIZE, target_athlete_id=athlete_id)
+        mark_onboarding(athlete_id, 'first_analytics_at')
+        print(f"\t🚩 Ripple effect finished for priority batch.")
+
+    # 4. The rest has no streams yet and sits in the crawler backlog
+    remaining = len(recent) - len(priority)
+    if remaining > 0:
+        print(f"\t🕵️ {remaining} more recent activities queued for the background crawler.")
+
+    return len(activities)
@@ -0,0 +1,55 @@
+# core/power_envelope.py
+
+# Rolling best-power envelope per athlete (athlete_power_envelope): best watts, holder activity
+# and its date for every curve duration within the last ENVELOPE_MONTHS.
+#   - every analytics write merges the ride's curve in; only durations it beats are touched
+#   - a full rebuild happens only when a holder ages out of the window, is deleted (FK sets
+#     strava_id NULL) or its recomputed curve drops below the stored record
+# Reads are one row per duration instead of a scan of a year of power_curve JSONB.
+
+from datetime import datetime, timedelta
+from core.database import run_query
+from core.queries import (
+    SQL_POWER_ENVELOPE_REBUILD, SQL_POWER_ENVELOPE_MERGE,
+    SQL_POWER_ENVELOPE_LOST_RECORDS, SQL_POWER_ENVELOPE_READ
+)
+import config
+
+ENVELOPE_MONTHS = getattr(config, 'ENVELOPE_MONTHS', 12)
+
+def envelope_since(months=ENVELOPE_MONTHS):
+    """Window start, same 30-day months as get_best_power_curve always used."""
+    return (datetime.now() - timedelta(days=months * 30)).strftime('%Y-%m-%d')
+
+def rebuild_power_envelope(athlete_id):
+    """Full recomputation from activity_analytics (the only scan left)."""
+    run_query(SQL_POWER_ENVELOPE_REBUILD, {'athlete_id': athlete_id, 'since': envelope_since()})
+
+def merge_activity_into_envelope(athlete_id, strava_id):
+    """
+    Called after a ride's analytics are written. Not-yet-built envelopes are left alone:
+    the first read builds them in full.
+    """
+    built = run_query("SELECT power_envelope_at FROM users WHERE athlete_id = %s", (athlete_id,))
+    if not built or built[0]['power_envelope_at'] is None:
+        return
+
+    # A re-processed record holder may have lost a record to a ride we no longer know about
+    if run_query(SQL_POWER_ENVELOPE_LOST_RECORDS, {'strava_id': strava_id}):
+        rebuild_power_envelope(athlete_id)
+        return
+
+    run_query(SQL_POWER_ENVELOPE_MERGE, {'strava_id': strava_id, 'since': envelope_since()})
+
+def get_power_envelope(athlete_id):
+    """{duration: watts} over the rolling window, rebuilt first if a holder expired or vanished."""
+    params = {'athlete_id': athlete_id, 'since': envelope_since()}
+    res = run_query(SQL_POWER_ENVELOPE_READ, params)
+    if not res:
+        return {}
+
+    if res[0]['stale']:
+        rebuild_power_envelope(athlete_id)
+        res = run_query(SQL_POWER_ENVELOPE_READ, params)
+
+    return {int(d): p for d, p in (res[0]['curve'] or {}).items()}
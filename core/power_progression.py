@@ -0,0 +1,139 @@
+# core/power_progression.py
+
+# Power progression series of the performance page (get_performance_summary in core/analysis.py).
+#   - one query returns every ride's 5s..60m values together (SQL_POWER_PROGRESSION) instead of
+#     one JSONB scan per interval
+#   - the rows are cached per athlete and kept current incrementally: when users.data_version
+#     moves (core/athlete_globals.py), only rides whose activity or analytics changed since the
+#     last load are fetched and merged; a lower row count (deleted ride or analytics) reloads in full
+#   - the 30-day seasonal record is a sliding-window maximum over a monotonic deque, O(n)
+#     per interval instead of a backwards scan per ride
+
+import calendar, threading
+from collections import deque
+from datetime import datetime, timedelta
+from cachetools import LRUCache
+from core.database import run_query
+from core.queries import SQL_POWER_PROGRESSION
+import config
+
+PROGRESSION_CACHE_SIZE = getattr(config, 'PROGRESSION_CACHE_SIZE', 64)
+SEASONAL_WINDOW_DAYS = 30
+
+# chart label -> column of SQL_POWER_PROGRESSION (power_curve key in seconds)
+PROGRESSION_INTERVALS = {
+    '5s': 'p5',
+    '1m': 'p60',
+    '5m': 'p300',
+    '10m': 'p600',
+    '20m': 'p1200',
+    '60m': 'p3600',
+}
+
+_cache = LRUCache(maxsize=PROGRESSION_CACHE_SIZE)  # athlete_id -> {'version', 'since', 'rows'}
+_lock = threading.Lock()
+
+def _fetch(athlete_id, since=None):
+    res = run_query(SQL_POWER_PROGRESSION, {'athlete_id': athlete_id, 'since': since})
+    total = res[0]['total'] if res else 0
+    return total, [r for r in res if r['strava_id'] is not None]
+
+def _merge(rows, changed):
+    for r in changed:
+        rows[r['strava_id']] = {
+            'date': r['date'],
+            'name': r['activity_name'],
+            'ftp': r['baseline_ftp'] or 0,
+            'updated_at': r['updated_at'],
+            **{col: r[col] for col in PROGRESSION_INTERVALS.values()},
+        }
+
+def get_progression_rows(athlete_id):
+    """
+    {strava_id: row} of all the athlete's rides with a power curve, full history, served from the
+    cache while the athlete's data version is unchanged.
+    """
+    from core.athlete_globals import get_athlete_globals
+    version = get_athlete_globals(athlete_id).get('data_version')
+
+    with _lock:
+        entry = _cache.get(athlete_id)
+    if entry and version is not None and entry['version'] == version:
+        return entry['rows']
+
+    if entry:
+        total, changed = _fetch(athlete_id, entry['since'])
+        rows = dict(entry['rows'])
+        _merge(rows, changed)
+        if len(rows) != total:
+            entry = None  # rides left the set: start over
+
+    if not entry:
+        total, changed = _fetch(athlete_id)
+        rows = {}
+        _merge(rows, changed)
+
+    stamps = [r['updated_at'] for r in rows.values() if r['updated_at']]
+    if version is not None:
+        with _lock:
+            _cache[athlete_id] = {'version': version, 'since': max(stamps) if stamps else None, 'rows': rows}
+    return rows
+
+def months_ago(now, months):
+    """now - N calendar months, clamped to the month end (Postgres interval arithmetic)."""
+    year, month = divmod(now.year * 12 + now.month - 1 - months, 12)
+    day = min(now.day, calendar.monthrange(year, month + 1)[1])
+    return now.replace(year=year, month=month + 1, day=day)
+
+def sliding_max(dates, values, window_days=SEASONAL_WINDOW_DAYS):
+    """
+    For each position i, the max of values[j <= i] with dates[j] >= dates[i] - window_days.
+    Monotonic deque: each value enters and leaves once.
+    """
+    window = deque()  # (date, value), values strictly decreasing
+    out = []
+    for d, v in zip(dates, values):
+        while window and window[-1][1] <= v:
+            window.pop()
+        window.append((d, v))
+        start = d - timedelta(days=window_days)
+        while window[0][0] < start:
+            window.popleft()
+        out.append(window[0][1])
+    return out
+
+def build_progression(athlete_id, months_limit=12):
+    """
+    Returns (progression, all_time_peaks, recent_peaks), each keyed by interval label.
+    progression points: {'x', 'y', 'seasonal_record', 'ftp', 'name', 'id'}.
+    """
+    rows = get_progression_rows(athlete_id)
+
+    now = datetime.now()
+    cutoff = months_ago(now, months_limit) if months_limit else None
+    recent_cutoff = now.date() - timedelta(days=30)
+
+    selected = sorted(
+        (r for r in rows.items() if cutoff is None or r[1]['date'] >= cutoff),
+        key=lambda r: (r[1]['date'], r[0])
+    )
+
+    progression, all_time_peaks, recent_peaks = {}, {}, {}
+    for label, col in PROGRESSION_INTERVALS.items():
+        series = [(sid, r) for sid, r in selected if r[col] and r[col] > 0]
+        dates = [r['date'].date() for _, r in series]
+        powers = [r[col] for _, r in series]
+        seasonal = sliding_max(dates, powers)
+
+        progression[label] = [{
+            'x': d.isoformat(),
+            'y': p,
+            'seasonal_record': s,
+            'ftp': r['ftp'],
+            'name': r['name'],
+            'id': str(sid)
+        } for (sid, r), d, p, s in zip(series, dates, powers, seasonal)]
+        all_time_peaks[label] = max(powers, default=0)
+        recent_peaks[label] = max((p for d, p in zip(dates, powers) if d >= recent_cutoff), default=0)
+
+    return progression, all_time_peaks, recent_peaks
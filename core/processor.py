@@ -2,6 +2,8 @@
 
 from datetime import datetime, timedelta
 from core.database import run_query
+from core.render_payload import save_render_payload
+from core.power_envelope import merge_activity_into_envelope
 from core.analysis import (
     calculate_weighted_power, 
     get_interval_bests, 
@@ -52,16 +54,22 @@ def format_activities_to_markdown(rows):
     if not rows:
         return "No data found."
 
-    # 1. Dynamically get headers
-    headers = list(rows[0].keys())
-    
-    header_row = "| " + " | ".join(headers) + " |"
-    separator_row = "| " + " | ".join([":---"] * len(headers)) + " |"
-    
-    table_lines = [header_row, separator_row]
-    
-    # 2. Build rows
+    return "\n".join(iter_markdown_lines(rows))
+
+def iter_markdown_lines(rows):
+    """
+    The same Markdown table, one line at a time, for any row iterable (e.g. a
+    streaming cursor): headers are taken from the first row.
+    """
+    headers = None
     for r in rows:
+        if headers is None:
+            # 1. Dynamically get headers
+            headers = list(r.keys())
+            yield "| " + " | ".join(headers) + " |"
+            yield "| " + " | ".join([":---"] * len(headers)) + " |"
+
+        # 2. Build rows
         row_values = []
         for h in headers:
             val = r[h]
@@ -73,9 +81,7 @@ def format_activities_to_markdown(rows):
             elif val is None:
                 val = "N/A"
             row_values.append(str(val))
-        table_lines.append("| " + " | ".join(row_values) + " |")
-    
-    return "\n".join(table_lines)
+        yield "| " + " | ".join(row_values) + " |"
 
 def get_athlete_context(strava_id):
     """Fetches user settings and activity metadata."""
@@ -372,8 +378,18 @@ def process_activity_metrics(strava_id, force=False):
         Json(power_tiz), Json(hr_tiz), ride_label
     ))
 
+    #7b. Rolling best-power envelope (only durations this ride beats)
+    if power_curve:
+        merge_activity_into_envelope(athlete_id, strava_id)
+
     #8. Laps enrichemnt
     if has_power:
         process_lap_details(strava_id, streams['watts_series'])
 
+    #9. Render-ready payload for the activity page
+    try:
+        save_render_payload(strava_id)
+    except Exception as e:
+        print(f"\t⚠️ Render payload for {strava_id} not built: {e}")
+
     return True
\ No newline at end of file
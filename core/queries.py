@@ -118,13 +118,24 @@ WHERE athlete_id = %s
 """
 
 SQL_GET_LATEST_ACTIVITY_ID = """
-SELECT strava_id 
-FROM activities 
-WHERE athlete_id = %s 
-ORDER BY start_date_local DESC 
+SELECT strava_id
+FROM activities
+WHERE athlete_id = %s
+ORDER BY start_date_local DESC
 LIMIT 1;
 """
 
+# Template globals in one round trip; counts are the trigger-maintained counters on users
+SQL_ATHLETE_GLOBALS = """
+SELECT
+    u.firstname, u.manual_ftp, u.detected_ftp,
+    u.activity_count, u.stream_count, u.data_version,
+    (SELECT a.strava_id FROM activities a
+     WHERE a.athlete_id = u.athlete_id
+     ORDER BY a.start_date_local DESC LIMIT 1) as last_activity_id
+FROM users u WHERE u.athlete_id = %s;
+"""
+
 SQL_ACTIVITY_DETAILS = """
 SELECT 
     a.strava_id, a.name, a.type, a.start_date_local, 
@@ -158,6 +169,120 @@ LEFT JOIN activity_classification_meta cm ON an.classification = cm.slug
 WHERE a.strava_id = %s;
 """
 
+# Everything the activity page needs in one round trip (core/activity_page.py).
+# strava_id NULL = the athlete's latest activity. Small side lists come back as JSON columns.
+# Streams, curves and the map are not selected: the page loads them from the render payload
+# (/api/activity/<id>/render, core/render_payload.py).
+SQL_ACTIVITY_PAGE = """
+WITH target AS (
+    SELECT strava_id FROM activities
+    WHERE strava_id = COALESCE(%(strava_id)s::bigint, (
+        SELECT strava_id FROM activities WHERE athlete_id = %(athlete_id)s
+        ORDER BY start_date_local DESC LIMIT 1
+    ))
+)
+SELECT 
+    a.strava_id, a.name, a.type, a.start_date_local, 
+    a.distance / 1000.0 as distance_km, 
+    a.moving_time, a.total_elevation_gain, a.average_watts, a.average_heartrate,
+    a.average_speed, a.max_speed, a.max_watts, a.max_heartrate,
+    a.average_cadence, a.kilojoules,
+    an.peak_5s, an.peak_1m, an.peak_5m, an.peak_20m, 
+    an.peak_5s_hr, an.peak_1m_hr, an.peak_5m_hr, an.peak_20m_hr,
+    an.weighted_avg_power, an.baseline_ftp, 
+    an.baseline_max_hr,
+    an.aerobic_decoupling,
+    an.variability_index, an.efficiency_factor, an.intensity_score,
+    an.training_stress_score,
+    an.power_tiz, an.hr_tiz,
+    a.resource_state,
+    cm.display_name as class_label,
+    cm.accent_color,
+    cm.bg_color,
+    cm.icon_class,
+    (SELECT json_agg(l ORDER BY l.start_index)
+     FROM activity_laps l
+     WHERE l.strava_id = a.strava_id AND l.is_hidden = FALSE AND a.resource_state = 3) as page_laps,
+    (SELECT json_agg(r ORDER BY r.start_date_local DESC) FROM (
+        (SELECT strava_id, substr(name,1,30) as name, type, start_date_local 
+         FROM activities 
+         WHERE athlete_id = %(athlete_id)s AND start_date_local <= a.start_date_local
+         ORDER BY start_date_local DESC LIMIT 10)
+        UNION
+        (SELECT strava_id, substr(name,1,30) as name, type, start_date_local 
+         FROM activities 
+         WHERE athlete_id = %(athlete_id)s AND start_date_local > a.start_date_local
+         ORDER BY start_date_local ASC LIMIT 10)
+    ) r) as page_recent,
+    (SELECT p.strava_id FROM activities p
+     WHERE p.athlete_id = %(athlete_id)s AND p.start_date_local < a.start_date_local
+     ORDER BY p.start_date_local DESC LIMIT 1) as page_prev_id,
+    (SELECT n.strava_id FROM activities n
+     WHERE n.athlete_id = %(athlete_id)s AND n.start_date_local > a.start_date_local
+     ORDER BY n.start_date_local ASC LIMIT 1) as page_next_id,
+    (SELECT jsonb_object_agg(e.duration, e.power) FROM athlete_power_envelope e
+     WHERE e.athlete_id = %(athlete_id)s) as page_best_power,
+    (SELECT u.power_envelope_at IS NULL
+            OR EXISTS (SELECT 1 FROM athlete_power_envelope e
+                       WHERE e.athlete_id = u.athlete_id
+                         AND (e.strava_id IS NULL OR e.activity_date < %(best_since)s))
+     FROM users u WHERE u.athlete_id = %(athlete_id)s) as page_best_stale,
+    fit.rows as page_fitness,
+    tz.zone as page_tsb_zone
+FROM target t
+JOIN activities a ON a.strava_id = t.strava_id
+JOIN activity_streams s ON a.strava_id = s.strava_id
+LEFT JOIN activity_analytics an ON a.strava_id = an.strava_id
+LEFT JOIN activity_classification_meta cm ON an.classification = cm.slug
+LEFT JOIN LATERAL (
+    SELECT json_agg(f ORDER BY f.date DESC) as rows, (array_agg(f.tsb ORDER BY f.date DESC))[1] as tsb
+    FROM (SELECT date, ctl, atl, tsb FROM athlete_daily_metrics
+          WHERE athlete_id = %(athlete_id)s AND date <= a.start_date_local::date
+          ORDER BY date DESC LIMIT 2) f
+) fit ON TRUE
+LEFT JOIN LATERAL (
+    SELECT row_to_json(z) as zone FROM (
+        SELECT zone_name, description, color_code FROM training_zones
+        WHERE category = 'tsb' AND fit.tsb >= min_val AND fit.tsb < max_val
+        LIMIT 1
+    ) z
+) tz ON TRUE;
+"""
+
+SQL_RENDER_PAYLOAD_SOURCE = """
+SELECT
+    a.strava_id, a.map_polyline,
+    s.time_series, s.watts_series, s.heartrate_series, s.cadence_series, s.altitude_series,
+    s.updated_at as streams_updated_at,
+    an.power_curve, an.hr_curve, an.cadence_curve, an.power_tiz, an.hr_tiz,
+    (SELECT json_agg(l ORDER BY l.start_index)
+     FROM activity_laps l
+     WHERE l.strava_id = a.strava_id AND l.is_hidden = FALSE) as laps
+FROM activities a
+LEFT JOIN activity_streams s ON a.strava_id = s.strava_id
+LEFT JOIN activity_analytics an ON a.strava_id = an.strava_id
+WHERE a.strava_id = %(strava_id)s
+  AND (%(athlete_id)s::bigint IS NULL OR a.athlete_id = %(athlete_id)s);
+"""
+
+SQL_SAVE_RENDER_PAYLOAD = """
+INSERT INTO activity_render_payloads (strava_id, format_version, etag, body, raw_bytes, built_at)
+VALUES (%s, %s, %s, %s, %s, NOW())
+ON CONFLICT (strava_id) DO UPDATE SET
+    format_version = EXCLUDED.format_version,
+    etag = EXCLUDED.etag,
+    body = EXCLUDED.body,
+    raw_bytes = EXCLUDED.raw_bytes,
+    built_at = NOW();
+"""
+
+SQL_GET_RENDER_PAYLOAD = """
+SELECT p.etag, p.body
+FROM activity_render_payloads p
+JOIN activities a ON a.strava_id = p.strava_id
+WHERE p.strava_id = %s AND a.athlete_id = %s AND p.format_version = %s;
+"""
+
 SQL_PREVIOUS_ACTIVITY_ID = """
 SELECT strava_id FROM activities 
 WHERE athlete_id = %s 
@@ -175,23 +300,38 @@ LIMIT 1;
 """
 
 SQL_POWER_PROGRESSION = """
-    SELECT 
-        a.start_date_local as date, 
-        a.name as activity_name, 
+-- Every ride's progression intervals in one pass (core/power_progression.py). With a `since`
+-- only rows whose activity or analytics changed after it come back (renames and date edits
+-- included); `total` is always the full row count, so the caller can tell when rows were removed.
+WITH rides AS (
+    SELECT
+        a.start_date_local as date,
+        a.name as activity_name,
         a.strava_id,
-        (aa.power_curve->>%s)::int as power,  -- Extract key from JSON and cast to int
-        aa.baseline_ftp
+        aa.baseline_ftp,
+        GREATEST(aa.updated_at, a.updated_at) as updated_at,
+        aa.power_curve
     FROM activities a
     JOIN activity_analytics aa ON a.strava_id = aa.strava_id
-    WHERE a.athlete_id = %s
-    AND (aa.power_curve->>%s) IS NOT NULL    -- Ensure the specific interval exists
-    AND (aa.power_curve->>%s)::int > 0
+    WHERE a.athlete_id = %(athlete_id)s
+    AND aa.power_curve IS NOT NULL
     AND a.type IN ('Ride','VirtualRide')
-    AND (
-        %s = 0 OR 
-        a.start_date_local >= NOW() - make_interval(months => %s)
-    )
-    ORDER BY a.start_date_local ASC
+),
+changed AS (
+    SELECT
+        date, activity_name, strava_id, baseline_ftp, updated_at,
+        (power_curve->>'5')::int as p5,
+        (power_curve->>'60')::int as p60,
+        (power_curve->>'300')::int as p300,
+        (power_curve->>'600')::int as p600,
+        (power_curve->>'1200')::int as p1200,
+        (power_curve->>'3600')::int as p3600
+    FROM rides
+    WHERE %(since)s::timestamp IS NULL OR updated_at > %(since)s::timestamp - interval '10 minutes'
+)
+SELECT t.total, c.*
+FROM (SELECT COUNT(*) as total FROM rides) t
+LEFT JOIN changed c ON TRUE
 """
 
 SQL_YEARLY_PEAKS = """
@@ -216,21 +356,67 @@ WHERE a.athlete_id = %s
 AND EXTRACT(YEAR FROM a.start_date_local) = %s
 """
 
-SQL_CRAWLER_BACKLOG = """
-  SELECT a.strava_id, a.type, a.start_date_local
-  FROM activities a
-  LEFT JOIN activity_streams s ON a.strava_id = s.strava_id
-  WHERE a.athlete_id = %s 
-    AND a.streams_missing != TRUE
-    --AND a.type IN ('Ride', 'VirtualRide')
-    AND a.start_date_local >= %s
-    AND (
-        s.strava_id IS NULL             -- Case 1: We don't have streams yet
-        OR 
-        a.resource_state = 2            -- Case 2: We have streams, but metadata is only 'Summary'
+SQL_CLAIM_CRAWLER_BACKLOG = """
+  -- Leases the next backlog rows to this worker. SKIP LOCKED lets concurrent
+  -- workers pass over rows another claim is taking; the lease keeps them
+  -- reserved until processed or expired.
+  UPDATE activities
+  SET crawl_leased_until = NOW() + make_interval(secs => %s),
+      crawl_leased_by = %s
+  WHERE strava_id IN (
+      SELECT a.strava_id
+      FROM activities a
+      LEFT JOIN activity_streams s ON a.strava_id = s.strava_id
+      WHERE a.athlete_id = %s 
+        AND a.streams_missing != TRUE
+        --AND a.type IN ('Ride', 'VirtualRide')
+        AND a.start_date_local >= %s
+        AND (
+            s.strava_id IS NULL             -- Case 1: We don't have streams yet
+            OR 
+            a.resource_state = 2            -- Case 2: We have streams, but metadata is only 'Summary'
+        )
+        AND (a.crawl_leased_until IS NULL OR a.crawl_leased_until < NOW())
+      ORDER BY a.start_date_local DESC
+      LIMIT %s
+      FOR UPDATE OF a SKIP LOCKED
+  )
+  RETURNING strava_id, type, start_date_local
+"""
+
+SQL_RELEASE_CRAWLER_LEASES = """
+  UPDATE activities
+  SET crawl_leased_until = NULL, crawl_leased_by = NULL
+  WHERE strava_id = ANY(%s) AND crawl_leased_by = %s
+"""
+
+SQL_CLAIM_ANALYTICS_LEASE = """
+    -- Analytics are leased per athlete: the baseline FTP/HR chain must be
+    -- recomputed strictly in date order, so one athlete = one worker at a time.
+    UPDATE users
+    SET analytics_leased_until = NOW() + make_interval(secs => %s),
+        analytics_leased_by = %s
+    WHERE athlete_id = (
+        SELECT athlete_id FROM users
+        WHERE athlete_id = %s
+          AND (analytics_leased_until IS NULL
+               OR analytics_leased_until < NOW()
+               OR analytics_leased_by = %s)
+        FOR UPDATE SKIP LOCKED
     )
-  ORDER BY a.start_date_local DESC
-  LIMIT %s
+    RETURNING athlete_id
+"""
+
+SQL_RENEW_ANALYTICS_LEASE = """
+    UPDATE users
+    SET analytics_leased_until = NOW() + make_interval(secs => %s)
+    WHERE athlete_id = %s AND analytics_leased_by = %s
+"""
+
+SQL_RELEASE_ANALYTICS_LEASE = """
+    UPDATE users
+    SET analytics_leased_until = NULL, analytics_leased_by = NULL
+    WHERE athlete_id = %s AND analytics_leased_by = %s
 """
 
 SQL_RECALC_QUEUE = """
@@ -361,11 +547,14 @@ SQL_ADMIN_OVERVIEW = """
         COUNT(a.strava_id) FILTER (WHERE s.strava_id is NOT NULL) AS streams,
         min(a.start_date_local::date) FILTER (WHERE s.strava_id is NOT NULL) AS first_stream,
         max(a.start_date_local::date) FILTER (WHERE s.strava_id is NOT NULL) AS last_stream,
-        COUNT(a.strava_id) FILTER (WHERE a.resource_state = 3) AS detailed_activities
+        COUNT(a.strava_id) FILTER (WHERE a.resource_state = 3) AS detailed_activities,
+        EXTRACT(EPOCH FROM u.first_dashboard_at - u.onboarding_started_at)::int AS time_to_dashboard,
+        EXTRACT(EPOCH FROM u.first_analytics_at - u.onboarding_started_at)::int AS time_to_analytics
     FROM users u
     JOIN activities a ON u.athlete_id = a.athlete_id
     LEFT JOIN activity_streams s ON s.strava_id = a.strava_id 
-    GROUP BY u.athlete_id, u.firstname, u.lastname;
+    GROUP BY u.athlete_id, u.firstname, u.lastname,
+             u.onboarding_started_at, u.first_dashboard_at, u.first_analytics_at;
 """
 
 SQL_ADMIN_CRAWLER_ACTIVITIES_BACKLOG = """
@@ -459,4 +648,363 @@ WHERE t.athlete_id = %s
   AND t.strava_id != 17792642743
   AND t.moving_time > 600
 ORDER BY t.start_date_local DESC
-"""
\ No newline at end of file
+"""
+
+# webhook queries:
+
+SQL_INSERT_WEBHOOK_EVENT = """
+    INSERT INTO webhook_events (
+        object_id, object_type, aspect_type, owner_id, event_time, updates, payload
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (object_id, aspect_type, event_time) DO NOTHING
+    RETURNING id
+"""
+
+SQL_CANCEL_PENDING_WEBHOOK_UPDATES = """
+    UPDATE webhook_events
+    SET status = 'cancelled', processed_at = NOW()
+    WHERE object_id = %s
+      AND object_type = 'activity'
+      AND aspect_type IN ('create', 'update')
+      AND status = 'pending'
+"""
+
+SQL_WEBHOOK_DUE_ACTIVITIES = """
+    SELECT object_id, MAX(owner_id) as owner_id
+    FROM webhook_events
+    WHERE status = 'pending'
+      AND object_type = 'activity'
+      AND aspect_type IN ('create', 'update')
+    GROUP BY object_id
+    HAVING MAX(received_at) <= NOW() - make_interval(secs => %s)
+    ORDER BY MIN(received_at) ASC
+"""
+
+SQL_CLAIM_WEBHOOK_EVENTS = """
+    UPDATE webhook_events
+    SET status = 'processing', claimed_at = NOW()
+    WHERE object_id = %s
+      AND object_type = 'activity'
+      AND aspect_type IN ('create', 'update')
+      AND status = 'pending'
+      -- Debounce: only claim once the burst for this activity has gone quiet
+      AND NOT EXISTS (
+          SELECT 1 FROM webhook_events w
+          WHERE w.object_id = %s
+            AND w.status = 'pending'
+            AND w.received_at > NOW() - make_interval(secs => %s)
+      )
+    RETURNING id, owner_id, aspect_type, updates
+"""
+
+SQL_RECLAIM_STALE_WEBHOOK_EVENTS = """
+    -- Claims whose drain died (crash, killed subprocess) go back to pending
+    UPDATE webhook_events
+    SET status = 'pending', claimed_at = NULL
+    WHERE status = 'processing'
+      AND (claimed_at IS NULL OR claimed_at < NOW() - make_interval(secs => %s))
+"""
+
+SQL_APPLY_WEBHOOK_TITLE = """
+    UPDATE activities
+    SET name = %s,
+        raw_json = jsonb_set(raw_json, '{name}', to_jsonb(%s::text)),
+        updated_at = NOW()
+    WHERE strava_id = %s
+    RETURNING strava_id
+"""
+
+SQL_FINISH_WEBHOOK_EVENTS = """
+    UPDATE webhook_events
+    SET status = %s, processed_at = NOW()
+    WHERE id = ANY(%s)
+"""
+
+
+# run exclusion queries:
+
+SQL_TRY_ADVISORY_LOCK = """
+    SELECT pg_try_advisory_lock(hashtextextended(%s, 0))
+"""
+
+SQL_ADVISORY_UNLOCK = """
+    SELECT pg_advisory_unlock(hashtextextended(%s, 0))
+"""
+
+SQL_INSERT_RUN_DEFERRAL = """
+    INSERT INTO run_deferrals (athlete_id, job_type, job_name, strava_id, params, contender)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON CONFLICT (athlete_id, job_name, COALESCE(strava_id, 0)) WHERE resolved_at IS NULL
+    DO UPDATE SET
+        contention_count = run_deferrals.contention_count + 1,
+        last_contended_at = NOW()
+"""
+
+SQL_PENDING_RUN_DEFERRALS = """
+    SELECT id, athlete_id, job_type, job_name, strava_id, params
+    FROM run_deferrals
+    WHERE resolved_at IS NULL
+    ORDER BY created_at ASC
+"""
+
+SQL_RESOLVE_RUN_DEFERRAL = """
+    UPDATE run_deferrals SET resolved_at = NOW() WHERE id = %s
+"""
+
+SQL_ADMIN_RUN_CONTENTION = """
+    SELECT 
+        COALESCE(u.firstname || ' ' || u.lastname, d.athlete_id::text) AS athlete_name,
+        d.job_type,
+        d.job_name,
+        SUM(d.contention_count) AS contentions,
+        COUNT(*) FILTER (WHERE d.resolved_at IS NULL) AS pending,
+        MAX(d.last_contended_at) AS last_contended_at
+    FROM run_deferrals d
+    LEFT JOIN users u ON u.athlete_id = d.athlete_id
+    WHERE d.last_contended_at >= NOW() - INTERVAL '7 days'
+    GROUP BY d.athlete_id, u.firstname, u.lastname, d.job_type, d.job_name
+    ORDER BY last_contended_at DESC;
+"""
+
+
+# scheduler queries:
+
+SQL_SCHEDULER_BACKLOG = """
+    SELECT 
+        u.athlete_id,
+        u.firstname,
+        COALESCE(u.history_summaries_synced, FALSE) AS history_summaries_synced,
+        (SELECT COUNT(*)
+         FROM activities a
+         LEFT JOIN activity_streams s ON a.strava_id = s.strava_id
+         WHERE a.athlete_id = u.athlete_id
+           AND a.streams_missing != TRUE
+           AND a.start_date_local >= %s
+           AND (s.strava_id IS NULL OR a.resource_state = 2)
+        ) AS crawl_backlog,
+        (SELECT COUNT(*)
+         FROM activities a
+         WHERE a.athlete_id = u.athlete_id AND a.needs_recalculation = TRUE
+        ) AS recalc_backlog
+    FROM users u
+    ORDER BY u.athlete_id
+"""
+
+
+# strava api lane queries:
+
+SQL_API_WINDOW_USAGE = """
+    SELECT 
+        COUNT(*) FILTER (
+            WHERE called_at >= date_trunc('hour', NOW() AT TIME ZONE 'UTC')
+                + floor(EXTRACT(MINUTE FROM NOW() AT TIME ZONE 'UTC') / 15) * INTERVAL '15 minutes'
+        ) AS usage_15m,
+        COUNT(*) AS usage_1d
+    FROM api_calls
+    WHERE called_at >= date_trunc('day', NOW() AT TIME ZONE 'UTC')
+"""
+
+SQL_API_ACTIVE_LANES = """
+    SELECT 
+        EXISTS (
+            SELECT 1 FROM webhook_events 
+            WHERE status = 'processing' AND object_type = 'activity'
+              AND claimed_at > NOW() - make_interval(secs => %s)  -- stale claims don't preempt
+        ) AS webhook,
+        EXISTS (
+            SELECT 1 FROM users 
+            WHERE onboarding_started_at > NOW() - INTERVAL '1 hour'
+              AND first_analytics_at IS NULL
+        ) AS onboarding
+"""
+
+SQL_INSERT_API_CALLS = """
+    INSERT INTO api_calls (lane, endpoint, status_code, latency_ms, waited_ms, called_at)
+    VALUES %s
+"""
+
+SQL_PURGE_API_CALLS = """
+    DELETE FROM api_calls WHERE called_at < (NOW() AT TIME ZONE 'UTC') - INTERVAL '7 days'
+"""
+
+SQL_ADMIN_API_LANES = """
+    SELECT 
+        lane,
+        COUNT(*) FILTER (
+            WHERE called_at >= date_trunc('hour', NOW() AT TIME ZONE 'UTC')
+                + floor(EXTRACT(MINUTE FROM NOW() AT TIME ZONE 'UTC') / 15) * INTERVAL '15 minutes'
+        ) AS calls_15m,
+        COUNT(*) AS calls_1d,
+        ROUND(AVG(latency_ms)) AS avg_latency_ms,
+        ROUND(percentile_cont(0.95) WITHIN GROUP (ORDER BY latency_ms)) AS p95_latency_ms,
+        ROUND(AVG(waited_ms)) AS avg_wait_ms,
+        COUNT(*) FILTER (WHERE status_code = 429) AS throttled
+    FROM api_calls
+    WHERE called_at >= date_trunc('day', NOW() AT TIME ZONE 'UTC')
+    GROUP BY lane
+"""
+
+
+# strava api circuit breaker queries:
+
+SQL_GET_API_BREAKER = """
+    SELECT state, consecutive_failures, opened_until,
+           (state = 'open' AND opened_until <= NOW())
+           OR (state = 'half_open' AND updated_at < NOW() - make_interval(secs => %s)) AS probe_due
+    FROM api_breakers WHERE endpoint = %s
+"""
+
+SQL_API_BREAKER_PROBE = """
+    -- Only one worker wins the half-open probe after the cool-down; a probe whose worker died
+    -- without reporting back is taken over once it is older than the probe timeout
+    UPDATE api_breakers
+    SET state = 'half_open', updated_at = NOW()
+    WHERE endpoint = %(endpoint)s
+      AND ((state = 'open' AND opened_until <= NOW())
+        OR (state = 'half_open' AND updated_at < NOW() - make_interval(secs => %(probe_timeout)s)))
+    RETURNING endpoint
+"""
+
+SQL_API_BREAKER_RELEASE_PROBE = """
+    -- The probe got no verdict (429, cancelled): back to open, the next call probes again
+    UPDATE api_breakers
+    SET state = 'open', updated_at = NOW()
+    WHERE endpoint = %s AND state = 'half_open'
+"""
+
+SQL_API_BREAKER_FAILURE = """
+    INSERT INTO api_breakers (endpoint, consecutive_failures, last_error, updated_at)
+    VALUES (%(endpoint)s, 1, %(error)s, NOW())
+    ON CONFLICT (endpoint) DO UPDATE SET
+        consecutive_failures = api_breakers.consecutive_failures + 1,
+        last_error = EXCLUDED.last_error,
+        state = CASE
+            WHEN api_breakers.state = 'half_open'
+              OR api_breakers.consecutive_failures + 1 >= %(threshold)s THEN 'open'
+            ELSE api_breakers.state END,
+        opened_until = CASE
+            WHEN api_breakers.state <> 'open' AND (api_breakers.state = 'half_open'
+              OR api_breakers.consecutive_failures + 1 >= %(threshold)s)
+            THEN NOW() + make_interval(secs => %(open_seconds)s)
+            ELSE api_breakers.opened_until END,
+        trips = api_breakers.trips + CASE
+            WHEN api_breakers.state <> 'open' AND (api_breakers.state = 'half_open'
+              OR api_breakers.consecutive_failures + 1 >= %(threshold)s)
+            THEN 1 ELSE 0 END,
+        updated_at = NOW()
+    RETURNING state, trips
+"""
+
+SQL_API_BREAKER_SUCCESS = """
+    UPDATE api_breakers
+    SET recoveries = recoveries + CASE WHEN state <> 'closed' THEN 1 ELSE 0 END,
+        state = 'closed',
+        consecutive_failures = 0,
+        opened_until = NULL,
+        updated_at = NOW()
+    WHERE endpoint = %s AND (state <> 'closed' OR consecutive_failures > 0)
+    RETURNING recoveries
+"""
+
+SQL_SAVE_INGEST_STAGE_STATS = """
+    INSERT INTO ingest_stage_stats
+        (pipeline, stage, position, workers, processed, failed, busy_s, wall_s, utilization, max_queue, avg_queue)
+    VALUES %s
+"""
+
+# Per pipeline stage over the last week: throughput and where the queues back up
+SQL_ADMIN_INGEST_STAGES = """
+    SELECT pipeline, stage, MIN(position) as position,
+           COUNT(*) as runs,
+           SUM(processed) as processed,
+           SUM(failed) as failed,
+           ROUND((SUM(processed) / NULLIF(SUM(wall_s), 0))::numeric, 2) as per_s,
+           ROUND(AVG(utilization)::numeric * 100) as utilization_pct,
+           ROUND(AVG(avg_queue)::numeric, 1) as avg_queue,
+           MAX(max_queue) as max_queue,
+           ROUND(AVG(workers)::numeric, 1) as workers,
+           MAX(finished_at) as last_run
+    FROM ingest_stage_stats
+    WHERE finished_at > NOW() - INTERVAL '7 days'
+    GROUP BY pipeline, stage
+    ORDER BY pipeline, position
+"""
+
+SQL_ADMIN_API_BREAKERS = """
+    SELECT endpoint, state, consecutive_failures, opened_until, trips, recoveries, last_error, updated_at
+    FROM api_breakers
+    ORDER BY (state <> 'closed') DESC, endpoint
+"""
+
+
+# stream profile queries:
+
+SQL_ACTIVITY_STREAM_KEYS = """
+    SELECT stream_keys FROM activity_streams WHERE strava_id = %s
+"""
+
+# --- Rolling best-power envelope (core/power_envelope.py) ---
+
+SQL_POWER_ENVELOPE_REBUILD = """
+-- Concurrent rebuilds of one athlete run one after the other; ON CONFLICT covers a merge
+-- that lands between the DELETE and the INSERT
+SELECT pg_advisory_xact_lock(hashtextextended('power_envelope_rebuild:' || %(athlete_id)s, 0));
+
+DELETE FROM athlete_power_envelope WHERE athlete_id = %(athlete_id)s;
+
+INSERT INTO athlete_power_envelope (athlete_id, duration, power, strava_id, activity_date, updated_at)
+SELECT DISTINCT ON (c.key::int)
+    a.athlete_id, c.key::int, c.value::float8, a.strava_id, a.start_date_local, NOW()
+FROM activity_analytics an
+JOIN activities a ON an.strava_id = a.strava_id,
+jsonb_each_text(an.power_curve) c
+WHERE a.athlete_id = %(athlete_id)s
+  AND a.start_date_local >= %(since)s
+  AND c.value IS NOT NULL
+ORDER BY c.key::int, c.value::float8 DESC, a.start_date_local DESC
+ON CONFLICT (athlete_id, duration) DO UPDATE SET
+    power = EXCLUDED.power,
+    strava_id = EXCLUDED.strava_id,
+    activity_date = EXCLUDED.activity_date,
+    updated_at = NOW();
+
+UPDATE users SET power_envelope_at = NOW() WHERE athlete_id = %(athlete_id)s;
+"""
+
+# One ride's curve merged into the envelope: only durations it beats are touched
+SQL_POWER_ENVELOPE_MERGE = """
+INSERT INTO athlete_power_envelope (athlete_id, duration, power, strava_id, activity_date, updated_at)
+SELECT a.athlete_id, c.key::int, c.value::float8, a.strava_id, a.start_date_local, NOW()
+FROM activities a
+JOIN activity_analytics an ON an.strava_id = a.strava_id,
+jsonb_each_text(an.power_curve) c
+WHERE a.strava_id = %(strava_id)s
+  AND a.start_date_local >= %(since)s
+  AND c.value IS NOT NULL
+ON CONFLICT (athlete_id, duration) DO UPDATE SET
+    power = EXCLUDED.power,
+    strava_id = EXCLUDED.strava_id,
+    activity_date = EXCLUDED.activity_date,
+    updated_at = NOW()
+WHERE EXCLUDED.power > athlete_power_envelope.power;
+"""
+
+# Durations this ride holds but its (re-computed) curve no longer reaches
+SQL_POWER_ENVELOPE_LOST_RECORDS = """
+SELECT e.duration
+FROM athlete_power_envelope e
+JOIN activity_analytics an ON an.strava_id = e.strava_id
+WHERE e.strava_id = %(strava_id)s
+  AND COALESCE((an.power_curve->>e.duration::text)::float8, 0) < e.power;
+"""
+
+SQL_POWER_ENVELOPE_READ = """
+SELECT
+    u.power_envelope_at IS NULL
+    OR EXISTS (SELECT 1 FROM athlete_power_envelope e
+               WHERE e.athlete_id = u.athlete_id
+                 AND (e.strava_id IS NULL OR e.activity_date < %(since)s)) as stale,
+    (SELECT jsonb_object_agg(e.duration, e.power) FROM athlete_power_envelope e
+     WHERE e.athlete_id = u.athlete_id) as curve
+FROM users u WHERE u.athlete_id = %(athlete_id)s;
+"""
@@ -0,0 +1,73 @@
+# core/render_payload.py
+
+# Render-ready payload of an activity page: chart series (smoothed + LTTB, core/chart_streams.py),
+# power/HR/cadence curves, TIZ, laps and the map polyline, as one gzip-compressed JSON blob in
+# activity_render_payloads. Built at the end of process_activity_metrics (streams or analytics
+# changed), dropped when laps are edited, and rebuilt lazily on the next view if missing.
+# The stored bytes are served as-is (Content-Encoding: gzip) with an ETag, so a page view costs
+# one keyed read and a repeat view a 304.
+
+import gzip, hashlib, json
+from psycopg2 import Binary
+from core.database import run_query
+from core.queries import SQL_RENDER_PAYLOAD_SOURCE, SQL_SAVE_RENDER_PAYLOAD, SQL_GET_RENDER_PAYLOAD
+from core.chart_streams import downsample_channel, CHART_CHANNELS, DEFAULT_CHANNELS
+import config
+
+RENDER_PAYLOAD_POINTS = getattr(config, 'RENDER_PAYLOAD_POINTS', 1200)
+RENDER_PAYLOAD_VERSION = 1  # bump when the payload layout changes; old rows are rebuilt on read
+
+def build_render_payload(strava_id, athlete_id=None):
+    """
+    Builds the payload dict from the DB (empty series for summary-only activities), or None if
+    the activity does not exist or does not belong to athlete_id.
+    """
+    rows = run_query(SQL_RENDER_PAYLOAD_SOURCE, {'strava_id': strava_id, 'athlete_id': athlete_id})
+    if not rows:
+        return None
+    row = rows[0]
+
+    time_series = row['time_series'] or []
+    channels = {}
+    for c in DEFAULT_CHANNELS:
+        values = row.get(CHART_CHANNELS[c][0])
+        if values and time_series:
+            channels[c] = downsample_channel(time_series, values, c, RENDER_PAYLOAD_POINTS)
+
+    return {
+        'v': RENDER_PAYLOAD_VERSION,
+        'strava_id': strava_id,
+        'series': {'points': RENDER_PAYLOAD_POINTS, 'length': len(time_series), 'channels': channels},
+        'curves': {
+            'power': row['power_curve'] or {},
+            'hr': row['hr_curve'] or {},
+            'cadence': row['cadence_curve'] or {},
+        },
+        'tiz': {'power': row['power_tiz'], 'hr': row['hr_tiz']},
+        'laps': row['laps'] or [],
+        'map': {'polyline': row['map_polyline']},
+    }
+
+def save_render_payload(strava_id, athlete_id=None):
+    """(Re)builds and stores the payload. Returns (etag, gzip body) or None (see build_render_payload)."""
+    payload = build_render_payload(strava_id, athlete_id)
+    if payload is None:
+        return None
+
+    raw = json.dumps(payload, separators=(',', ':'), default=str).encode()
+    body = gzip.compress(raw, compresslevel=6, mtime=0)
+    etag = hashlib.sha1(body).hexdigest()[:20]
+
+    run_query(SQL_SAVE_RENDER_PAYLOAD, (strava_id, RENDER_PAYLOAD_VERSION, etag, Binary(body), len(raw)))
+    return etag, body
+
+def get_render_payload(strava_id, athlete_id):
+    """(etag, gzip body) of the athlete's stored payload, built on first use. None if not theirs."""
+    rows = run_query(SQL_GET_RENDER_PAYLOAD, (strava_id, athlete_id, RENDER_PAYLOAD_VERSION))
+    if rows:
+        return rows[0]['etag'], bytes(rows[0]['body'])
+    return save_render_payload(strava_id, athlete_id)
+
+def invalidate_render_payload(strava_id):
+    """Drops the stored payload (e.g. laps edited); the next view rebuilds it."""
+    run_query("DELETE FROM activity_render_payloads WHERE strava_id = %s", (strava_id,))
@@ -0,0 +1,257 @@
+# core/response_cache.py
+
+# Per-athlete response cache for the aggregate pages (/, /dashboard, /fitness, /performance).
+# Those pages only change when the athlete's data does, so a rendered page is stored under
+#   (route, query args, users.data_version)
+# users.data_version is bumped by DB triggers on every write to activities, activity_streams,
+# activity_analytics and athlete_daily_metrics (sync, analytics and fitness writers) and by
+# settings changes; the current value comes from core/athlete_globals.py (NOTIFY-invalidated),
+# so a hit costs no query.
+# Old versions are never read again and age out of the backend.
+#   - backends: 'memory' (in-process LRU), 'filesystem' (shared by workers on one host),
+#     'redis' (any Redis-compatible server, needs the redis package)
+#   - single-flight: concurrent misses for one key render once, the others wait for the result
+#   - hit / miss / wait counters per route for the admin overview
+
+import hashlib, os, pickle, tempfile, threading, time
+from functools import wraps
+from cachetools import TTLCache
+import config
+
+RESPONSE_CACHE_BACKEND = getattr(config, 'RESPONSE_CACHE_BACKEND', 'memory')  # memory | filesystem | redis | off
+RESPONSE_CACHE_TTL = getattr(config, 'RESPONSE_CACHE_TTL', 6 * 3600)  # safety net, versions do the invalidation
+RESPONSE_CACHE_SIZE = getattr(config, 'RESPONSE_CACHE_SIZE', 512)
+RESPONSE_CACHE_DIR = getattr(config, 'RESPONSE_CACHE_DIR', os.path.join(config.BASE_PATH, 'cache', 'responses'))
+RESPONSE_CACHE_REDIS_URL = getattr(config, 'RESPONSE_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+RESPONSE_CACHE_LOCK_WAIT = getattr(config, 'RESPONSE_CACHE_LOCK_WAIT', 10)  # seconds a follower waits
+
+# ------------------------------------------------------------------------------------------
+# Backends: get(key) -> value or None, set(key, value), lock(key) -> bool, unlock(key).
+# lock() guards a render across processes; in-process waiters are handled by _inflight.
+
+class MemoryBackend:
+    def __init__(self):
+        self._data = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._data.get(key)
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+
+    def lock(self, key):
+        return True
+
+    def unlock(self, key):
+        pass
+
+class FilesystemBackend:
+    def __init__(self, path=RESPONSE_CACHE_DIR):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key, ext='bin'):
+        return os.path.join(self.path, f"{hashlib.sha1(key.encode()).hexdigest()}.{ext}")
+
+    def get(self, key):
+        path = self._file(key)
+        try:
+            if time.time() - os.path.getmtime(path) > RESPONSE_CACHE_TTL:
+                return None
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def set(self, key, value):
+        fd, tmp = tempfile.mkstemp(dir=self.path)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._file(key))
+
+    def lock(self, key):
+        path = self._file(key, 'lock')
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL))
+            return True
+        except FileExistsError:
+            # A crashed renderer must not block the key forever
+            try:
+                if time.time() - os.path.getmtime(path) > RESPONSE_CACHE_LOCK_WAIT:
+                    os.remove(path)
+            except OSError:
+                pass
+            return False
+
+    def unlock(self, key):
+        try:
+            os.remove(self._file(key, 'lock'))
+        except OSError:
+            pass
+
+class RedisBackend:
+    def __init__(self, url=RESPONSE_CACHE_REDIS_URL):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        data = self.client.get(key)
+        return pickle.loads(data) if data is not None else None
+
+    def set(self, key, value):
+        self.client.set(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ex=RESPONSE_CACHE_TTL)
+
+    def lock(self, key):
+        return bool(self.client.set(f"{key}:lock", 1, nx=True, ex=RESPONSE_CACHE_LOCK_WAIT))
+
+    def unlock(self, key):
+        self.client.delete(f"{key}:lock")
+
+BACKENDS = {'memory': MemoryBackend, 'filesystem': FilesystemBackend, 'redis': RedisBackend}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    """The configured backend, created on first use (None when caching is off)."""
+    global _backend
+    if _backend is None and RESPONSE_CACHE_BACKEND in BACKENDS:
+        with _backend_lock:
+            if _backend is None:
+                _backend = BACKENDS[RESPONSE_CACHE_BACKEND]()
+    return _backend
+
+# ------------------------------------------------------------------------------------------
+# Metrics (per process)
+
+_stats = {}  # route -> {'hit', 'miss', 'wait', 'error'}
+_stats_lock = threading.Lock()
+
+def _count(route, outcome):
+    with _stats_lock:
+        counters = _stats.setdefault(route, {'hit': 0, 'miss': 0, 'wait': 0, 'error': 0})
+        counters[outcome] += 1
+
+def get_response_cache_stats():
+    """[{'route', 'hit', 'miss', 'wait', 'error', 'hit_rate'}] for this process."""
+    with _stats_lock:
+        rows = [{'route': r, **c} for r, c in sorted(_stats.items())]
+    for r in rows:
+        lookups = r['hit'] + r['miss']
+        r['hit_rate'] = round(100.0 * r['hit'] / lookups, 1) if lookups else None
+    return rows
+
+# ------------------------------------------------------------------------------------------
+# Lookup with single-flight
+
+_inflight = {}  # key -> threading.Event set when the leader has stored (or given up on) the value
+_inflight_lock = threading.Lock()
+
+def make_key(route, athlete_id, version, args):
+    """Cache key; args are the query args that shape the page (order-independent)."""
+    params = "&".join(f"{k}={v}" for k, v in sorted(args.items()))
+    digest = hashlib.sha1(params.encode()).hexdigest()[:12]
+    return f"resp:{athlete_id}:{version}:{route}:{digest}"
+
+def get_or_render(route, key, render):
+    """Returns the cached value of key, or render()'s result, stored once for all concurrent callers."""
+    backend = get_backend()
+    if backend is None:
+        return render()
+
+    try:
+        value = backend.get(key)
+    except Exception as e:
+        print(f"⚠️ Response cache read failed ({e}), rendering uncached.")
+        _count(route, 'error')
+        return render()
+    if value is not None:
+        _count(route, 'hit')
+        return value
+
+    with _inflight_lock:
+        event = _inflight.get(key)
+        leader = event is None
+        if leader:
+            event = _inflight[key] = threading.Event()
+
+    if not leader:
+        # Another thread of this process is rendering the same page
+        _count(route, 'wait')
+        event.wait(RESPONSE_CACHE_LOCK_WAIT)
+        value = backend.get(key)
+        if value is not None:
+            return value
+        return render()
+
+    try:
+        # Another process may be rendering it: give it the chance to finish first
+        locked = backend.lock(key)
+        if not locked:
+            _count(route, 'wait')
+            deadline = time.monotonic() + RESPONSE_CACHE_LOCK_WAIT
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                value = backend.get(key)
+                if value is not None:
+                    return value
+
+        _count(route, 'miss')
+        try:
+            value = render()
+            try:
+                backend.set(key, value)
+            except Exception as e:
+                print(f"⚠️ Response cache write failed ({e}).")
+                _count(route, 'error')
+            return value
+        finally:
+            if locked:
+                backend.unlock(key)  # never another renderer's lock
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        event.set()
+
+class _Uncacheable(Exception):
+    pass
+
+def cached_page(route, args=()):
+    """
+    View decorator: caches the rendered page per athlete and data version. `args` lists the
+    query args the page depends on. Only plain string responses are stored; anonymous requests
+    and pages with pending flash messages bypass the cache.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*a, **kw):
+            from flask import session, request
+            from core.athlete_globals import get_athlete_globals
+
+            athlete_id = session.get('athlete_id')
+            if not athlete_id or session.get('_flashes'):
+                return view(*a, **kw)
+
+            version = get_athlete_globals(athlete_id).get('data_version')
+            if version is None:
+                return view(*a, **kw)
+
+            key = make_key(route, athlete_id, version, {k: request.args.get(k, '') for k in args})
+            rendered = {}
+
+            def render():
+                response = view(*a, **kw)
+                if isinstance(response, str):
+                    return response
+                rendered['response'] = response  # redirects, errors: served, never stored
+                raise _Uncacheable()
+
+            try:
+                return get_or_render(route, key, render)
+            except _Uncacheable:
+                return rendered['response']
+        return wrapper
+    return decorator
@@ -0,0 +1,140 @@
+# core/run_locks.py
+
+# Run exclusion per athlete and job type, using Postgres advisory locks.
+# A webhook sync, a manual /ops/sync-activities and the cron crawler must not
+# recompute the same athlete's analytics chain at the same time.
+#   - 'sync':      run_sync, sync_single_activity, crawl_backfill (per athlete)
+#   - 'analytics': sync_local_analytics (per athlete)
+# A losing contender does not wait: it records a deferral in run_deferrals and returns.
+# Deferrals are re-run by drain_run_deferrals (end of every crawler run):
+#   ./venv/bin/python3 -u -m core.run_locks
+
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from psycopg2.extras import Json
+from core.database import get_db_connection, run_query
+from core.queries import (
+    SQL_TRY_ADVISORY_LOCK, SQL_ADVISORY_UNLOCK,
+    SQL_INSERT_RUN_DEFERRAL, SQL_PENDING_RUN_DEFERRALS, SQL_RESOLVE_RUN_DEFERRAL
+)
+from core.work_leases import WORKER_ID
+
+# Locks held by the current thread: key -> [connection, depth].
+# Lets nested calls (crawl_backfill -> sync_single_activity) re-enter their own lock.
+_held = threading.local()
+
+def _held_locks():
+    if not hasattr(_held, 'locks'):
+        _held.locks = {}
+    return _held.locks
+
+@contextmanager
+def athlete_run_lock(athlete_id, job_type):
+    """
+    Non-blocking advisory lock on (job_type, athlete_id). Yields True if acquired.
+    The lock lives on a dedicated session, so it is released even if the process dies.
+    """
+    key = f"{job_type}:{athlete_id}"
+    locks = _held_locks()
+
+    if key in locks:
+        locks[key][1] += 1
+        try:
+            yield True
+        finally:
+            locks[key][1] -= 1
+        return
+
+    conn = get_db_connection()
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(SQL_TRY_ADVISORY_LOCK, (key,))
+        acquired = cur.fetchone()[0]
+
+    if not acquired:
+        conn.close()
+        yield False
+        return
+
+    locks[key] = [conn, 1]
+    try:
+        yield True
+    finally:
+        locks.pop(key, None)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(SQL_ADVISORY_UNLOCK, (key,))
+        finally:
+            conn.close()
+
+def defer_run(athlete_id, job_type, job_name, strava_id=None, params=None):
+    """Re-queues a run that lost the lock. Repeated contention only bumps the counter."""
+    print(f"\t🔒 {job_name} for {athlete_id} busy ({job_type} lock held elsewhere). Deferred.")
+    try:
+        run_query(SQL_INSERT_RUN_DEFERRAL, (
+            athlete_id, job_type, job_name, strava_id, Json(params or {}), WORKER_ID
+        ))
+    except Exception as e:
+        print(f"\t⚠️ Failed to record deferral for {athlete_id}: {e}")
+
+def exclusive_athlete_run(job_type):
+    """
+    Decorator for entry points whose first argument is the athlete_id.
+    Returns False without running when the athlete's lock is held elsewhere.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(athlete_id, *args, **kwargs):
+            with athlete_run_lock(athlete_id, job_type) as acquired:
+                if not acquired:
+                    strava_id = args[0] if (f.__name__ == 'sync_single_activity' and args) else None
+                    defer_run(athlete_id, job_type, f.__name__, strava_id, {'args': list(args), 'kwargs': kwargs})
+                    return False
+                return f(athlete_id, *args, **kwargs)
+        return wrapper
+    return decorator
+
+def drain_run_deferrals():
+    """Re-runs every pending deferral. Still-busy runs simply get deferred again."""
+    from run_sync import run_sync, sync_single_activity
+    from core.crawl_analytics import sync_local_analytics
+    from core.crawl_backfill import crawl_backfill
+    from config import ANALYTICS_RECALC_SIZE, CRAWL_BACKFILL_SIZE, CRAWL_HISTORY_DAYS
+
+    pending = run_query(SQL_PENDING_RUN_DEFERRALS)
+    if not pending:
+        print("\t∅ No deferred runs.")
+        return 0
+
+    print(f"\t🔁 Re-running {len(pending)} deferred run(s)...")
+    for row in pending:
+        # Resolve first, so a renewed contention opens a fresh pending row
+        run_query(SQL_RESOLVE_RUN_DEFERRAL, (row['id'],))
+        a_id = row['athlete_id']
+        params = row['params'] or {}
+
+        try:
+            if row['job_name'] == 'sync_single_activity':
+                sync_single_activity(a_id, *params.get('args', []), **params.get('kwargs', {}))
+            elif row['job_name'] == 'run_sync':
+                run_sync(a_id, *params.get('args', []), **params.get('kwargs', {}))
+            elif row['job_name'] == 'sync_local_analytics':
+                sync_local_analytics(batch_size_per_user=ANALYTICS_RECALC_SIZE, target_athlete_id=a_id)
+            elif row['job_name'] == 'crawl_backfill':
+                crawl_backfill(batch_size_per_user=CRAWL_BACKFILL_SIZE, history_days=CRAWL_HISTORY_DAYS, target_athlete_id=a_id)
+        except Exception as e:
+            print(f"\t⚠️ Deferred {row['job_name']} for {a_id} failed: {e}")
+
+    return len(pending)
+
+
+if __name__ == "__main__":
+    print(f"\n{'='*60}")
+    print(f"Deferred Runs Started: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    drain_run_deferrals()
+
+    print(f"Deferred Runs Finished: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"{'='*60}\n")
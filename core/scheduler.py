@@ -0,0 +1,175 @@
+# core/scheduler.py
+
+# Resident scheduler replacing the cron-spawned crawler scripts.
+# One process keeps imports, caches and a DB connection pool warm, and runs the
+# periodic tasks in-process. Each task reports how much work it saw: an empty
+# backlog doubles its interval (up to max), a large one drops it back to min.
+#
+# systemd / supervisor:
+#   cd /home/ubuntu/apps/cycling_stats && ./venv/bin/python3 -u -m core.scheduler >> logs/crawler_log.log 2>&1
+
+import signal, time
+from datetime import datetime, timedelta
+from core.database import run_query, enable_connection_pool
+from core.queries import SQL_SCHEDULER_BACKLOG
+import config
+
+def _default_pool_size():
+    """
+    Peak connections of one task: the athlete run lock and crawl connection, one per history
+    fetch thread (breaker / lane / api_calls checks) and up to two per ingest stage worker
+    (its own connection plus run_query calls), with a little headroom.
+    """
+    from core.strava_api import HISTORY_FETCH_CONCURRENCY
+    from core.ingest_pipeline import INGEST_STAGE_WORKERS
+    return 2 + HISTORY_FETCH_CONCURRENCY + 2 * sum(INGEST_STAGE_WORKERS.values()) + 2
+
+SCHEDULER_POOL_SIZE = getattr(config, 'SCHEDULER_POOL_SIZE', None) or _default_pool_size()
+SCHEDULER_BUSY_BACKLOG = getattr(config, 'SCHEDULER_BUSY_BACKLOG', 50)
+
+# task name -> (min interval, max interval) in seconds
+SCHEDULER_INTERVALS = getattr(config, 'SCHEDULER_INTERVALS', {
+    'webhooks': (15, 120),
+    'deferrals': (60, 900),
+    'backfill': (300, 3600),
+    'analytics': (60, 1800),
+    'fitness': (3600, 3600),
+    'heatmap': (600, 3600),
+})
+
+class PeriodicTask:
+    """A task function with an adaptive interval. The function returns its backlog size."""
+
+    def __init__(self, name, func, min_interval, max_interval):
+        self.name = name
+        self.func = func
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.next_run = 0.0
+
+    def run(self):
+        started = time.monotonic()
+        try:
+            backlog = self.func() or 0
+        except Exception as e:
+            print(f"  ⚠️ Task {self.name} failed: {e}")
+            backlog = 0
+
+        if backlog >= SCHEDULER_BUSY_BACKLOG:
+            self.interval = self.min_interval
+        elif backlog > 0:
+            self.interval = max(self.min_interval, self.interval / 2)
+        else:
+            self.interval = min(self.max_interval, self.interval * 2)
+
+        self.next_run = time.monotonic() + self.interval
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] ⏱️ {self.name}: backlog {backlog}, "
+              f"took {time.monotonic() - started:.1f}s, next in {int(self.interval)}s")
+
+def get_backlog():
+    """One cheap query instead of letting every task rescan every athlete."""
+    since = (datetime.now() - timedelta(days=config.CRAWL_HISTORY_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+    return run_query(SQL_SCHEDULER_BACKLOG, (since,))
+
+def task_webhooks():
+    from core.webhook_events import drain_webhook_events
+    return drain_webhook_events()
+
+def task_deferrals():
+    from core.run_locks import drain_run_deferrals
+    return drain_run_deferrals()
+
+def task_backfill():
+    from core.crawl_backfill import crawl_backfill
+
+    pending = [a for a in get_backlog() if a['crawl_backlog'] > 0 or not a['history_summaries_synced']]
+    for athlete in pending:
+        crawl_backfill(
+            batch_size_per_user=config.CRAWL_BACKFILL_SIZE,
+            history_days=config.CRAWL_HISTORY_DAYS,
+            target_athlete_id=athlete['athlete_id']
+        )
+    return sum(a['crawl_backlog'] for a in pending)
+
+def task_analytics():
+    from core.crawl_analytics import sync_local_analytics
+
+    pending = [a for a in get_backlog() if a['recalc_backlog'] > 0]
+    for athlete in pending:
+        sync_local_analytics(
+            batch_size_per_user=config.ANALYTICS_RECALC_SIZE,
+            target_athlete_id=athlete['athlete_id']
+        )
+    return sum(a['recalc_backlog'] for a in pending)
+
+def task_fitness():
+    """Marches the fitness ledger forward so 'today' exists even without new rides."""
+    from core.analysis import sync_daily_fitness
+
+    refresh_from = (datetime.now() - timedelta(days=3)).date()
+    for athlete in get_backlog():
+        sync_daily_fitness(athlete['athlete_id'], refresh_from)
+    return 0
+
+def task_heatmap():
+    from core.heatmap import update_heatmap, pending_heatmap_count
+
+    backlog = 0
+    for athlete in get_backlog():
+        pending = pending_heatmap_count(athlete['athlete_id'])
+        if pending:
+            update_heatmap(athlete['athlete_id'])
+        backlog += pending
+    return backlog
+
+def build_tasks():
+    funcs = {
+        'webhooks': task_webhooks,
+        'deferrals': task_deferrals,
+        'backfill': task_backfill,
+        'analytics': task_analytics,
+        'fitness': task_fitness,
+        'heatmap': task_heatmap,
+    }
+    return [PeriodicTask(name, func, *SCHEDULER_INTERVALS[name]) for name, func in funcs.items()]
+
+def run_scheduler():
+    stop = {'flag': False}
+
+    def handle_stop(signum, frame):
+        print(f"[{datetime.now()}] Scheduler: signal {signum} received, finishing current task...")
+        stop['flag'] = True
+
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+
+    enable_connection_pool(maxconn=SCHEDULER_POOL_SIZE)
+
+    # Warm the caches used on every processed activity
+    from core.analysis import get_percentage_zones
+    get_percentage_zones('power')
+    get_percentage_zones('hr')
+
+    tasks = build_tasks()
+    print(f"🗓️ Scheduler started with tasks: {', '.join(t.name for t in tasks)}")
+
+    while not stop['flag']:
+        due = min(tasks, key=lambda t: t.next_run)
+        wait = due.next_run - time.monotonic()
+        if wait > 0:
+            # Sleep in short slices so a stop signal is honoured quickly
+            time.sleep(min(wait, 5))
+            continue
+        due.run()
+
+    print(f"[{datetime.now()}] Scheduler stopped.")
+
+
+if __name__ == "__main__":
+    print(f"\n{'='*60}")
+    print(f"Scheduler Started: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    run_scheduler()
+
+    print(f"{'='*60}\n")
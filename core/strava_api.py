@@ -1,9 +1,35 @@
 # core/strava_api.py
 
-import requests
+import requests, time, threading
 from datetime import datetime, timedelta
 from config import APP_STRAVA_CLIENT_ID, APP_STRAVA_CLIENT_SECRET, USER_STRAVA_REFRESH_TOKEN, STRAVA_TIMEOUT
 from core.database import db_mark_streams_missing
+from core.api_dispatcher import acquire_lane_slot, record_api_call, StravaLaneBlocked
+from core.circuit_breaker import (
+    check_breaker, record_success, record_failure, release_probe, backoff_delay, retry_after_seconds,
+    STRAVA_MAX_RETRIES, STRAVA_BACKOFF_MAX, RETRYABLE_STATUS
+)
+import config
+
+# Point these at scripts/fake_strava.py to run syncs and benchmarks offline
+STRAVA_API_BASE = getattr(config, 'STRAVA_API_BASE', 'https://www.strava.com/api/v3')
+STRAVA_OAUTH_BASE = getattr(config, 'STRAVA_OAUTH_BASE', 'https://www.strava.com/oauth')
+
+HISTORY_FETCH_CONCURRENCY = getattr(config, 'HISTORY_FETCH_CONCURRENCY', 4)
+HISTORY_BUDGET_RESERVE = getattr(config, 'HISTORY_BUDGET_RESERVE', 20)
+# Upper bound on how long a token is served from memory, so tokens replaced
+# by another process (re-login, deauthorization) are picked up in time
+TOKEN_CACHE_SECONDS = getattr(config, 'TOKEN_CACHE_SECONDS', 600)
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+# athlete_id -> (tokens dict, served until); per-athlete locks make the refresh single-flight
+_token_cache = {}
+_token_locks = {}
+_token_locks_guard = threading.Lock()
+
+# Last rate-limit headers seen by this process; seen_at (epoch seconds) lets the usage
+# figures expire at the window boundary after them (a blocked lane sends no new calls)
+rate_limit_state = {}
 
 def print_rate_limits(res):
     """Prints rate limits if available; stays silent if not."""
@@ -14,10 +40,38 @@ def print_rate_limits(res):
         try:
             l_15m, l_1d = limit.split(',')
             u_15m, u_1d = usage.split(',')
+            rate_limit_state.update({
+                'limit_15m': int(l_15m), 'limit_1d': int(l_1d),
+                'usage_15m': int(u_15m), 'usage_1d': int(u_1d),
+                'seen_at': time.time()
+            })
             print(f"\t📊 Rate limits: (15m) {u_15m}/{l_15m}, (1d) {u_1d}/{l_1d}")
         except (ValueError, IndexError):
             pass
 
+def header_usage():
+    """
+    (usage_15m, usage_1d) from the last headers, each 0 once its window has reset: Strava's
+    15-min windows start at :00/:15/:30/:45 and the daily one at midnight UTC.
+    """
+    seen_at = rate_limit_state.get('seen_at')
+    if seen_at is None:
+        return 0, 0
+    now = time.time()
+    usage_15m = rate_limit_state['usage_15m'] if now < (seen_at // 900 + 1) * 900 else 0
+    usage_1d = rate_limit_state['usage_1d'] if now < (seen_at // 86400 + 1) * 86400 else 0
+    return usage_15m, usage_1d
+
+def rate_budget_remaining():
+    """Requests left in the tighter of the 15-min and daily windows, or None if unknown."""
+    if not rate_limit_state:
+        return None
+    usage_15m, usage_1d = header_usage()
+    return min(
+        rate_limit_state['limit_15m'] - usage_15m,
+        rate_limit_state['limit_1d'] - usage_1d
+    )
+
 def refresh_strava_tokens(refresh_token):
     payload = {
         'client_id': APP_STRAVA_CLIENT_ID,
@@ -25,34 +79,145 @@ def refresh_strava_tokens(refresh_token):
         'refresh_token': refresh_token,
         'grant_type': 'refresh_token'
     }
-    res = requests.post("https://www.strava.com/oauth/token", data=payload)
+    res = send_with_retry('oauth', lambda: requests.post(f"{STRAVA_OAUTH_BASE}/token", data=payload, timeout=STRAVA_TIMEOUT), use_lane=False)
     res.raise_for_status()
     return res.json()
 
+def send_with_retry(endpoint, send, use_lane=True):
+    """
+    Runs send() (one HTTP call) behind the endpoint's circuit breaker (core/circuit_breaker.py).
+    Timeouts, 5xx and 429 are retried with jittered backoff or Retry-After; when retries run out,
+    or Strava asks to wait longer than STRAVA_BACKOFF_MAX, the last response is returned for the
+    caller's raise_for_status. Each attempt takes a slot in the caller's API lane before it may
+    claim the breaker's half-open probe, and a probe that ends without a verdict is released.
+    """
+    for attempt in range(STRAVA_MAX_RETRIES + 1):
+        lane, waited_ms = acquire_lane_slot() if use_lane else (None, 0)
+        probe = check_breaker(endpoint)
+        verdict = False
+
+        try:
+            started = time.monotonic()
+            try:
+                res = send()
+            except requests.RequestException as e:
+                if use_lane:
+                    record_api_call(lane, endpoint, None, int((time.monotonic() - started) * 1000), waited_ms)
+                record_failure(endpoint, e)
+                verdict = True
+                if attempt == STRAVA_MAX_RETRIES:
+                    raise
+                delay = backoff_delay(attempt)
+                print(f"\t↻ {endpoint}: {type(e).__name__}, retry {attempt + 1}/{STRAVA_MAX_RETRIES} in {delay:.1f}s")
+            else:
+                if use_lane:
+                    record_api_call(lane, endpoint, res.status_code, int((time.monotonic() - started) * 1000), waited_ms)
+                print_rate_limits(res)
+
+                if res.status_code not in RETRYABLE_STATUS:
+                    record_success(endpoint)
+                    verdict = True
+                    return res
+
+                # 5xx means Strava is unwell; 429 is our own budget and is left to the lanes
+                if res.status_code >= 500:
+                    record_failure(endpoint, f"HTTP {res.status_code}")
+                    verdict = True
+
+                delay = retry_after_seconds(res)
+                if delay is None:
+                    delay = backoff_delay(attempt)
+                if attempt == STRAVA_MAX_RETRIES or delay > STRAVA_BACKOFF_MAX:
+                    return res
+                print(f"\t↻ {endpoint}: HTTP {res.status_code}, retry {attempt + 1}/{STRAVA_MAX_RETRIES} in {delay:.1f}s")
+                res.close()
+        finally:
+            if probe and not verdict:
+                release_probe(endpoint)
+        time.sleep(delay)
+
+def strava_request(endpoint, url, access_token, params=None, timeout=STRAVA_TIMEOUT, stream=False):
+    """
+    GET against the Strava API in the caller's priority lane (core/api_dispatcher.py),
+    with retries and the endpoint's circuit breaker. Logs the call and tracks the rate-limit headers.
+    With stream=True the body is left unread (the caller must consume or close the response).
+    """
+    headers = {"Authorization": f"Bearer {access_token}"}
+    return send_with_retry(endpoint, lambda: requests.get(url, headers=headers, params=params, timeout=timeout, stream=stream))
+
+def _token_lock(athlete_id):
+    with _token_locks_guard:
+        return _token_locks.setdefault(athlete_id, threading.Lock())
+
+def _cache_tokens(athlete_id, tokens):
+    exp = tokens['expires_at']
+    expires_dt = datetime.fromtimestamp(exp) if isinstance(exp, (int, float)) else exp
+    served_until = min(expires_dt - TOKEN_REFRESH_MARGIN, datetime.now() + timedelta(seconds=TOKEN_CACHE_SECONDS))
+    _token_cache[athlete_id] = (tokens, served_until)
+
+def _cached_tokens(athlete_id):
+    entry = _token_cache.get(athlete_id)
+    if entry and entry[1] > datetime.now():
+        return entry[0]
+    return None
+
+def forget_access_token(athlete_id):
+    """Drops the in-process copy, e.g. after the tokens were replaced on login."""
+    _token_cache.pop(athlete_id, None)
+
 def get_valid_access_token(conn, athlete_id):
-    """Returns the full tokens dict, refreshing if necessary."""
-    from core.database import get_db_user_tokens, save_db_user_tokens
-    
-    row = get_db_user_tokens(conn, athlete_id)
-    if row:
+    """
+    Returns the full tokens dict, refreshing if necessary.
+    Served from memory while fresh. A refresh is single-flight: one thread per process
+    (per-athlete lock) and one process overall (row lock on users), the others reuse its result.
+    """
+    from core.database import get_db_user_tokens, lock_db_user_tokens, save_db_user_tokens
+
+    tokens = _cached_tokens(athlete_id)
+    if tokens:
+        return tokens
+
+    with _token_lock(athlete_id):
+        # Another thread may have refreshed while we waited
+        tokens = _cached_tokens(athlete_id)
+        if tokens:
+            return tokens
+
+        row = get_db_user_tokens(conn, athlete_id)
+        if not row:
+            print("\t⚠️ User not in DB. Using config refresh token...")
+            tokens = refresh_strava_tokens(USER_STRAVA_REFRESH_TOKEN)
+            save_db_user_tokens(conn, athlete_id, tokens)
+            return tokens
+
         access_token, refresh_token, expires_at = row
-        if expires_at > datetime.now() + timedelta(minutes=5):
+        if expires_at > datetime.now() + TOKEN_REFRESH_MARGIN:
             # We have fresh tokens, no need to hit Srava API at all
             # Return in the same format as the API response
-            return {'access_token': access_token, 'refresh_token': refresh_token, 'expires_at': expires_at}
-        
-        print("\t🔄 Token expired. Refreshing...")
-        tokens = refresh_strava_tokens(refresh_token)
-    else:
-        print("\t⚠️ User not in DB. Using config refresh token...")
-        tokens = refresh_strava_tokens(USER_STRAVA_REFRESH_TOKEN)
+            tokens = {'access_token': access_token, 'refresh_token': refresh_token, 'expires_at': expires_at}
+            _cache_tokens(athlete_id, tokens)
+            return tokens
+
+        # Row lock until commit: a concurrent process blocks here and then reads our new tokens
+        access_token, refresh_token, expires_at = lock_db_user_tokens(conn, athlete_id)
+        if expires_at > datetime.now() + TOKEN_REFRESH_MARGIN:
+            conn.commit()
+            print("\t🔄 Token already refreshed by another process.")
+            tokens = {'access_token': access_token, 'refresh_token': refresh_token, 'expires_at': expires_at}
+        else:
+            print("\t🔄 Token expired. Refreshing...")
+            try:
+                tokens = refresh_strava_tokens(refresh_token)
+            except Exception:
+                conn.rollback()
+                raise
+            save_db_user_tokens(conn, athlete_id, tokens)
 
-    save_db_user_tokens(conn, athlete_id, tokens)
-    return tokens
+        _cache_tokens(athlete_id, tokens)
+        return tokens
 
 def fetch_athlete_data(access_token):
-    headers = {"Authorization": f"Bearer {access_token}"}
-    res = requests.get("https://www.strava.com/api/v3/athlete", headers=headers)
+    res = strava_request('athlete', f"{STRAVA_API_BASE}/athlete", access_token)
     res.raise_for_status()
     return res.json()
 
@@ -61,28 +226,108 @@ def fetch_activity_detail(access_token, activity_id):
     Fetches a single activity's full summary/detail by its ID.
     Used for targeted updates from webhooks.
     """
-    headers = {"Authorization": f"Bearer {access_token}"}
-    url = f"https://www.strava.com/api/v3/activities/{activity_id}"
+    url = f"{STRAVA_API_BASE}/activities/{activity_id}"
     
-    res = requests.get(url, headers=headers, timeout=STRAVA_TIMEOUT)
+    res = strava_request('activity', url, access_token)
     res.raise_for_status()
-    
-    print_rate_limits(res)
     return res.json()
 
 def fetch_activities_list(access_token, params):
-    headers = {"Authorization": f"Bearer {access_token}"}
-    res = requests.get("https://www.strava.com/api/v3/athlete/activities", headers=headers, params=params, timeout=STRAVA_TIMEOUT)
+    res = strava_request('activities', f"{STRAVA_API_BASE}/athlete/activities", access_token, params=params)
     res.raise_for_status()
-    
-    print_rate_limits(res)
     return res.json()
 
+def fetch_activities_pages(access_token, params, max_pages=10, per_page=200, concurrency=HISTORY_FETCH_CONCURRENCY):
+    """
+    Fetches up to max_pages list pages for one cursor (before/after), several at a time.
+    Pages are consumed in order and the run stops at the first short page, the first error,
+    or when the rate budget runs low, so the result is always a contiguous range.
+    Returns (activities de-duplicated by id, reached_end).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import contextvars
+
+    merged = {}
+    page = 1
+    reached_end = False
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while page <= max_pages and not reached_end:
+            wave = min(concurrency, max_pages - page + 1)
+
+            budget = rate_budget_remaining()
+            if budget is not None:
+                wave = min(wave, budget - HISTORY_BUDGET_RESERVE)
+                if wave <= 0:
+                    print(f"\t⏸️ Rate budget low ({budget} left), stopping at page {page}.")
+                    break
+
+            # copy_context keeps the caller's API lane in the worker threads
+            futures = [
+                pool.submit(contextvars.copy_context().run, fetch_activities_list,
+                            access_token, {**params, "page": p, "per_page": per_page})
+                for p in range(page, page + wave)
+            ]
+
+            for offset, future in enumerate(futures):
+                try:
+                    data = future.result()
+                except StravaLaneBlocked as e:
+                    print(f"\t⏸️ Page {page + offset} not fetched: {e}")
+                    return list(merged.values()), False
+                except Exception as e:
+                    print(f"\t⚠️ Page {page + offset} failed: {e}")
+                    # Later pages of this wave would leave a gap, drop them
+                    return list(merged.values()), False
+
+                for a in data:
+                    merged[a['id']] = a
+
+                if len(data) < per_page:
+                    reached_end = True
+                    break
+
+            page += wave
+
+    return list(merged.values()), reached_end
+
+def fetch_activity_streams(access_token, activity_id, keys=None):
+    """
+    Downloads the streams of one activity as {channel: {'data': ndarray}}, only the given
+    channels (default: all, see core/stream_profiles.py).
+    Returns None when Strava has no streams for it; the activity is then marked as missing.
+    """
+    from core.stream_profiles import ALL_STREAM_KEYS
+    from core.stream_parser import parse_stream_chunks, STREAM_CHUNK_BYTES
+
+    # Note: Using 'velocity_smooth' as that is Strava's internal key for speed
+    stream_keys = ",".join(keys or ALL_STREAM_KEYS)
+    url = f"{STRAVA_API_BASE}/activities/{activity_id}/streams"
+    params = {
+        "keys": stream_keys,
+        "key_by_type": "true" 
+    }
+
+    res = strava_request('streams', url, access_token, params=params, stream=True)
+    try:
+        #if stream is missing, invalidate:
+        if res.status_code == 404:
+            print(f"\tℹ️ No streams found for {activity_id}. Marking as missing.")
+            db_mark_streams_missing(activity_id)
+            return None
+
+        res.raise_for_status()
+        # Decoded chunk by chunk into NumPy buffers instead of res.json()
+        return parse_stream_chunks(res.iter_content(chunk_size=STREAM_CHUNK_BYTES))
+    finally:
+        res.close()
+
 def sync_activity_streams(conn, athlete_id, activity_id, force=False):
     """
     Orchestrates fetching streams from Strava and saving them to the DB.
     """
     from core.database import save_db_activity_stream
+    from core.stream_profiles import stream_keys_for
     
     # 0. Check if streams already exist locally
     if not force:
@@ -96,37 +341,27 @@ def sync_activity_streams(conn, athlete_id, activity_id, force=False):
     # 1. Get valid token
     tokens = get_valid_access_token(conn, athlete_id)
     access_token = tokens['access_token']
-    
-    # 2. Define what we want to pull
-    # Note: Using 'velocity_smooth' as that is Strava's internal key for speed
-    stream_keys = "time,distance,velocity_smooth,heartrate,cadence,watts,temp,moving,altitude"
-    url = f"https://www.strava.com/api/v3/activities/{activity_id}/streams"
-    params = {
-        "keys": stream_keys,
-        "key_by_type": "true" 
-    }
-    headers = {"Authorization": f"Bearer {access_token}"}
 
-    try:
-        res = requests.get(url, headers=headers, params=params, timeout=STRAVA_TIMEOUT)
-
-        #if stream is missing, invalidate:
-        if res.status_code == 404:
-            print(f"\tℹ️ No streams found for {activity_id}. Marking as missing.")
-            db_mark_streams_missing(activity_id)
-            return False  
-
-        res.raise_for_status()
+    # 2. Only the channels this activity type's analytics use
+    with conn.cursor() as cur:
+        cur.execute("SELECT type FROM activities WHERE strava_id = %s", (activity_id,))
+        row = cur.fetchone()
+    keys = stream_keys_for(row[0] if row else None)
 
-        print_rate_limits(res)
-
-        streams_data = res.json()
+    try:
+        # 3. Pull the streams
+        streams_data = fetch_activity_streams(access_token, activity_id, keys=keys)
+        if streams_data is None:
+            return False
 
-        # 3. Save to Database
-        save_db_activity_stream(conn, activity_id, streams_data)
+        # 4. Save to Database
+        save_db_activity_stream(conn, activity_id, streams_data, stream_keys=keys)
         print(f"\tSaved streams for activity {activity_id}")
         return True
 
+    except StravaLaneBlocked:
+        # Not a stream problem: let the batch job stop instead of trying every activity
+        raise
     except Exception as e:
         print(f"\t❌ Failed to sync streams for {activity_id}: {e}")
         return False
@@ -136,11 +371,11 @@ def post_deauthorization(access_token):
     Revokes the current access token and deauthorizes the application.
     Important: This will trigger a webhook event from Strava (aspect_type='update', authorized='false').
     """
-    url = "https://www.strava.com/oauth/deauthorize"
+    url = f"{STRAVA_OAUTH_BASE}/deauthorize"
     headers = {"Authorization": f"Bearer {access_token}"}
     
     try:
-        res = requests.post(url, headers=headers, timeout=STRAVA_TIMEOUT)
+        res = send_with_retry('deauthorize', lambda: requests.post(url, headers=headers, timeout=STRAVA_TIMEOUT), use_lane=False)
         res.raise_for_status()
         return True
     except Exception as e:
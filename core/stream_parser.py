@@ -0,0 +1,139 @@
+# core/stream_parser.py
+
+# Incremental parser for Strava's key_by_type stream responses.
+# res.json() on a long ride builds millions of Python ints/floats before anything is stored.
+# Here the response is consumed chunk by chunk and every "data" array is decoded straight into
+# a NumPy buffer (np.fromstring on the number text), so the only Python objects are the chunks.
+# The buffers are written by the ndarray adapters in core/database.py, again without lists.
+#
+#   streams = parse_stream_chunks(res.iter_content(chunk_size=STREAM_CHUNK_BYTES))
+#   streams['watts']['data']  -> np.ndarray
+
+import codecs, re
+import numpy as np
+
+STREAM_CHUNK_BYTES = 64 * 1024
+
+INT_CHANNELS = {'time', 'heartrate', 'cadence', 'watts', 'temp'}
+BOOL_CHANNELS = {'moving'}
+
+_DATA_START = re.compile(r'"data"\s*:\s*\[')
+_STREAM_KEY = re.compile(r'"(\w+)"\s*:\s*\{')
+_LATLNG_END = re.compile(r'\]\s*\]')
+
+class _GrowBuffer:
+    """float64 buffer with amortised doubling; sized from the previous stream when known."""
+
+    def __init__(self, capacity):
+        self.values = np.empty(max(capacity, 1024), dtype=np.float64)
+        self.size = 0
+
+    def extend(self, chunk):
+        needed = self.size + len(chunk)
+        if needed > len(self.values):
+            grown = np.empty(max(needed, len(self.values) * 2), dtype=np.float64)
+            grown[:self.size] = self.values[:self.size]
+            self.values = grown
+        self.values[self.size:needed] = chunk
+        self.size = needed
+
+    def view(self):
+        return self.values[:self.size]
+
+class StreamParser:
+    """Feed text chunks with feed(); read the result from .streams after close()."""
+
+    def __init__(self):
+        self.streams = {}
+        self.outside = ''
+        self.key = None
+        self.in_data = False
+        self.pending = ''
+        self.buffer = None
+        self.expected = 0  # all channels of one activity have the same length
+
+    def feed(self, text):
+        while text:
+            if not self.in_data:
+                # Metadata between arrays is tiny, keep it until the next "data": [
+                self.outside += text
+                text = ''
+                m = _DATA_START.search(self.outside)
+                if not m:
+                    break
+                keys = _STREAM_KEY.findall(self.outside[:m.start()])
+                if keys:
+                    self.key = keys[-1]
+                text = self.outside[m.end():]
+                self.outside = ''
+                self.in_data = True
+                self.pending = ''
+                self.buffer = _GrowBuffer(self.expected * (2 if self.key == 'latlng' else 1))
+                continue
+
+            data = self.pending + text
+            text = ''
+            if self.key == 'latlng':
+                end = _LATLNG_END.search(data)
+                body, rest = (data[:end.start()], data[end.end():]) if end else (None, None)
+            else:
+                end = data.find(']')
+                body, rest = (data[:end], data[end + 1:]) if end >= 0 else (None, None)
+
+            if body is None:
+                # Only whole numbers: parse up to the last comma, keep the tail
+                cut = data.rfind(',')
+                if cut >= 0:
+                    self._parse_numbers(data[:cut])
+                    self.pending = data[cut + 1:]
+                else:
+                    self.pending = data
+                break
+
+            self._parse_numbers(body)
+            self._finish_stream()
+            text = rest
+
+    def _parse_numbers(self, s):
+        if self.key == 'latlng':
+            s = s.replace('[', '').replace(']', '')
+        if self.key in BOOL_CHANNELS:
+            s = s.replace('true', '1').replace('false', '0')
+        s = s.replace('null', 'nan').strip(' ,\n')
+        if s:
+            self.buffer.extend(np.fromstring(s, dtype=np.float64, sep=','))
+
+    def _finish_stream(self):
+        values = self.buffer.view()
+        key = self.key
+
+        if key == 'latlng':
+            data = values.reshape(-1, 2).copy()
+        elif key in BOOL_CHANNELS:
+            data = values.astype(bool)
+        elif key in INT_CHANNELS:
+            missing = np.isnan(values)
+            data = np.nan_to_num(values).astype(np.int64)
+            if missing.any():
+                data = np.ma.masked_array(data, missing)
+        else:
+            data = values.copy()
+
+        self.streams[key] = {'data': data}
+        self.expected = max(self.expected, len(values) if key != 'latlng' else len(values) // 2)
+        self.in_data = False
+        self.buffer = None
+
+    def close(self):
+        if self.in_data:
+            raise ValueError(f"Truncated stream response (inside '{self.key}')")
+        return self.streams
+
+def parse_stream_chunks(chunks):
+    """Parses an iterable of byte chunks (e.g. res.iter_content) into {channel: {'data': ndarray}}."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    parser = StreamParser()
+    for chunk in chunks:
+        parser.feed(decoder.decode(chunk))
+    parser.feed(decoder.decode(b'', final=True))
+    return parser.close()
@@ -0,0 +1,91 @@
+# core/stream_profiles.py
+
+# Which Strava stream channels to download per activity type. Only the channels the analytics
+# (core/processor.py) and the activity page use are requested, e.g. no altitude for VirtualRide,
+# no watts for IGNORE_POWER_ACTIVITY types. The requested set is stored in
+# activity_streams.stream_keys; anything left out can be fetched later:
+#   ./venv/bin/python3 -u -m core.stream_profiles <activity_id> temp,moving
+
+import sys
+from core.database import run_query, get_db_connection, stream_channel_value
+from core.queries import SQL_ACTIVITY_STREAM_KEYS
+import config
+
+ALL_STREAM_KEYS = ['time', 'distance', 'velocity_smooth', 'heartrate', 'cadence', 'watts', 'temp', 'moving', 'altitude']
+
+# activity_streams column per Strava channel
+STREAM_COLUMNS = {
+    'time': 'time_series', 'distance': 'distance_series', 'velocity_smooth': 'velocity_series',
+    'heartrate': 'heartrate_series', 'cadence': 'cadence_series', 'watts': 'watts_series',
+    'temp': 'temp_series', 'moving': 'moving_series', 'latlng': 'latlng_series', 'altitude': 'altitude_series',
+}
+
+# Unlisted types get ALL_STREAM_KEYS
+STREAM_PROFILES = getattr(config, 'STREAM_PROFILES', {
+    'Ride':        ['time', 'distance', 'velocity_smooth', 'heartrate', 'cadence', 'watts', 'altitude'],
+    'GravelRide':  ['time', 'distance', 'velocity_smooth', 'heartrate', 'cadence', 'watts', 'altitude'],
+    'MountainBikeRide': ['time', 'distance', 'velocity_smooth', 'heartrate', 'cadence', 'watts', 'altitude'],
+    'VirtualRide': ['time', 'distance', 'velocity_smooth', 'heartrate', 'cadence', 'watts'],
+    'Run':         ['time', 'distance', 'velocity_smooth', 'heartrate', 'cadence', 'watts', 'altitude'],
+    'Walk':        ['time', 'distance', 'heartrate', 'altitude'],
+    'Hike':        ['time', 'distance', 'heartrate', 'altitude'],
+})
+
+def stream_keys_for(activity_type):
+    """Channels to request for an activity type."""
+    keys = list(STREAM_PROFILES.get(activity_type, ALL_STREAM_KEYS))
+    if activity_type in config.IGNORE_POWER_ACTIVITY and 'watts' in keys:
+        keys.remove('watts')
+    return keys
+
+def fetch_stream_channels(athlete_id, activity_id, channels):
+    """
+    Downloads channels that were left out by the activity's profile and adds them
+    to its activity_streams row. Returns the channels that were added.
+    """
+    from core.strava_api import get_valid_access_token, fetch_activity_streams
+
+    rows = run_query(SQL_ACTIVITY_STREAM_KEYS, (activity_id,))
+    if not rows:
+        raise ValueError(f"No streams stored for activity {activity_id}")
+
+    stored = set(rows[0]['stream_keys'] or ALL_STREAM_KEYS)
+    missing = [c for c in channels if c in STREAM_COLUMNS and c not in stored]
+    if not missing:
+        return []
+
+    conn = get_db_connection()
+    try:
+        tokens = get_valid_access_token(conn, athlete_id)
+        streams = fetch_activity_streams(tokens['access_token'], activity_id, keys=missing)
+        if not streams:
+            return []
+
+        assignments = ", ".join(f"{STREAM_COLUMNS[c]} = %s" for c in missing)
+        with conn.cursor() as cur:
+            cur.execute(
+                f"UPDATE activity_streams SET {assignments}, "
+                f"stream_keys = ARRAY(SELECT DISTINCT unnest(COALESCE(stream_keys, %s::text[]) || %s::text[])), "
+                f"updated_at = NOW() WHERE strava_id = %s",
+                [stream_channel_value(streams, c) for c in missing] + [ALL_STREAM_KEYS, missing, activity_id]
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+    print(f"\t🧩 Activity {activity_id}: added channels {', '.join(missing)}")
+    return missing
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python -m core.stream_profiles <activity_id> <channel,channel,...>")
+        sys.exit(1)
+
+    activity_id = int(sys.argv[1])
+    res = run_query("SELECT athlete_id FROM activities WHERE strava_id = %s", (activity_id,))
+    if not res:
+        print(f"Activity {activity_id} not found.")
+        sys.exit(1)
+
+    fetch_stream_channels(res[0]['athlete_id'], activity_id, sys.argv[2].split(','))
@@ -0,0 +1,141 @@
+# core/webhook_events.py
+
+# Strava sends bursts of 'update' events for the same activity (rename, description, gear...).
+# Events are stored in webhook_events and drained after a quiet period, so a burst turns into
+# one sync_single_activity call. Deletes are applied immediately and cancel pending updates.
+# The webhook route only stores events; the scheduler's webhook task drains them.
+# A failed sync is marked 'failed' in the trail.
+#
+# Single activity (manual):
+#   ./venv/bin/python3 -u -m core.webhook_events <activity_id>
+# Sweep of everything that is due (safe to run from cron as a fallback):
+#   ./venv/bin/python3 -u -m core.webhook_events
+
+import sys, time
+from datetime import datetime
+from core.database import (
+    run_query, run_query_returning, save_db_webhook_event, claim_db_webhook_events
+)
+from core.queries import (
+    SQL_CANCEL_PENDING_WEBHOOK_UPDATES,
+    SQL_WEBHOOK_DUE_ACTIVITIES,
+    SQL_FINISH_WEBHOOK_EVENTS,
+    SQL_APPLY_WEBHOOK_TITLE,
+    SQL_RECLAIM_STALE_WEBHOOK_EVENTS
+)
+from core.api_dispatcher import api_lane, StravaLaneBlocked, WEBHOOK_CLAIM_TIMEOUT
+import config
+
+WEBHOOK_DEBOUNCE_SECONDS = getattr(config, 'WEBHOOK_DEBOUNCE_SECONDS', 60)
+
+# Update keys that never touch streams or analytics ('private' is not stored separately)
+METADATA_ONLY_UPDATES = {'title', 'private'}
+
+def record_webhook_event(event):
+    """
+    Stores the incoming event. Returns the event id, or None for a duplicate delivery.
+    A delete cancels any updates still waiting in the debounce window.
+    """
+    event_id = save_db_webhook_event(event)
+
+    if event_id and event.get('object_type') == 'activity' and event.get('aspect_type') == 'delete':
+        cancelled = run_query(SQL_CANCEL_PENDING_WEBHOOK_UPDATES, (event.get('object_id'),))
+        if cancelled:
+            print(f"[{datetime.now()}] WEBHOOK: Cancelled {cancelled} pending update(s) for deleted activity {event.get('object_id')}.")
+
+    return event_id
+
+def finish_webhook_events(event_ids, status='done'):
+    if event_ids:
+        run_query(SQL_FINISH_WEBHOOK_EVENTS, (status, list(event_ids)))
+
+def apply_metadata_only(activity_id, claimed):
+    """
+    Applies a burst of title/privacy edits locally, without any Strava call.
+    Returns False if the burst carries anything else (or the activity is unknown).
+    """
+    if not all(
+        r['aspect_type'] == 'update' and r['updates'] and set(r['updates']) <= METADATA_ONLY_UPDATES
+        for r in claimed
+    ):
+        return False
+
+    titles = [r['updates']['title'] for r in sorted(claimed, key=lambda r: r['id']) if 'title' in r['updates']]
+    if titles:
+        if not run_query_returning(SQL_APPLY_WEBHOOK_TITLE, (titles[-1], titles[-1], activity_id)):
+            return False
+    print(f"\t✏️ Activity {activity_id}: metadata-only update applied locally.")
+    return True
+
+def process_activity_events(activity_id, debounce_seconds=WEBHOOK_DEBOUNCE_SECONDS):
+    """
+    Coalesces all pending create/update events of one activity into a single sync.
+    Returns False when the burst is still active (a later drain will pick it up).
+    """
+    from run_sync import sync_single_activity
+
+    claimed = claim_db_webhook_events(activity_id, debounce_seconds)
+    if not claimed:
+        return False
+
+    event_ids = [r['id'] for r in claimed]
+    athlete_id = claimed[0]['owner_id']
+    print(f"\t🪝 Activity {activity_id}: {len(event_ids)} webhook event(s) coalesced into one sync.")
+
+    try:
+        if apply_metadata_only(activity_id, claimed):
+            finish_webhook_events(event_ids, 'done')
+            return True
+    except Exception as e:
+        print(f"\t⚠️ Local metadata update failed for {activity_id}, falling back to a sync: {e}")
+
+    try:
+        # False = the athlete is locked by another run; the sync was re-queued in run_deferrals
+        with api_lane('webhook'):
+            synced = sync_single_activity(athlete_id, activity_id, raise_errors=True)
+        finish_webhook_events(event_ids, 'deferred' if synced is False else 'done')
+    except StravaLaneBlocked as e:
+        # Out of API budget: back to pending, the next drain retries
+        print(f"\t⏸️ Webhook sync for {activity_id} postponed: {e}")
+        finish_webhook_events(event_ids, 'pending')
+    except Exception as e:
+        print(f"\t❌ Webhook sync failed for {activity_id}: {e}")
+        finish_webhook_events(event_ids, 'failed')
+
+    return True
+
+def drain_webhook_events(debounce_seconds=WEBHOOK_DEBOUNCE_SECONDS):
+    """Processes every activity whose pending events have been quiet for the debounce window."""
+    reclaimed = run_query(SQL_RECLAIM_STALE_WEBHOOK_EVENTS, (WEBHOOK_CLAIM_TIMEOUT,))
+    if reclaimed:
+        print(f"\t♻️ {reclaimed} abandoned webhook claim(s) returned to pending.")
+
+    due = run_query(SQL_WEBHOOK_DUE_ACTIVITIES, (debounce_seconds,))
+
+    if not due:
+        print("\t∅ No webhook events due.")
+        return 0
+
+    processed = 0
+    for row in due:
+        if process_activity_events(row['object_id'], debounce_seconds):
+            processed += 1
+    return processed
+
+
+if __name__ == "__main__":
+    print(f"\n{'='*60}")
+    print(f"Webhook Drain Started: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    if len(sys.argv) > 1:
+        # Wait out the debounce window; if another event lands meanwhile,
+        # the claim finds the burst still active and the newer drain handles it.
+        activity_id = int(sys.argv[1])
+        time.sleep(WEBHOOK_DEBOUNCE_SECONDS + 1)
+        if not process_activity_events(activity_id):
+            print(f"\t⏳ Activity {activity_id}: newer events pending or already handled, skipping.")
+    else:
+        drain_webhook_events()
+
+    print(f"Webhook Drain Finished: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"{'='*60}\n")
@@ -0,0 +1,46 @@
+# core/work_leases.py
+
+# Work leasing so several crawler processes (overlapping cron runs, multiple hosts)
+# can drain the backlogs in parallel without doing the same rows twice.
+#   - crawler backlog: leased per activity row (SELECT ... FOR UPDATE SKIP LOCKED)
+#   - analytics queue: leased per athlete, keeping the chronological recompute order
+# Leases expire on their own, so a crashed worker only delays its rows.
+
+import os, socket
+from core.database import run_query, run_query_returning
+from core.queries import (
+    SQL_CLAIM_CRAWLER_BACKLOG, SQL_RELEASE_CRAWLER_LEASES,
+    SQL_CLAIM_ANALYTICS_LEASE, SQL_RENEW_ANALYTICS_LEASE, SQL_RELEASE_ANALYTICS_LEASE
+)
+import config
+
+CRAWL_LEASE_SECONDS = getattr(config, 'CRAWL_LEASE_SECONDS', 1800)
+ANALYTICS_LEASE_SECONDS = getattr(config, 'ANALYTICS_LEASE_SECONDS', 900)
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+def claim_crawler_backlog(athlete_id, since_date, limit):
+    """Leases up to `limit` backlog activities of an athlete, newest first."""
+    rows = run_query_returning(SQL_CLAIM_CRAWLER_BACKLOG, (
+        CRAWL_LEASE_SECONDS, WORKER_ID, athlete_id, since_date, limit
+    ))
+    # RETURNING has no ORDER BY, restore the backlog order
+    rows.sort(key=lambda r: r['start_date_local'], reverse=True)
+    return rows
+
+def release_crawler_leases(strava_ids):
+    if strava_ids:
+        run_query(SQL_RELEASE_CRAWLER_LEASES, (list(strava_ids), WORKER_ID))
+
+def claim_analytics_lease(athlete_id):
+    """Returns True if this worker now owns the analytics queue of the athlete."""
+    rows = run_query_returning(SQL_CLAIM_ANALYTICS_LEASE, (
+        ANALYTICS_LEASE_SECONDS, WORKER_ID, athlete_id, WORKER_ID
+    ))
+    return bool(rows)
+
+def renew_analytics_lease(athlete_id):
+    run_query(SQL_RENEW_ANALYTICS_LEASE, (ANALYTICS_LEASE_SECONDS, athlete_id, WORKER_ID))
+
+def release_analytics_lease(athlete_id):
+    run_query(SQL_RELEASE_ANALYTICS_LEASE, (athlete_id, WORKER_ID))
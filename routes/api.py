@@ -1,5 +1,6 @@
 # # routes/api.py
-from flask import Blueprint, jsonify, session
+import gzip
+from flask import Blueprint, jsonify, session, request, abort, Response
 from core.database import run_query
 from core.queries import SQL_DAILY_ACTIVITIES
 from routes.auth import login_required
@@ -19,6 +20,54 @@ def get_monthly_activities(month_year):
     data = run_query(SQL_DAILY_ACTIVITIES, (athlete_id, month_year))
     return jsonify(data)
 
+@api_bp.route('/activity/<int(signed=True):strava_id>/streams')
+@login_required
+def get_activity_streams(strava_id):
+    """
+    Smoothed, LTTB-downsampled chart series (core/chart_streams.py).
+    /api/activity/<id>/streams?points=1200&channels=watts,heartrate
+    """
+    from core.chart_streams import get_chart_streams, DEFAULT_CHANNELS
+
+    points = request.args.get('points', default=1200, type=int)
+    channels = request.args.get('channels')
+    channels = [c.strip() for c in channels.split(',') if c.strip()] if channels else DEFAULT_CHANNELS
+
+    data = get_chart_streams(strava_id, session.get('athlete_id'), points=max(points, 3), channels=channels)
+    if data is None:
+        abort(404, description=f"No streams for activity {strava_id}.")
+
+    # Streams only change on a re-sync: let the browser revalidate instead of re-downloading
+    etag = f'"{strava_id}-{data["version"]}-{data["points"]}-{",".join(sorted(data["channels"]))}"'
+    if request.headers.get('If-None-Match') == etag:
+        return '', 304
+
+    response = jsonify(data)
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@api_bp.route('/activity/<int(signed=True):strava_id>/render')
+@login_required
+def get_activity_render_payload(strava_id):
+    """Precomputed page payload (core/render_payload.py): one keyed read, gzip passed through."""
+    from core.render_payload import get_render_payload
+
+    stored = get_render_payload(strava_id, session.get('athlete_id'))
+    if stored is None:
+        abort(404, description=f"Activity {strava_id} not found.")
+    etag, body = stored
+
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': 'private, no-cache', 'Vary': 'Accept-Encoding'}
+    if request.headers.get('If-None-Match') == f'"{etag}"':
+        return Response(status=304, headers=headers)
+
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        headers['Content-Encoding'] = 'gzip'
+    else:
+        body = gzip.decompress(body)
+    return Response(body, mimetype='application/json', headers=headers)
+
 # Reserved for your future idea:
 @api_bp.route('/activities/range')
 def get_activities_range():
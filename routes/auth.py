@@ -9,6 +9,7 @@ import json, os
 from datetime import datetime
 import subprocess
 from run_sync import run_sync
+from core.strava_api import forget_access_token
 
 """
 strava responded with:
@@ -104,6 +105,7 @@ def strava_callback():
     conn = get_db_connection()
     try:
         is_new_user = save_db_user_profile(conn, athlete_data, token_data)
+        forget_access_token(athlete_id)
         session['athlete_id'] = athlete_id
 
         # ------------ NEW USER TIRGGER ACTIVITY LOAD -------------------
@@ -156,7 +158,8 @@ def disconnect():
     athlete_id = session.get('athlete_id')
     
     from core.database import get_db_connection, delete_db_user_data
-    from core.strava_api import get_valid_access_token, post_deauthorization
+    from core.strava_api import get_valid_access_token, post_deauthorization, forget_access_token
+    from core.athlete_globals import invalidate_athlete_globals
 
     conn = get_db_connection()
     try:
@@ -164,10 +167,12 @@ def disconnect():
         tokens = get_valid_access_token(conn, athlete_id)
         if tokens:
             post_deauthorization(tokens['access_token'])
+            forget_access_token(athlete_id)
             #print("TEST WARNING: User deauthorized triggered")
         
         # 2. Wipe local database for this user
         delete_db_user_data(athlete_id)
+        invalidate_athlete_globals(athlete_id)
         #print("TEST WARNING: User DB cleanup triggered")
         
         # 3. Clear session
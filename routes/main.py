@@ -1,23 +1,25 @@
 # routes/main.py
 import os
-import csv, io
 import json
+from itertools import chain
+from functools import partial
 from flask import (
     Blueprint, render_template, request, Response, jsonify,
     session, current_app, flash, redirect, url_for, abort
 )
 from datetime import datetime, timedelta
 from config import LOG_PATH
-from core.database import run_query, get_db_zone_for_value, get_athlete_ftp
-from core.analysis import get_best_power_curve, get_performance_summary, get_zone_descriptions
+from core.database import run_query, stream_query, get_athlete_ftp
+from core.analysis import get_performance_summary, get_zone_descriptions
 from routes.auth import login_required
 from core.processor import format_activities_to_markdown
+from core.exports import iter_export, gzip_chunks, EXPORT_MIMETYPES, EXPORT_GZIP
+from core.activity_page import load_activity_page
+from core.response_cache import cached_page, get_response_cache_stats
 from core.queries import (
     SQL_GET_ACTIVITY_TYPES_BY_COUNT, 
     SQL_MONTHLY_ACTIVITY_METRICS,
     SQL_ACTIVITY_DETAILS,
-    SQL_PREVIOUS_ACTIVITY_ID,
-    SQL_NEXT_ACTIVITY_ID,
     SQL_DAILY_ACTIVITIES_HISTORY,
     SQL_RAW_DATA,
     SQL_GET_USER_SETTINGS,
@@ -26,12 +28,16 @@ from core.queries import (
     SQL_ADMIN_CRAWLER_ACTIVITIES_BACKLOG, 
     SQL_ADMIN_CRAWLER_ANALYTICS_BACKLOG,
     SQL_DB_SIZE, SQL_TABLE_STATS,
-    SQL_GET_LATEST_ACTIVITY_ID
+    SQL_GET_LATEST_ACTIVITY_ID,
+    SQL_ADMIN_RUN_CONTENTION,
+    SQL_ADMIN_API_LANES,
+    SQL_ADMIN_API_BREAKERS, SQL_ADMIN_INGEST_STAGES
 )
 
 main_bp = Blueprint('main', __name__)
 
 @main_bp.route('/')
+@cached_page('index')
 def index():
     athlete_id = session.get('athlete_id')
     if not athlete_id:
@@ -51,6 +57,7 @@ def index():
 
 @main_bp.route('/dashboard')
 @login_required
+@cached_page('dashboard')
 def dashboard():
 
     athlete_id = session.get('athlete_id')
@@ -64,63 +71,26 @@ def dashboard():
     )
 
 @main_bp.route('/activity/', defaults={'strava_id': None})
-@main_bp.route('/activity/<int:strava_id>')
+@main_bp.route('/activity/<int(signed=True):strava_id>')
 @login_required
 def activity_detail(strava_id):
     athlete_id = session.get('athlete_id')
 
-    # If no ID is provided, find the latest one dynamically
-    if strava_id is None:
-        last_act_data = run_query(SQL_GET_LATEST_ACTIVITY_ID, (athlete_id,))
-        if last_act_data:
-            strava_id = last_act_data[0]['strava_id']
-        else:
+    # One round trip for the activity and everything around it (core/activity_page.py)
+    page = load_activity_page(athlete_id, strava_id)
+    if page is None:
+        if strava_id is None:
             abort(404, description="No activities found for your profile.")
-        
-    results = run_query(SQL_ACTIVITY_DETAILS, (strava_id,))
-
-    if not results:
         abort(404, description=f"Activity details for ID {strava_id} not found.")
-    activity = results[0] if results else None
-
-    #0. Get the laps:
-    laps = []
-    if activity['resource_state'] == 3:
-        laps_sql = """
-            SELECT * FROM activity_laps 
-            WHERE strava_id = %s 
-              AND is_hidden = FALSE
-            ORDER BY start_index ASC
-        """
-        laps = run_query(laps_sql, (strava_id,))
-    
-    # 1. Fetch the current ride's date first
-    current_ride = run_query("SELECT start_date_local FROM activities WHERE strava_id = %s", (strava_id,))
-    
-    if current_ride:
-        curr_date = current_ride[0]['start_date_local']
-        
-        recent_sql = """
-            (SELECT strava_id, substr(name,1,30) as name, type, start_date_local 
-             FROM activities 
-             WHERE athlete_id = %s AND start_date_local <= %s
-             ORDER BY start_date_local DESC LIMIT 10)
-            UNION
-            (SELECT strava_id, substr(name,1,30) as name, type, start_date_local 
-             FROM activities 
-             WHERE athlete_id = %s AND start_date_local > %s
-             ORDER BY start_date_local ASC LIMIT 10)
-            ORDER BY start_date_local DESC
-        """
-        recent_activities = run_query(recent_sql, (athlete_id, curr_date, athlete_id, curr_date))
-    else:
-        recent_activities = []
-    
+    activity = page['activity']
+
     export_format = request.args.get('export')
-    if export_format == 'json':
-        return jsonify(activity)
-    elif export_format == 'csv':
-        return export_to_csv([activity]) # Reusing the list-based exporter
+    if export_format in ('json', 'csv'):
+        # Exports keep the raw stream arrays the page itself no longer loads
+        activity = run_query(SQL_ACTIVITY_DETAILS, (activity['strava_id'],))[0]
+        if export_format == 'json':
+            return jsonify(activity)
+        return export_response([activity], 'csv', f"activity_{activity['strava_id']}.csv")
 
     # Map pre-calculated DB columns to the UI structure
     activity['interval_bests'] = {
@@ -130,38 +100,6 @@ def activity_detail(strava_id):
         '20m': {'power': activity.get('peak_20m'), 'hr': activity.get('peak_20m_hr')}
     }
 
-    # Prev/Next logic stays the same
-    prev_res = run_query(SQL_PREVIOUS_ACTIVITY_ID, (athlete_id, strava_id))
-    next_res = run_query(SQL_NEXT_ACTIVITY_ID, (athlete_id, strava_id))
-    prev_id = prev_res[0]['strava_id'] if prev_res else None
-    next_id = next_res[0]['strava_id'] if next_res else None
-
-    #get the best power curve:
-    best_curve = get_best_power_curve(athlete_id, months=12)
-
-    fitness_sql = """
-        SELECT date, ctl, atl, tsb 
-        FROM athlete_daily_metrics 
-        WHERE athlete_id = %s 
-          AND date <= %s::date
-        ORDER BY date DESC
-        LIMIT 2
-    """
-    fitness_res = run_query(fitness_sql, (athlete_id, activity['start_date_local']))
-    
-    fitness_data = fitness_res[0] if len(fitness_res) > 0 else {}
-    yesterday_data = fitness_res[1] if len(fitness_res) > 1 else None
-
-    current_tsb = fitness_data.get('tsb')
-    tsb_zone = get_db_zone_for_value('tsb',current_tsb)
-
-    # Calculate deltas
-    deltas = {}
-    if yesterday_data:
-        for metric in ['ctl', 'atl', 'tsb']:
-            if fitness_data.get(metric) is not None and yesterday_data.get(metric) is not None:
-                deltas[metric] = fitness_data[metric] - yesterday_data[metric]
-
     zone_ranges = get_zone_descriptions(
         activity.get('baseline_ftp'), 
         activity.get('baseline_max_hr')
@@ -170,19 +108,20 @@ def activity_detail(strava_id):
     return render_template(
         'activity_detail.html', 
         activity=activity, 
-        prev_id=prev_id, 
-        next_id=next_id,
-        best_power=best_curve,
-        recent_activities=recent_activities,
-        fitness=fitness_data,
-        fitness_deltas=deltas,
-        tsb_zone=tsb_zone,
+        prev_id=page['prev_id'], 
+        next_id=page['next_id'],
+        best_power=page['best_power'],
+        recent_activities=page['recent_activities'],
+        fitness=page['fitness'],
+        fitness_deltas=page['fitness_deltas'],
+        tsb_zone=page['tsb_zone'],
         zone_ranges=zone_ranges,
-        laps=laps
+        laps=page['laps']
     )
 
 @main_bp.route('/performance')
 @login_required
+@cached_page('performance', args=('months',))
 def performance_dashboard():
     athlete_id = session.get('athlete_id')
     
@@ -207,21 +146,21 @@ def activities_list():
     date_to = request.args.get('to') or datetime.now().strftime('%Y-%m-%d')
     export_format = request.args.get('export')
 
-    # Fetch activities with filters
-    activities = run_query(SQL_DAILY_ACTIVITIES_HISTORY, (
+    params = (
         athlete_id, 
         activity_type, activity_type, 
         date_from, 
         f"{date_to} 23:59:59"
-    ))
-    #print(activities)
+    )
 
-    # Handle Export logic before rendering anything else
-    if export_format == 'csv':
-        return export_to_csv(activities)
-    elif export_format == 'json':
-        # Use a string conversion for datetime objects in JSON
-        return jsonify(activities)
+    # Handle Export logic before rendering anything else: streamed from a server-side cursor
+    if export_format in ('csv', 'ndjson', 'json'):
+        filename = f"activities_{datetime.now().strftime('%Y%m%d')}.{export_format}" if export_format != 'json' else None
+        empty = Response("[]", mimetype='application/json') if export_format == 'json' else ("No data to export", 400)
+        return export_response(stream_query(SQL_DAILY_ACTIVITIES_HISTORY, params), export_format, filename, empty)
+
+    # Fetch activities with filters
+    activities = run_query(SQL_DAILY_ACTIVITIES_HISTORY, params)
 
     # Use your existing query for the dropdown, ordered by count
     activity_types = run_query(SQL_GET_ACTIVITY_TYPES_BY_COUNT, (athlete_id,))
@@ -271,11 +210,13 @@ def show_logs():
 @login_required
 def settings():
     athlete_id = session.get('athlete_id')
+    from core.athlete_globals import invalidate_athlete_globals
     
     # Handle the Reset/Clear action
     if request.args.get('clear') == 'true':
         from core.database import update_user_manual_settings
         update_user_manual_settings(athlete_id, clear_manual=True)
+        invalidate_athlete_globals(athlete_id)
         flash("Manual overrides cleared. Reverting to system detection.", "info")
         return redirect(url_for('main.settings'))
 
@@ -287,6 +228,7 @@ def settings():
         
         from core.database import update_user_manual_settings
         update_user_manual_settings(athlete_id, ftp=ftp, max_hr=max_hr, weight=weight)
+        invalidate_athlete_globals(athlete_id)
         
         # 2. Flash the message
         flash("Settings updated successfully!", "success")
@@ -314,6 +256,7 @@ def settings():
 # --------------------------------------------------------------------------------
 @main_bp.route('/fitness')
 @login_required
+@cached_page('fitness', args=('days',))
 def fitness_dashboard():
     athlete_id = session.get('athlete_id')
     days = request.args.get('days', default=30, type=int)
@@ -463,7 +406,7 @@ def fitness_dashboard():
     )
 
 # --------------------------------------------------------------------------------
-@main_bp.route('/laps-editor/<int:strava_id>')
+@main_bp.route('/laps-editor/<int(signed=True):strava_id>')
 def laps_editor(strava_id):
     # Fetch the specific activity data
     activity_results = run_query("SELECT * FROM activities WHERE strava_id = %s", (strava_id,))
@@ -501,6 +444,15 @@ def admin_dashboard():
     overview = run_query(SQL_ADMIN_OVERVIEW)
     crawler = run_query(SQL_ADMIN_CRAWLER_ACTIVITIES_BACKLOG, (history_days,))
     analytics = run_query(SQL_ADMIN_CRAWLER_ANALYTICS_BACKLOG)
+    contention = run_query(SQL_ADMIN_RUN_CONTENTION)
+
+    # Strava API usage per priority lane, listed in priority order even when idle
+    from core.api_dispatcher import LANES, STRAVA_LANE_QUOTAS
+    lane_stats = {r['lane']: r for r in run_query(SQL_ADMIN_API_LANES)}
+    api_lanes = [{'lane': l, 'quota': STRAVA_LANE_QUOTAS.get(l, 1.0), **lane_stats.get(l, {})} for l in LANES]
+    breakers = run_query(SQL_ADMIN_API_BREAKERS)
+    ingest_stages = run_query(SQL_ADMIN_INGEST_STAGES)
+    response_cache = get_response_cache_stats()
     
     db_size_res = run_query(SQL_DB_SIZE)
     db_size = db_size_res[0]['total_db_size'] if db_size_res else "N/A"
@@ -513,6 +465,11 @@ def admin_dashboard():
                            overview=overview, 
                            crawler=crawler, 
                            analytics=analytics,
+                           contention=contention,
+                           api_lanes=api_lanes,
+                           breakers=breakers,
+                           ingest_stages=ingest_stages,
+                           response_cache=response_cache,
                            history_days=history_days,
                            db_size=db_size,
                            table_stats=table_stats,
@@ -546,15 +503,10 @@ def dump():
 def dump_raw():
     days = request.args.get('days', default=7, type=int)
     athlete_id = session.get('athlete_id')
-    rows = run_query(SQL_RAW_DATA, (athlete_id, f'{days} days'))
-    
-    if not rows:
-        return Response("No data found.", mimetype='text/plain')
+    rows = stream_query(SQL_RAW_DATA, (athlete_id, f'{days} days'))
 
-    markdown_data = format_activities_to_markdown(rows)
-    
-    # Return raw text directly to the browser
-    return Response(markdown_data, mimetype='text/plain')
+    # Raw markdown straight to the browser, written as the cursor is read
+    return export_response(rows, 'markdown', empty=Response("No data found.", mimetype='text/plain'))
 
 # --------------------------------------------------------------------------------
 @main_bp.route('/coach')
@@ -609,19 +561,27 @@ def coach_load():
     return render_template('coach_content.html', advice=advice)
 
 # --------------------------------------------------------------------------------
-def export_to_csv(data):
-    if not data:
-        return "No data to export", 400
-    
-    output = io.StringIO()
-    # Use keys from first row for header
-    writer = csv.DictWriter(output, fieldnames=data[0].keys())
-    writer.writeheader()
-    writer.writerows(data)
-    
-    filename = f"activities_{datetime.now().strftime('%Y%m%d')}.csv"
-    return Response(
-        output.getvalue(),
-        mimetype="text/csv",
-        headers={"Content-disposition": f"attachment; filename={filename}"}
-    )
\ No newline at end of file
+def export_response(rows, export_format, filename=None, empty=("No data to export", 400)):
+    """
+    Streams rows (list or stream_query generator) as csv / ndjson / json / markdown
+    (core/exports.py), gzip-compressed when the client accepts it. `filename` makes it a download.
+    `empty` is returned as is when there are no rows.
+    """
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        if hasattr(rows, 'close'):
+            rows.close()  # hands the cursor's connection back
+        return empty
+
+    # Flask's JSON provider keeps json/ndjson rows in the format jsonify always produced
+    dumps = partial(current_app.json.dumps, separators=(',', ':'))
+    body = iter_export(chain([first], rows), export_format, dumps=dumps)
+    headers = {'Vary': 'Accept-Encoding'}
+    if filename:
+        headers['Content-Disposition'] = f"attachment; filename={filename}"
+    if EXPORT_GZIP and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        body = gzip_chunks(body)
+        headers['Content-Encoding'] = 'gzip'
+
+    return Response(body, mimetype=EXPORT_MIMETYPES[export_format], headers=headers)
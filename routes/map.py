@@ -1,31 +1,42 @@
-from flask import Blueprint, render_template, jsonify, request, session
+import hashlib
+from flask import Blueprint, render_template, jsonify, request, session, Response
 from core.database import run_query
+from core.heatmap import get_tile_png, HEATMAP_MAX_ZOOM
 from routes.auth import login_required
-import json
+import config
 
 map_bp = Blueprint('map', __name__)
 
 @map_bp.route('/map')
 @login_required
 def map_page():
-    return render_template('map.html')
+    # Heatmap tiles are rasterized by the scheduler's heatmap task, not in the web worker
+    return render_template('map.html', heatmap_max_zoom=HEATMAP_MAX_ZOOM)
 
-@map_bp.route('/api/map-data')
+@map_bp.route('/tiles/heat/<int:z>/<int:x>/<int:y>')
 @login_required
-def map_data():
+def heatmap_tile(z, x, y):
+    """Personal heatmap tile from the local tile cache (core/heatmap.py), transparent if empty."""
+    body = get_tile_png(session.get('athlete_id'), z, x, y)
+
+    etag = f'"{hashlib.sha1(body).hexdigest()[:16]}"'
+    headers = {'ETag': etag, 'Cache-Control': 'private, max-age=300'}
+    if request.headers.get('If-None-Match') == etag:
+        return Response(status=304, headers=headers)
+    return Response(body, mimetype='image/png', headers=headers)
+
+# Geometry level of detail: the RDP-simplified summary_polyline (core/map_utils.py) up to this
+# zoom, the full map_polyline when zoomed in further.
+MAP_LOD_SUMMARY_MAX_ZOOM = getattr(config, 'MAP_LOD_SUMMARY_MAX_ZOOM', 12)
+MAP_PAGE_SIZE = getattr(config, 'MAP_PAGE_SIZE', 200)
+
+def _map_filters(athlete_id):
+    """WHERE clause + params shared by the data, extent and type queries."""
     months = request.args.get('range', type=int, default=12)
-    athlete_id = session.get('athlete_id')
     activity_type = request.args.get('type', default='Ride')
     search_term = request.args.get('search', default='')
-    
-    query = """
-        SELECT 
-            strava_id, 
-            name, 
-            map_polyline, 
-            type,
-            TO_CHAR(start_date_local, 'DD-MM-YYYY') as activity_date
-        FROM activities 
+
+    where = """
         WHERE athlete_id = %s 
         and type != 'VirtualRide'
         AND map_polyline IS NOT NULL
@@ -35,53 +46,116 @@ def map_data():
 
     # Filter by Activity Type (unless 'All' is selected)
     if activity_type != 'All':
-        query += " AND type = %s"
+        where += " AND type = %s"
         params.append(activity_type)
 
     # Filter by Search Term
     if search_term:
-        query += " AND name ILIKE %s"
+        where += " AND name ILIKE %s"
         params.append(f"%{search_term}%")
 
     # Add the date interval filter if range is not "Full History" (0)
     if months > 0:
-        query += " AND start_date_local >= CURRENT_DATE - INTERVAL '%s months'"
+        where += " AND start_date_local >= CURRENT_DATE - INTERVAL '%s months'"
         params.append(months)
 
-    query += " ORDER BY start_date_local DESC"
-    activities = run_query(query, params)
-        
-    type_query = """
-        SELECT type, COUNT(*) as activity_count
-        FROM activities
-        WHERE athlete_id = %s
-        AND type != 'VirtualRide'
-        AND map_polyline IS NOT NULL
-        AND map_polyline != ''
-        GROUP BY type
-        ORDER BY activity_count DESC;
+    return where, params
+
+def _parse_bbox(value):
+    """Leaflet's toBBoxString(): 'west,south,east,north'. None if missing or malformed."""
+    try:
+        west, south, east, north = (float(v) for v in value.split(','))
+    except (AttributeError, ValueError):
+        return None
+    return west, south, east, north
+
+@map_bp.route('/api/map-data')
+@login_required
+def map_data():
+    """
+    Activities overlapping the viewport, with geometry detail picked by zoom, one page at a time.
+      ?bbox=west,south,east,north&zoom=Z&cursor=<strava_id>   + range / type / search filters
+      ?extent=1   only the overall bounds, count and type list (the page fits the map to it first)
     """
-    available_types = run_query(type_query, [athlete_id])
+    athlete_id = session.get('athlete_id')
+    where, params = _map_filters(athlete_id)
 
+    if request.args.get('extent'):
+        extent = run_query(f"""
+            SELECT COUNT(*) as activity_count,
+                   MIN(min_lat) as south, MAX(max_lat) as north,
+                   MIN(min_lng) as west, MAX(max_lng) as east
+            FROM activities {where}
+        """, params)[0]
 
-    # Debugging the payload size
-    json_string = json.dumps(activities, default=str)
-    print(f"--- Map Data Debug ---")
-    print(f"Athlete: {athlete_id} | Range: {months} months")
-    print(f"Activities: {len(activities)}")
-    print(f"Payload Size: {len(json_string)/1024/1024:.2f} MB")
-    print(f"----------------------")
+        type_query = """
+            SELECT type, COUNT(*) as activity_count
+            FROM activities
+            WHERE athlete_id = %s
+            AND type != 'VirtualRide'
+            AND map_polyline IS NOT NULL
+            AND map_polyline != ''
+            GROUP BY type
+            ORDER BY activity_count DESC;
+        """
+        available_types = run_query(type_query, [athlete_id])
+        return jsonify({'extent': extent, 'available_types': available_types})
 
-    return jsonify({
-        'activities': activities,
-        'available_types': available_types
-    })
+    zoom = request.args.get('zoom', type=int, default=MAP_LOD_SUMMARY_MAX_ZOOM)
+    limit = min(request.args.get('limit', type=int, default=MAP_PAGE_SIZE), MAP_PAGE_SIZE)
+    cursor = request.args.get('cursor', type=int)
+    bbox = _parse_bbox(request.args.get('bbox'))
 
+    use_summary = zoom <= MAP_LOD_SUMMARY_MAX_ZOOM
+    geometry = "COALESCE(summary_polyline, map_polyline)" if use_summary else "map_polyline"
 
+    branch = f"""
+        SELECT 
+            strava_id, 
+            name, 
+            {geometry} as polyline, 
+            type,
+            TO_CHAR(start_date_local, 'DD-MM-YYYY') as activity_date,
+            start_date_local
+        FROM activities 
+        {where}
+    """
 
-"""
-    print(f"--- Map Data Debug ---")
-    print(f"Activities: {len(activities)}")
-    print(f"Payload Size: {size_mb:.2f} MB")
-    print(f"----------------------")
-"""
\ No newline at end of file
+    # Keyset paging, newest first
+    if cursor:
+        branch += """ AND (start_date_local, strava_id) <
+            (SELECT start_date_local, strava_id FROM activities WHERE strava_id = %s)"""
+        params.append(cursor)
+
+    # Bbox overlap on the ingest-time bounds (idx_activities_bbox). Rows never backfilled have no
+    # bounds and always pass; they get their own branch so the indexed one stays index-friendly.
+    if bbox:
+        west, south, east, north = bbox
+        query = f"""
+            {branch} AND min_lat IS NOT NULL
+              AND box(point(min_lng, min_lat), point(max_lng, max_lat)) && box(point(%s, %s), point(%s, %s))
+            UNION ALL
+            {branch} AND min_lat IS NULL
+        """
+        params = params + [west, south, east, north] + params
+    else:
+        query = branch
+
+    query = f"""
+        SELECT strava_id, name, polyline, type, activity_date
+        FROM ({query}) m
+        ORDER BY start_date_local DESC, strava_id DESC LIMIT %s
+    """
+    params.append(limit + 1)
+    activities = run_query(query, params)
+
+    next_cursor = None
+    if len(activities) > limit:
+        activities = activities[:limit]
+        next_cursor = activities[-1]['strava_id']
+
+    return jsonify({
+        'activities': activities,
+        'lod': 'summary' if use_summary else 'full',
+        'next_cursor': next_cursor
+    })
@@ -55,43 +55,17 @@ def inject_globals():
             current_ftp = 200
         )
     
-    from core.queries import (
-        SQL_GET_USER_NAME,
-        SQL_GET_LATEST_ACTIVITY_ID,
-        SQL_ATHLETE_COUNTS
-    )
+    # Cached per athlete, dropped by the DB triggers' NOTIFY (see core/athlete_globals.py)
+    from core.athlete_globals import get_athlete_globals
+    g = get_athlete_globals(athlete_id)
 
-    # 1. Get User Name for the specific logged-in athlete
-    user_data = run_query(SQL_GET_USER_NAME, (athlete_id,))
-    if user_data:
-        row = user_data[0]
-        name = row['firstname']
-        # Priority: Manual -> Detected -> Default
-        ftp = row.get('manual_ftp') or row.get('detected_ftp') or 200
-    else:
-        name = "Athlete"
-        ftp = 200
-    
-    # 2. Get Last Activity ID for the specific logged-in athlete
-    last_act_data = run_query(SQL_GET_LATEST_ACTIVITY_ID, (athlete_id,))
-    last_id = last_act_data[0]['strava_id'] if last_act_data else None
-
-    # 3. Get activity counts:
-    res = run_query(SQL_ATHLETE_COUNTS,(athlete_id, athlete_id))
-    if res and len(res) > 0:
-        total_activity_count = res[0].get('total', 0)
-        total_streams_count = res[0].get('streams', 0)
-    else:
-        total_activity_count = 0
-        total_streams_count = 0
-    
     return dict(
-        current_user_name=name,
+        current_user_name=g['name'],
         current_athlete_id=athlete_id,
-        current_ftp=ftp,
-        last_activity_id=last_id,
-        total_activity_count=total_activity_count,
-        total_streams_count=total_streams_count
+        current_ftp=g['ftp'],
+        last_activity_id=g['last_activity_id'],
+        total_activity_count=g['activity_count'],
+        total_streams_count=g['stream_count']
     )
 
 def is_vps():
@@ -228,17 +202,18 @@ def strava_webhook():
             print(f"[{datetime.now()}] WEBHOOK: Ignoring event from unknown subscription {data.get('subscription_id')}")
             return "EVENT_RECEIVED", 200 # Still return 200 so Strava doesn't retry
 
-        # LOG the webhook to create a trail of all updates/deletes/deauths
-        log_file_path = os.path.join(current_app.config['BASE_PATH'], 'logs', 'webhook_events.log')
+        # Persist the event: webhook_events is the trail of all updates/deletes/deauths.
+        # Strava retries deliveries, so a duplicate (same object, aspect, event_time) is acknowledged and dropped.
+        from core.webhook_events import record_webhook_event, finish_webhook_events
         try:
-            with open(log_file_path, 'a') as f:
-                log_entry = {
-                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "payload": data
-                }
-                f.write(json.dumps(log_entry) + "\n")
+            event_id = record_webhook_event(data)
         except Exception as e:
-            print(f"Failed to log webhook event: {e}")
+            print(f"[{datetime.now()}] WEBHOOK ERROR: Failed to store event: {e}")
+            return "EVENT_RECEIVED", 200
+
+        if event_id is None:
+            print(f"[{datetime.now()}] WEBHOOK: Duplicate event for {data.get('object_id')} ignored.")
+            return "EVENT_RECEIVED", 200
 
         object_type = data.get('object_type')
         aspect_type = data.get('aspect_type')
@@ -254,28 +229,16 @@ def strava_webhook():
             # Since this is a webhook, we just wipe the DB. 
             # No need to call Strava back; they are the ones who told us!
             delete_db_user_data(athlete_id)
+            finish_webhook_events([event_id])
             return "EVENT_RECEIVED", 200
 
         # For event "activity" and aspect "create" process:
         if object_type == 'activity' and aspect_type in ['create', 'update']:
             
-            print(f"[{datetime.now()}] WEBHOOK: Activity {aspect_type} {activity_id} for athlete {athlete_id}. Triggering sync.")
-
-            # Trigger the same subprocess logic you already use in sync_activities
-            try:
-                python_executable = os.path.join(BASE_PATH, 'venv', 'bin', 'python')
-                script_path = os.path.join(BASE_PATH, 'run_sync.py')
-                
-                with open(LOG_PATH, "a") as log_file:
-                    log_file.write(f"\n[{datetime.now()}] WEBHOOK TRIGGER: Activity {aspect_type} {activity_id} detected for {athlete_id}\n")
-                    subprocess.Popen(
-                        [python_executable, "-u", script_path, str(athlete_id), str(activity_id)],
-                        stdout=log_file,
-                        stderr=log_file,
-                        cwd=BASE_PATH
-                    )
-            except Exception as e:
-                print(f"[{datetime.now()}] WEBHOOK ERROR: Failed to start subprocess: {e}")
+            # Nothing is spawned here: the scheduler's webhook task (core/scheduler.py) drains the
+            # events once the activity has been quiet for the debounce window, so a burst of
+            # updates ends up as one sync in one process
+            print(f"[{datetime.now()}] WEBHOOK: Activity {aspect_type} {activity_id} for athlete {athlete_id}. Queued for debounced sync.")
             
         elif object_type == 'activity' and aspect_type == 'delete':
             from core.database import delete_db_activity, get_db_connection
@@ -299,6 +262,8 @@ def strava_webhook():
                     )
                     thread.start()
                     
+                finish_webhook_events([event_id])
+
                 with open(LOG_PATH, "a") as log_file:
                     log_file.write(f"[{datetime.now()}] WEBHOOK TRIGGER: Activity delete {activity_id} fired\n")
 
@@ -307,6 +272,10 @@ def strava_webhook():
             finally:
                 conn.close()
 
+        else:
+            # Athlete profile updates etc. are kept for the trail only
+            finish_webhook_events([event_id], 'ignored')
+
         return "EVENT_RECEIVED", 200
     
     return "Method not allowed", 405
@@ -1,18 +1,35 @@
 # run_sync.py
 
 from datetime import datetime, timedelta
-from config import REFRESH_USER_PROFILE, REFRESH_HISTORY, ANALYTICS_RECALC_SIZE, NEW_USER_PAGES_TO_FETCH
+from config import REFRESH_USER_PROFILE, REFRESH_HISTORY, ANALYTICS_RECALC_SIZE
 from core.database import (
     get_db_connection, get_db_user, save_db_user_profile, 
     get_db_latest_timestamp_for_athlete, save_db_activities,
-    get_db_all_athletes, run_query
+    get_db_all_athletes, run_query,
+    get_db_activity_state, activity_fingerprint
+)
+from core.strava_api import (
+    get_valid_access_token, fetch_athlete_data, fetch_activities_list,
+    fetch_activities_pages, fetch_activity_detail
 )
-from core.strava_api import get_valid_access_token, fetch_athlete_data, fetch_activities_list, fetch_activity_detail
 from core.processor import process_activity_metrics
 from core.crawl_analytics import sync_local_analytics
+from core.run_locks import exclusive_athlete_run
+from core.onboarding import onboard_new_athlete
+from core.api_dispatcher import StravaLaneBlocked
+from core.ingest_pipeline import ingest_activity_streams
 import sys, time
+import config
+
+INCREMENTAL_MAX_PAGES = getattr(config, 'INCREMENTAL_MAX_PAGES', 5)
 
-def sync_single_activity(athlete_id, activity_id, run_analytics=True):
+@exclusive_athlete_run('sync')
+def sync_single_activity(athlete_id, activity_id, run_analytics=True, raise_errors=False):
+    """
+    Refreshes one activity from Strava. Returns True when its content changed (streams and
+    analytics were refreshed), None when only metadata changed or the sync failed.
+    With raise_errors the failure is re-raised instead (webhook events record it as 'failed').
+    """
     conn = get_db_connection()
     try:
         user = get_db_user(conn, athlete_id)
@@ -26,6 +43,7 @@ def sync_single_activity(athlete_id, activity_id, run_analytics=True):
         
         # 2. Fetch the specific activity detail (Summary/Metadata)
         # This will get the new name/distance even if the activity is old
+        previous = get_db_activity_state(conn, activity_id)
         activity = fetch_activity_detail(token, activity_id)
         
         if activity:
@@ -33,9 +51,19 @@ def sync_single_activity(athlete_id, activity_id, run_analytics=True):
             save_db_activities(conn, athlete_id, [activity])
             print(f"\t✅ Activity {activity_id} metadata updated in DB.")
 
+            # Name/description/gear edits: streams and everything derived from them are still valid
+            stream_done = previous and (previous['has_streams'] or previous['streams_missing'])
+            old_fingerprint = previous['content_fingerprint'] if previous else None
+            content_changed = old_fingerprint != activity_fingerprint(activity)
+            if stream_done and not content_changed:
+                print(f"\t⏭️ Activity {activity_id}: content unchanged, skipping streams and analytics.")
+                return None
+
             # 4. Sync streams/metrics if it's a cycling activity
+            #    (re-download when a known activity was edited, e.g. cropped)
             from core.strava_api import sync_activity_streams
-            sync_activity_streams(conn, athlete_id, activity_id)
+            refetch = bool(old_fingerprint and previous['has_streams'])
+            sync_activity_streams(conn, athlete_id, activity_id, force=refetch)
             
             if False:
                 #5. process analytics - no need anymore
@@ -63,14 +91,22 @@ def sync_single_activity(athlete_id, activity_id, run_analytics=True):
                                      priority_sid=activity_id
                                      )
 
+            return True
+
         else:
             print(f"\t⚠️ Could not find activity {activity_id} on Strava.")
 
+    except StravaLaneBlocked:
+        # No API budget for this lane right now: the caller decides whether to retry or stop
+        raise
     except Exception as e:
         print(f"❌ ERROR in single sync: {str(e)}")
+        if raise_errors:
+            raise
     finally:
         conn.close()
 
+@exclusive_athlete_run('sync')
 def run_sync(athlete_id, athlete_name="Athlete"):
 
     conn = get_db_connection()
@@ -98,7 +134,6 @@ def run_sync(athlete_id, athlete_name="Athlete"):
             save_db_user_profile(conn, profile, tokens_dict)
 
         # 3. Sync Activities
-        is_new_user = False
         all_activities = []
         
         if REFRESH_HISTORY:
@@ -108,20 +143,13 @@ def run_sync(athlete_id, athlete_name="Athlete"):
             after_ts = get_db_latest_timestamp_for_athlete(conn, athlete_id)
 
             if after_ts == 0:
-                is_new_user = True
-                pages_to_fetch = NEW_USER_PAGES_TO_FETCH
-                print(f"\t🚀 New user, fetching last {pages_to_fetch} pages (up to {pages_to_fetch * 200} activities)")
-                
-                for page in range(1, pages_to_fetch + 1):
-                    print(f"\t  Fetching page {page}...")
-                    page_data = fetch_activities_list(token, {"page": page, "per_page": 200})
-                    if not page_data:
-                        break
-                    all_activities.extend(page_data)
+                # New athlete: staged pipeline (summaries -> early ledger -> priority streams -> crawler)
+                onboard_new_athlete(conn, athlete_id, token)
+                return
             else:
                 readable = datetime.fromtimestamp(after_ts).strftime('%Y-%m-%d %H:%M:%S')
                 print(f"\t🚀 Incremental sync: Activities after {readable}")
-                all_activities = fetch_activities_list(token, {"after": after_ts, "per_page": 200})
+                all_activities, _ = fetch_activities_pages(token, {"after": after_ts}, max_pages=INCREMENTAL_MAX_PAGES)
 
         if all_activities:
             activities = all_activities
@@ -129,56 +157,18 @@ def run_sync(athlete_id, athlete_name="Athlete"):
             save_db_activities(conn, athlete_id, activities)
             print(f"\t✅ Loaded {len(activities)} activities.")
 
-            
-
-
-            # -------------------- Define activiteis to process for new user ------------------------
-            from dateutil import parser # Strava dates are ISO8601 strings
-            from config import NEW_USER_STREAMS_LOAD_COUNT
-
-            if is_new_user:
-                # 1. Define 90-day window
-                stabilization_cutoff = datetime.now() - timedelta(days=90)
-
-                recent_acts = [
-                    a for a in all_activities 
-                    if parser.parse(a['start_date_local']).replace(tzinfo=None) >= stabilization_cutoff
-                ]
-                recent_acts.sort(key=lambda x: x['start_date_local'], reverse=True)
-                activities_to_process = recent_acts[:NEW_USER_STREAMS_LOAD_COUNT]
-                
-                print(f"\t🚀 New user: Found {len(recent_acts)} in 90d. Processing the {len(activities_to_process)} most recent.")
-            else:
-                activities_to_process = all_activities
+            activities_to_process = all_activities
 
             # ------------------------ Fetch Activity streams (details) -----------------------
-            if not REFRESH_HISTORY or is_new_user:
+            if not REFRESH_HISTORY:
                 print(f"\t🧬 Fetching high-res streams for {len(activities_to_process)} activities...")
 
-                from core.strava_api import sync_activity_streams
-
                 activities_to_process.sort(key=lambda x: x['start_date_local'])
                 earliest_date = activities_to_process[0]['start_date_local']
 
-
-                for activity in activities_to_process:
-                    strava_id = activity['id']
-                    try:
-                        # 1. Fetch the activity streams (details)
-                        sync_activity_streams(conn,athlete_id,strava_id)
-                        process_activity_metrics(strava_id, force=True)
-
-                        time.sleep(1)
-                        print(f"\t  ✨ Activity {strava_id}: Stream saved & Metrics calculated")
-
-                    except Exception as stream_error:
-
-                        if "429" in str(stream_error):
-                            print(f"\t  🚨 Rate limit hit for {strava_id}. Cooling down for 30s...")
-                            time.sleep(30)
-                        else:
-                            print(f"\t  ⚠️ Could not sync streams for {strava_id}: {stream_error}")
-                
+                # Downloads overlap with parsing, writes and metrics (core/ingest_pipeline.py);
+                # a blocked API lane stops intake and leaves the rest to the crawler
+                ingest_activity_streams(token, [a['id'] for a in activities_to_process])
 
                 from core.database import invalidate_analytics_from_date
                 invalidate_analytics_from_date(athlete_id, earliest_date)
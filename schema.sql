@@ -244,6 +244,625 @@ ALTER TABLE ONLY public.activity_streams
     ADD CONSTRAINT activity_streams_strava_id_fkey FOREIGN KEY (strava_id) REFERENCES public.activities(strava_id) ON DELETE CASCADE;
 
 
+--
+-- Name: webhook_events; Type: TABLE; Schema: public; Owner: jurajpanek
+--
+
+CREATE TABLE public.webhook_events (
+    id bigserial NOT NULL,
+    object_id bigint NOT NULL,
+    object_type text,
+    aspect_type text NOT NULL,
+    owner_id bigint,
+    event_time bigint NOT NULL,
+    updates jsonb,
+    payload jsonb,
+    status text DEFAULT 'pending'::text NOT NULL,
+    received_at timestamp without time zone DEFAULT now(),
+    processed_at timestamp without time zone
+);
+
+
+ALTER TABLE public.webhook_events OWNER TO jurajpanek;
+
+--
+-- Name: COLUMN webhook_events.status; Type: COMMENT; Schema: public; Owner: jurajpanek
+--
+
+COMMENT ON COLUMN public.webhook_events.status IS 'pending -> processing -> done | deferred | cancelled | failed | ignored';
+
+
+--
+-- Name: webhook_events webhook_events_pkey; Type: CONSTRAINT; Schema: public; Owner: jurajpanek
+--
+
+ALTER TABLE ONLY public.webhook_events
+    ADD CONSTRAINT webhook_events_pkey PRIMARY KEY (id);
+
+
+--
+-- Name: webhook_events webhook_events_event_key; Type: CONSTRAINT; Schema: public; Owner: jurajpanek
+--
+
+ALTER TABLE ONLY public.webhook_events
+    ADD CONSTRAINT webhook_events_event_key UNIQUE (object_id, aspect_type, event_time);
+
+
+--
+-- Name: idx_webhook_events_pending; Type: INDEX; Schema: public; Owner: jurajpanek
+--
+
+CREATE INDEX idx_webhook_events_pending ON public.webhook_events USING btree (object_id, received_at) WHERE (status = 'pending'::text);
+
+
+--
+-- Name: activities crawl lease; Type: COLUMN; Schema: public; Owner: jurajpanek
+--
+
+ALTER TABLE public.activities ADD COLUMN IF NOT EXISTS crawl_leased_until timestamp without time zone;
+ALTER TABLE public.activities ADD COLUMN IF NOT EXISTS crawl_leased_by text;
+
+
+--
+-- Name: users analytics lease; Type: COLUMN; Schema: public; Owner: jurajpanek
+--
+
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS analytics_leased_until timestamp without time zone;
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS analytics_leased_by text;
+
+
+--
+-- Name: idx_activities_recalc_queue; Type: INDEX; Schema: public; Owner: jurajpanek
+--
+
+CREATE INDEX idx_activities_recalc_queue ON public.activities USING btree (athlete_id, start_date_local) WHERE (needs_recalculation = true);
+
+
+--
+-- Name: run_deferrals; Type: TABLE; Schema: public; Owner: jurajpanek
+--
+
+CREATE TABLE public.run_deferrals (
+    id bigserial NOT NULL,
+    athlete_id bigint NOT NULL,
+    job_type text NOT NULL,
+    job_name text NOT NULL,
+    strava_id bigint,
+    params jsonb,
+    contender text,
+    contention_count integer DEFAULT 1 NOT NULL,
+    created_at timestamp without time zone DEFAULT now(),
+    last_contended_at timestamp without time zone DEFAULT now(),
+    resolved_at timestamp without time zone
+);
+
+
+ALTER TABLE public.run_deferrals OWNER TO jurajpanek;
+
+--
+-- Name: COLUMN run_deferrals.job_type; Type: COMMENT; Schema: public; Owner: jurajpanek
+--
+
+COMMENT ON COLUMN public.run_deferrals.job_type IS 'Advisory lock family that was busy: sync | analytics';
+
+
+--
+-- Name: run_deferrals run_deferrals_pkey; Type: CONSTRAINT; Schema: public; Owner: jurajpanek
+--
+
+ALTER TABLE ONLY public.run_deferrals
+    ADD CONSTRAINT run_deferrals_pkey PRIMARY KEY (id);
+
+
+--
+-- Name: idx_run_deferrals_pending; Type: INDEX; Schema: public; Owner: jurajpanek
+--
+
+CREATE UNIQUE INDEX idx_run_deferrals_pending ON public.run_deferrals USING btree (athlete_id, job_name, COALESCE(strava_id, (0)::bigint)) WHERE (resolved_at IS NULL);
+
+
+--
+-- Name: users onboarding milestones; Type: COLUMN; Schema: public; Owner: jurajpanek
+--
+
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS onboarding_started_at timestamp without time zone;
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS first_dashboard_at timestamp without time zone;
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS first_analytics_at timestamp without time zone;
+
+
+--
+-- Name: users history_cursor; Type: COLUMN; Schema: public; Owner: jurajpanek
+--
+
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS history_cursor bigint;
+
+COMMENT ON COLUMN public.users.history_cursor IS 'Epoch (UTC) of the oldest summary fetched by the history backfill; next run fetches before it';
+
+
+--
+-- Name: activities content_fingerprint; Type: COLUMN; Schema: public; Owner: jurajpanek
+--
+
+ALTER TABLE public.activities ADD COLUMN IF NOT EXISTS content_fingerprint text;
+
+COMMENT ON COLUMN public.activities.content_fingerprint IS 'Hash of the fields that affect streams and analytics (see core/database.activity_fingerprint); name/description edits keep it unchanged';
+
+
+--
+-- Name: activity_streams stream_keys; Type: COLUMN; Schema: public; Owner: jurajpanek
+--
+
+ALTER TABLE public.activity_streams ADD COLUMN IF NOT EXISTS stream_keys text[];
+
+COMMENT ON COLUMN public.activity_streams.stream_keys IS 'Channels requested from Strava (per-type profile, see core/stream_profiles.py); NULL = all channels';
+
+
+--
+-- Name: api_breakers; Type: TABLE; Schema: public; Owner: jurajpanek
+--
+
+CREATE TABLE public.api_breakers (
+    endpoint text NOT NULL,
+    state text DEFAULT 'closed'::text NOT NULL,
+    consecutive_failures integer DEFAULT 0 NOT NULL,
+    opened_until timestamp without time zone,
+    trips integer DEFAULT 0 NOT NULL,
+    recoveries integer DEFAULT 0 NOT NULL,
+    last_error text,
+    updated_at timestamp without time zone DEFAULT now()
+);
+
+
+ALTER TABLE public.api_breakers OWNER TO jurajpanek;
+
+--
+-- Name: COLUMN api_breakers.state; Type: COMMENT; Schema: public; Owner: jurajpanek
+--
+
+COMMENT ON COLUMN public.api_breakers.state IS 'closed -> open (after consecutive failures) -> half_open (one probe) -> closed | open';
+
+
+--
+-- Name: api_breakers api_breakers_pkey; Type: CONSTRAINT; Schema: public; Owner: jurajpanek
+--
+
+ALTER TABLE ONLY public.api_breakers
+    ADD CONSTRAINT api_breakers_pkey PRIMARY KEY (endpoint);
+
+
+--
+-- Name: api_calls; Type: TABLE; Schema: public; Owner: jurajpanek
+--
+
+CREATE TABLE public.api_calls (
+    id bigserial NOT NULL,
+    lane text NOT NULL,
+    endpoint text NOT NULL,
+    status_code integer,
+    latency_ms integer,
+    waited_ms integer,
+    called_at timestamp without time zone DEFAULT (now() AT TIME ZONE 'UTC'::text)
+);
+
+
+ALTER TABLE public.api_calls OWNER TO jurajpanek;
+
+--
+-- Name: COLUMN api_calls.called_at; Type: COMMENT; Schema: public; Owner: jurajpanek
+--
+
+COMMENT ON COLUMN public.api_calls.called_at IS 'UTC, matching the Strava 15-min and daily rate limit windows';
+
+
+--
+-- Name: api_calls api_calls_pkey; Type: CONSTRAINT; Schema: public; Owner: jurajpanek
+--
+
+ALTER TABLE ONLY public.api_calls
+    ADD CONSTRAINT api_calls_pkey PRIMARY KEY (id);
+
+
+--
+-- Name: idx_api_calls_called_at; Type: INDEX; Schema: public; Owner: jurajpanek
+--
+
+CREATE INDEX idx_api_calls_called_at ON public.api_calls USING btree (called_at);
+
+
+
+--
+-- Name: users activity_count, stream_count; Type: COLUMN; Schema: public; Owner: jurajpanek
+--
+
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS activity_count integer DEFAULT 0 NOT NULL;
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS stream_count integer DEFAULT 0 NOT NULL;
+
+COMMENT ON COLUMN public.users.activity_count IS 'Maintained by the activities triggers below (template header counts, see core/athlete_globals.py)';
+COMMENT ON COLUMN public.users.stream_count IS 'Maintained by the activity_streams triggers below';
+
+
+--
+-- Name: counter triggers; Type: FUNCTION; Schema: public; Owner: jurajpanek
+-- Statement-level with transition tables: a 200-row execute_values page is one UPDATE per athlete.
+-- Inserts add, deletes recount (rare, and cascades make the deleted rows' athlete unknowable).
+-- Every change NOTIFYs 'athlete_globals' so web processes drop their cached template globals.
+--
+
+CREATE OR REPLACE FUNCTION public.users_count_activities_inserted() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE public.users u SET activity_count = u.activity_count + n.cnt
+    FROM (SELECT athlete_id, COUNT(*) AS cnt FROM new_rows GROUP BY athlete_id) n
+    WHERE u.athlete_id = n.athlete_id;
+    PERFORM pg_notify('athlete_globals', n.athlete_id::text) FROM (SELECT DISTINCT athlete_id FROM new_rows) n;
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE FUNCTION public.users_count_activities_deleted() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE public.users u SET
+        activity_count = (SELECT COUNT(*) FROM public.activities a WHERE a.athlete_id = u.athlete_id),
+        stream_count = (SELECT COUNT(*) FROM public.activity_streams s
+                        JOIN public.activities a ON a.strava_id = s.strava_id WHERE a.athlete_id = u.athlete_id)
+    WHERE u.athlete_id IN (SELECT DISTINCT athlete_id FROM old_rows);
+    PERFORM pg_notify('athlete_globals', o.athlete_id::text) FROM (SELECT DISTINCT athlete_id FROM old_rows) o;
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE FUNCTION public.users_count_streams_inserted() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE public.users u SET stream_count = u.stream_count + n.cnt
+    FROM (SELECT a.athlete_id, COUNT(*) AS cnt FROM new_rows s
+          JOIN public.activities a ON a.strava_id = s.strava_id GROUP BY a.athlete_id) n
+    WHERE u.athlete_id = n.athlete_id;
+    PERFORM pg_notify('athlete_globals', a.athlete_id::text)
+    FROM (SELECT DISTINCT a.athlete_id FROM new_rows s JOIN public.activities a ON a.strava_id = s.strava_id) a;
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE FUNCTION public.users_count_streams_deleted() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+BEGIN
+    -- Streams removed by an activity delete cascade have no parent left; that trigger recounts them
+    UPDATE public.users u SET stream_count = GREATEST(u.stream_count - o.cnt, 0)
+    FROM (SELECT a.athlete_id, COUNT(*) AS cnt FROM old_rows s
+          JOIN public.activities a ON a.strava_id = s.strava_id GROUP BY a.athlete_id) o
+    WHERE u.athlete_id = o.athlete_id;
+    PERFORM pg_notify('athlete_globals', o.athlete_id::text)
+    FROM (SELECT DISTINCT a.athlete_id FROM old_rows s JOIN public.activities a ON a.strava_id = s.strava_id) o;
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE FUNCTION public.users_notify_globals() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify('athlete_globals', NEW.athlete_id::text);
+    RETURN NULL;
+END $$;
+
+DROP TRIGGER IF EXISTS trg_activities_count_insert ON public.activities;
+CREATE TRIGGER trg_activities_count_insert AFTER INSERT ON public.activities
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION public.users_count_activities_inserted();
+
+DROP TRIGGER IF EXISTS trg_activities_count_delete ON public.activities;
+CREATE TRIGGER trg_activities_count_delete AFTER DELETE ON public.activities
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION public.users_count_activities_deleted();
+
+DROP TRIGGER IF EXISTS trg_streams_count_insert ON public.activity_streams;
+CREATE TRIGGER trg_streams_count_insert AFTER INSERT ON public.activity_streams
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION public.users_count_streams_inserted();
+
+DROP TRIGGER IF EXISTS trg_streams_count_delete ON public.activity_streams;
+CREATE TRIGGER trg_streams_count_delete AFTER DELETE ON public.activity_streams
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION public.users_count_streams_deleted();
+
+DROP TRIGGER IF EXISTS trg_users_notify_globals ON public.users;
+CREATE TRIGGER trg_users_notify_globals AFTER UPDATE OF firstname, manual_ftp, detected_ftp ON public.users
+    FOR EACH ROW WHEN (OLD.firstname IS DISTINCT FROM NEW.firstname
+                       OR OLD.manual_ftp IS DISTINCT FROM NEW.manual_ftp
+                       OR OLD.detected_ftp IS DISTINCT FROM NEW.detected_ftp)
+    EXECUTE FUNCTION public.users_notify_globals();
+
+-- One-off backfill of the counters (safe to re-run)
+UPDATE public.users u SET
+    activity_count = (SELECT COUNT(*) FROM public.activities a WHERE a.athlete_id = u.athlete_id),
+    stream_count = (SELECT COUNT(*) FROM public.activity_streams s
+                    JOIN public.activities a ON a.strava_id = s.strava_id WHERE a.athlete_id = u.athlete_id);
+
+
+--
+-- Name: activity_render_payloads; Type: TABLE; Schema: public; Owner: jurajpanek
+--
+
+CREATE TABLE IF NOT EXISTS public.activity_render_payloads (
+    strava_id bigint NOT NULL,
+    format_version integer NOT NULL,
+    etag text NOT NULL,
+    body bytea NOT NULL,
+    raw_bytes integer,
+    built_at timestamp without time zone DEFAULT now()
+);
+
+
+ALTER TABLE public.activity_render_payloads OWNER TO jurajpanek;
+
+--
+-- Name: COLUMN activity_render_payloads.body; Type: COMMENT; Schema: public; Owner: jurajpanek
+--
+
+COMMENT ON COLUMN public.activity_render_payloads.body IS 'gzip-compressed JSON: chart series, curves, laps, map (see core/render_payload.py); served as-is with Content-Encoding: gzip';
+
+
+--
+-- Name: activity_render_payloads activity_render_payloads_pkey; Type: CONSTRAINT; Schema: public; Owner: jurajpanek
+--
+
+ALTER TABLE ONLY public.activity_render_payloads
+    ADD CONSTRAINT activity_render_payloads_pkey PRIMARY KEY (strava_id);
+
+
+--
+-- Name: activity_render_payloads activity_render_payloads_strava_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: jurajpanek
+--
+
+ALTER TABLE ONLY public.activity_render_payloads
+    ADD CONSTRAINT activity_render_payloads_strava_id_fkey FOREIGN KEY (strava_id) REFERENCES public.activities(strava_id) ON DELETE CASCADE;
+
+
+--
+-- Name: athlete_power_envelope; Type: TABLE; Schema: public; Owner: jurajpanek
+--
+
+CREATE TABLE IF NOT EXISTS public.athlete_power_envelope (
+    athlete_id bigint NOT NULL,
+    duration integer NOT NULL,
+    power double precision NOT NULL,
+    strava_id bigint,
+    activity_date timestamp without time zone,
+    updated_at timestamp without time zone DEFAULT now()
+);
+
+
+ALTER TABLE public.athlete_power_envelope OWNER TO jurajpanek;
+
+--
+-- Name: COLUMN athlete_power_envelope.strava_id; Type: COMMENT; Schema: public; Owner: jurajpanek
+--
+
+COMMENT ON COLUMN public.athlete_power_envelope.strava_id IS 'Record holder within the rolling window (core/power_envelope.py); NULL = holder deleted, envelope is rebuilt on next read';
+
+
+--
+-- Name: athlete_power_envelope athlete_power_envelope_pkey; Type: CONSTRAINT; Schema: public; Owner: jurajpanek
+--
+
+ALTER TABLE ONLY public.athlete_power_envelope
+    ADD CONSTRAINT athlete_power_envelope_pkey PRIMARY KEY (athlete_id, duration);
+
+
+--
+-- Name: athlete_power_envelope athlete_power_envelope_athlete_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: jurajpanek
+--
+
+ALTER TABLE ONLY public.athlete_power_envelope
+    ADD CONSTRAINT athlete_power_envelope_athlete_id_fkey FOREIGN KEY (athlete_id) REFERENCES public.users(athlete_id) ON DELETE CASCADE;
+
+
+--
+-- Name: athlete_power_envelope athlete_power_envelope_strava_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: jurajpanek
+--
+
+ALTER TABLE ONLY public.athlete_power_envelope
+    ADD CONSTRAINT athlete_power_envelope_strava_id_fkey FOREIGN KEY (strava_id) REFERENCES public.activities(strava_id) ON DELETE SET NULL;
+
+
+--
+-- Name: users power_envelope_at; Type: COLUMN; Schema: public; Owner: jurajpanek
+--
+
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS power_envelope_at timestamp without time zone;
+
+COMMENT ON COLUMN public.users.power_envelope_at IS 'Last full rebuild of athlete_power_envelope; NULL = not built yet';
+
+
+--
+-- Name: activities map summary; Type: COLUMN; Schema: public; Owner: jurajpanek
+-- Simplified track and its bounding box, written at ingest (core/map_utils.py process_activity_map).
+--
+
+ALTER TABLE public.activities ADD COLUMN IF NOT EXISTS summary_polyline text;
+ALTER TABLE public.activities ADD COLUMN IF NOT EXISTS min_lat double precision;
+ALTER TABLE public.activities ADD COLUMN IF NOT EXISTS max_lat double precision;
+ALTER TABLE public.activities ADD COLUMN IF NOT EXISTS min_lng double precision;
+ALTER TABLE public.activities ADD COLUMN IF NOT EXISTS max_lng double precision;
+
+
+--
+-- Name: idx_activities_bbox; Type: INDEX; Schema: public; Owner: jurajpanek
+-- Viewport queries of /api/map-data (routes/map.py): box overlap on the ingest-time bbox columns.
+--
+
+CREATE INDEX IF NOT EXISTS idx_activities_bbox ON public.activities USING gist (box(point(min_lng, min_lat), point(max_lng, max_lat))) WHERE (min_lat IS NOT NULL);
+
+
+--
+-- Name: idx_activities_athlete_date; Type: INDEX; Schema: public; Owner: jurajpanek
+--
+
+CREATE INDEX IF NOT EXISTS idx_activities_athlete_date ON public.activities USING btree (athlete_id, start_date_local DESC, strava_id DESC);
+
+
+--
+-- Name: activities heatmap_at; Type: COLUMN; Schema: public; Owner: jurajpanek
+--
+
+ALTER TABLE public.activities ADD COLUMN IF NOT EXISTS heatmap_at timestamp without time zone;
+
+COMMENT ON COLUMN public.activities.heatmap_at IS 'When the track was rasterized into the heatmap tiles (core/heatmap.py); NULL = pending';
+
+ALTER TABLE public.activities ADD COLUMN IF NOT EXISTS heatmap_polyline text;
+
+COMMENT ON COLUMN public.activities.heatmap_polyline IS 'The track currently counted in the heatmap tiles, subtracted when map_polyline changes';
+
+-- Rides rasterized before the column existed counted their current track
+UPDATE public.activities SET heatmap_polyline = map_polyline
+WHERE heatmap_at IS NOT NULL AND heatmap_polyline IS NULL AND map_polyline IS NOT NULL AND map_polyline != '';
+
+
+--
+-- Name: users data_version; Type: COLUMN; Schema: public; Owner: jurajpanek
+-- Key of the per-athlete response cache (core/response_cache.py): bumped by every write that
+-- changes the athlete's activities, streams, analytics or fitness ledger, and by manual settings
+-- changes. UPDATEs only count when a column other than the bookkeeping ones (leases, heatmap_at,
+-- recalculation flags, updated_at) actually changed, so scheduler passes leave the cache alone.
+--
+
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS data_version bigint DEFAULT 0 NOT NULL;
+
+CREATE OR REPLACE FUNCTION public.users_bump_data_version() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE public.users SET data_version = data_version + 1
+    WHERE athlete_id IN (SELECT DISTINCT athlete_id FROM changed_rows);
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE FUNCTION public.users_bump_data_version_by_activity() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE public.users SET data_version = data_version + 1
+    WHERE athlete_id IN (SELECT DISTINCT a.athlete_id FROM changed_rows c
+                         JOIN public.activities a ON a.strava_id = c.strava_id);
+    RETURN NULL;
+END $$;
+
+-- UPDATE triggers: TG_ARGV[0] is the owner column ('athlete_id' or 'strava_id'), the rest are
+-- columns whose changes do not show on any page
+CREATE OR REPLACE FUNCTION public.users_bump_data_version_on_change() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+DECLARE
+    ignored text[] := COALESCE(TG_ARGV[1:TG_NARGS - 1], '{}');
+BEGIN
+    WITH changed AS (
+        (SELECT to_jsonb(n) - ignored AS r FROM new_rows n
+         EXCEPT ALL
+         SELECT to_jsonb(o) - ignored FROM old_rows o)
+        UNION ALL
+        (SELECT to_jsonb(o) - ignored FROM old_rows o
+         EXCEPT ALL
+         SELECT to_jsonb(n) - ignored FROM new_rows n)
+    )
+    UPDATE public.users SET data_version = data_version + 1
+    WHERE athlete_id IN (
+        SELECT (r->>'athlete_id')::bigint FROM changed WHERE TG_ARGV[0] = 'athlete_id'
+        UNION
+        SELECT a.athlete_id FROM changed c
+        JOIN public.activities a ON a.strava_id = (c.r->>'strava_id')::bigint
+        WHERE TG_ARGV[0] = 'strava_id'
+    );
+    RETURN NULL;
+END $$;
+
+DROP TRIGGER IF EXISTS trg_activities_version_insert ON public.activities;
+CREATE TRIGGER trg_activities_version_insert AFTER INSERT ON public.activities
+    REFERENCING NEW TABLE AS changed_rows FOR EACH STATEMENT EXECUTE FUNCTION public.users_bump_data_version();
+
+DROP TRIGGER IF EXISTS trg_activities_version_update ON public.activities;
+CREATE TRIGGER trg_activities_version_update AFTER UPDATE ON public.activities
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT
+    EXECUTE FUNCTION public.users_bump_data_version_on_change('athlete_id', 'updated_at', 'crawl_leased_until', 'crawl_leased_by', 'heatmap_at', 'heatmap_polyline',
+        'needs_recalculation', 'streams_missing');
+
+DROP TRIGGER IF EXISTS trg_activities_version_delete ON public.activities;
+CREATE TRIGGER trg_activities_version_delete AFTER DELETE ON public.activities
+    REFERENCING OLD TABLE AS changed_rows FOR EACH STATEMENT EXECUTE FUNCTION public.users_bump_data_version();
+
+DROP TRIGGER IF EXISTS trg_analytics_version_insert ON public.activity_analytics;
+CREATE TRIGGER trg_analytics_version_insert AFTER INSERT ON public.activity_analytics
+    REFERENCING NEW TABLE AS changed_rows FOR EACH STATEMENT EXECUTE FUNCTION public.users_bump_data_version_by_activity();
+
+DROP TRIGGER IF EXISTS trg_analytics_version_update ON public.activity_analytics;
+CREATE TRIGGER trg_analytics_version_update AFTER UPDATE ON public.activity_analytics
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT
+    EXECUTE FUNCTION public.users_bump_data_version_on_change('strava_id', 'updated_at');
+
+DROP TRIGGER IF EXISTS trg_analytics_version_delete ON public.activity_analytics;
+CREATE TRIGGER trg_analytics_version_delete AFTER DELETE ON public.activity_analytics
+    REFERENCING OLD TABLE AS changed_rows FOR EACH STATEMENT EXECUTE FUNCTION public.users_bump_data_version_by_activity();
+
+DROP TRIGGER IF EXISTS trg_streams_version_insert ON public.activity_streams;
+CREATE TRIGGER trg_streams_version_insert AFTER INSERT ON public.activity_streams
+    REFERENCING NEW TABLE AS changed_rows FOR EACH STATEMENT EXECUTE FUNCTION public.users_bump_data_version_by_activity();
+
+DROP TRIGGER IF EXISTS trg_streams_version_update ON public.activity_streams;
+CREATE TRIGGER trg_streams_version_update AFTER UPDATE ON public.activity_streams
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT
+    EXECUTE FUNCTION public.users_bump_data_version_on_change('strava_id', 'updated_at');
+
+DROP TRIGGER IF EXISTS trg_streams_version_delete ON public.activity_streams;
+CREATE TRIGGER trg_streams_version_delete AFTER DELETE ON public.activity_streams
+    REFERENCING OLD TABLE AS changed_rows FOR EACH STATEMENT EXECUTE FUNCTION public.users_bump_data_version_by_activity();
+
+DROP TRIGGER IF EXISTS trg_daily_metrics_version_insert ON public.athlete_daily_metrics;
+CREATE TRIGGER trg_daily_metrics_version_insert AFTER INSERT ON public.athlete_daily_metrics
+    REFERENCING NEW TABLE AS changed_rows FOR EACH STATEMENT EXECUTE FUNCTION public.users_bump_data_version();
+
+DROP TRIGGER IF EXISTS trg_daily_metrics_version_update ON public.athlete_daily_metrics;
+CREATE TRIGGER trg_daily_metrics_version_update AFTER UPDATE ON public.athlete_daily_metrics
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT
+    EXECUTE FUNCTION public.users_bump_data_version_on_change('athlete_id', 'updated_at');
+
+DROP TRIGGER IF EXISTS trg_daily_metrics_version_delete ON public.athlete_daily_metrics;
+CREATE TRIGGER trg_daily_metrics_version_delete AFTER DELETE ON public.athlete_daily_metrics
+    REFERENCING OLD TABLE AS changed_rows FOR EACH STATEMENT EXECUTE FUNCTION public.users_bump_data_version();
+
+-- A new version reaches the web processes through the athlete_globals NOTIFY (core/athlete_globals.py)
+DROP TRIGGER IF EXISTS trg_users_notify_globals ON public.users;
+CREATE TRIGGER trg_users_notify_globals AFTER UPDATE OF firstname, manual_ftp, detected_ftp, data_version ON public.users
+    FOR EACH ROW WHEN (OLD.firstname IS DISTINCT FROM NEW.firstname
+                       OR OLD.manual_ftp IS DISTINCT FROM NEW.manual_ftp
+                       OR OLD.detected_ftp IS DISTINCT FROM NEW.detected_ftp
+                       OR OLD.data_version IS DISTINCT FROM NEW.data_version)
+    EXECUTE FUNCTION public.users_notify_globals();
+
+
+--
+-- Name: webhook_events claimed_at; Type: COLUMN; Schema: public; Owner: jurajpanek
+-- Claims older than WEBHOOK_CLAIM_TIMEOUT are returned to pending by the drain and no longer
+-- count as an active webhook lane (core/api_dispatcher.py).
+--
+
+ALTER TABLE public.webhook_events ADD COLUMN IF NOT EXISTS claimed_at timestamp without time zone;
+
+--
+-- Name: ingest_stage_stats; Type: TABLE; Schema: public; Owner: jurajpanek
+-- One row per stage per run of core/ingest_pipeline.py, for tuning INGEST_STAGE_WORKERS /
+-- INGEST_QUEUE_SIZE from the admin overview.
+--
+
+CREATE TABLE IF NOT EXISTS public.ingest_stage_stats (
+    id bigserial PRIMARY KEY,
+    pipeline text NOT NULL,
+    stage text NOT NULL,
+    position integer NOT NULL,
+    workers integer NOT NULL,
+    processed integer NOT NULL,
+    failed integer NOT NULL,
+    busy_s double precision NOT NULL,
+    wall_s double precision NOT NULL,
+    utilization double precision NOT NULL,
+    max_queue integer NOT NULL,
+    avg_queue double precision NOT NULL,
+    finished_at timestamp without time zone DEFAULT now() NOT NULL
+);
+
+ALTER TABLE public.ingest_stage_stats OWNER TO jurajpanek;
+
+CREATE INDEX IF NOT EXISTS idx_ingest_stage_stats_finished_at ON public.ingest_stage_stats USING btree (finished_at);
+
+
 --
 -- PostgreSQL database dump complete
 --
@@ -0,0 +1,75 @@
+# scripts/bench_activity_page.py
+
+# Latency of the activity page queries: the old per-item sequence vs. core.activity_page.
+#   ./venv/bin/python3 -u -m scripts.bench_activity_page <athlete_id> [activities] [repeats]
+
+import sys
+import os
+import time
+import statistics
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.database import run_query, get_db_zone_for_value
+from core.analysis import scan_best_power_curve
+from core.activity_page import load_activity_page
+from core.queries import SQL_ACTIVITY_DETAILS, SQL_PREVIOUS_ACTIVITY_ID, SQL_NEXT_ACTIVITY_ID
+
+def legacy_load(athlete_id, strava_id):
+    """The query sequence activity_detail ran before the single-row loader."""
+    activity = run_query(SQL_ACTIVITY_DETAILS, (strava_id,))[0]
+    if activity['resource_state'] == 3:
+        run_query("SELECT * FROM activity_laps WHERE strava_id = %s AND is_hidden = FALSE ORDER BY start_index ASC", (strava_id,))
+    curr_date = run_query("SELECT start_date_local FROM activities WHERE strava_id = %s", (strava_id,))[0]['start_date_local']
+    run_query("""
+        (SELECT strava_id, substr(name,1,30) as name, type, start_date_local FROM activities
+         WHERE athlete_id = %s AND start_date_local <= %s ORDER BY start_date_local DESC LIMIT 10)
+        UNION
+        (SELECT strava_id, substr(name,1,30) as name, type, start_date_local FROM activities
+         WHERE athlete_id = %s AND start_date_local > %s ORDER BY start_date_local ASC LIMIT 10)
+        ORDER BY start_date_local DESC
+    """, (athlete_id, curr_date, athlete_id, curr_date))
+    run_query(SQL_PREVIOUS_ACTIVITY_ID, (athlete_id, strava_id))
+    run_query(SQL_NEXT_ACTIVITY_ID, (athlete_id, strava_id))
+    scan_best_power_curve(athlete_id, months=12)
+    fitness = run_query("""
+        SELECT date, ctl, atl, tsb FROM athlete_daily_metrics
+        WHERE athlete_id = %s AND date <= %s::date ORDER BY date DESC LIMIT 2
+    """, (athlete_id, activity['start_date_local']))
+    get_db_zone_for_value('tsb', fitness[0]['tsb'] if fitness else None)
+
+def timed(func, *args):
+    started = time.perf_counter()
+    func(*args)
+    return (time.perf_counter() - started) * 1000
+
+def bench(athlete_id, sample=10, repeats=3):
+    ids = [r['strava_id'] for r in run_query("""
+        SELECT a.strava_id FROM activities a JOIN activity_streams s ON s.strava_id = a.strava_id
+        WHERE a.athlete_id = %s ORDER BY random() LIMIT %s
+    """, (athlete_id, sample))]
+    if not ids:
+        print(f"No activities with streams for {athlete_id}.")
+        return
+
+    legacy, loader = [], []
+    for _ in range(repeats):
+        for sid in ids:
+            legacy.append(timed(legacy_load, athlete_id, sid))
+            loader.append(timed(load_activity_page, athlete_id, sid))
+
+    print(f"{len(ids)} activities x {repeats} repeats (ms)")
+    print(f"{'':10} {'median':>8} {'p90':>8} {'max':>8}")
+    for label, samples in (('legacy', legacy), ('loader', loader)):
+        p90 = statistics.quantiles(samples, n=10)[-1] if len(samples) > 1 else samples[0]
+        print(f"{label:10} {statistics.median(samples):8.1f} {p90:8.1f} {max(samples):8.1f}")
+    print(f"speedup (median): {statistics.median(legacy) / statistics.median(loader):.1f}x")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m scripts.bench_activity_page <athlete_id> [activities] [repeats]")
+        sys.exit(1)
+
+    bench(int(sys.argv[1]),
+          int(sys.argv[2]) if len(sys.argv) > 2 else 10,
+          int(sys.argv[3]) if len(sys.argv) > 3 else 3)
@@ -0,0 +1,282 @@
+# scripts/fake_strava.py
+
+# Local stand-in for the Strava API, for load-testing run_sync, crawl_backfill and the
+# webhook path without touching the real API or its quota.
+#
+# Serves /api/v3/athlete, /api/v3/athlete/activities, /api/v3/activities/<id>,
+# /api/v3/activities/<id>/streams and /oauth/token, /oauth/deauthorize from
+#   - recorded fixtures (--fixtures DIR: athlete.json, activities/<id>.json, streams/<id>.json), or
+#   - synthetic, deterministic activities and streams (default, --activities N)
+# with configurable latency, X-RateLimit headers, 404 streams and 429 bursts.
+#
+# Record fixtures from the real API (requests are proxied and saved into DIR):
+#   python scripts/fake_strava.py --record fixtures/strava
+# Replay / synthetic:
+#   python scripts/fake_strava.py --fixtures fixtures/strava --latency-ms 150 --throttle-every 300
+#   python scripts/fake_strava.py --activities 2000 --missing-streams 0.05
+#
+# Point the app at it (config.py):
+#   STRAVA_API_BASE = 'http://127.0.0.1:5055/api/v3'
+#   STRAVA_OAUTH_BASE = 'http://127.0.0.1:5055/oauth'
+
+import argparse, json, math, os, random, threading, time
+from datetime import datetime, timedelta, timezone
+import requests
+from flask import Flask, jsonify, request, Response
+
+app = Flask(__name__)
+
+opts = None
+state = {'lock': threading.Lock(), 'count': 0, 'window_15m': None, 'usage_15m': 0, 'day': None, 'usage_1d': 0}
+
+ATHLETE_ID = 1000001
+STREAM_KEYS = ['time', 'distance', 'velocity_smooth', 'heartrate', 'cadence', 'watts', 'temp', 'moving', 'altitude', 'latlng']
+
+# ------------------------------------------------------------------------------------------
+# Fixtures
+
+def fixture_path(*parts):
+    return os.path.join(opts.fixtures or opts.record, *parts)
+
+def load_fixture(*parts):
+    path = fixture_path(*parts)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def save_fixture(data, *parts):
+    path = fixture_path(*parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+_activities = None
+
+def all_activities():
+    """Every activity summary, newest first (recorded details or synthetic)."""
+    global _activities
+    if _activities is None:
+        if opts.fixtures:
+            folder = fixture_path('activities')
+            names = os.listdir(folder) if os.path.isdir(folder) else []
+            _activities = [load_fixture('activities', n) for n in names if n.endswith('.json')]
+        else:
+            _activities = [synthetic_activity(i) for i in range(opts.activities)]
+        _activities.sort(key=lambda a: a['start_date'], reverse=True)
+    return _activities
+
+def find_activity(activity_id):
+    if opts.fixtures:
+        return load_fixture('activities', f"{activity_id}.json")
+    index = activity_id - ATHLETE_ID * 10
+    return synthetic_activity(index) if 0 <= index < opts.activities else None
+
+# ------------------------------------------------------------------------------------------
+# Synthetic data (seeded by activity index, so every run serves the same rides)
+
+def synthetic_activity(index):
+    rnd = random.Random(index)
+    start = datetime(2026, 1, 1, 7, tzinfo=timezone.utc) - timedelta(days=index * 0.7, minutes=rnd.randint(0, 600))
+    moving = rnd.randint(1800, 4 * 3600)
+    watts = rnd.randint(140, 260)
+    kind = rnd.choice(['Ride', 'Ride', 'Ride', 'VirtualRide', 'Run', 'Walk'])
+    return {
+        'id': ATHLETE_ID * 10 + index, 'resource_state': 3, 'athlete': {'id': ATHLETE_ID},
+        'name': f"Synthetic {kind} #{index}", 'type': kind, 'sport_type': kind,
+        'start_date': start.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'start_date_local': (start + timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'timezone': '(GMT+01:00) Europe/Prague',
+        'distance': round(moving * rnd.uniform(6, 10), 1), 'moving_time': moving, 'elapsed_time': moving + rnd.randint(0, 900),
+        'total_elevation_gain': round(rnd.uniform(0, 1500), 1),
+        'average_speed': round(rnd.uniform(6, 10), 3), 'max_speed': round(rnd.uniform(12, 20), 3),
+        'average_watts': watts, 'max_watts': watts * 4, 'weighted_average_watts': int(watts * 1.08),
+        'kilojoules': round(watts * moving / 1000, 1), 'device_watts': kind in ('Ride', 'VirtualRide'),
+        'average_heartrate': rnd.randint(120, 160), 'max_heartrate': rnd.randint(165, 190),
+        'average_cadence': rnd.randint(75, 95), 'suffer_score': rnd.randint(10, 200),
+        'achievement_count': 0, 'kudos_count': rnd.randint(0, 20), 'trainer': kind == 'VirtualRide', 'manual': False,
+        'device_name': 'Fake Strava', 'map': {'summary_polyline': None}, 'laps': [],
+    }
+
+def synthetic_streams(activity):
+    rnd = random.Random(activity['id'])
+    n = activity['moving_time']
+    watts_avg = activity['average_watts']
+    data = {
+        'time': list(range(n)),
+        'distance': [round(i * activity['distance'] / n, 1) for i in range(n)],
+        'velocity_smooth': [round(activity['average_speed'] + math.sin(i / 60), 2) for i in range(n)],
+        'heartrate': [int(activity['average_heartrate'] + 10 * math.sin(i / 300)) for i in range(n)],
+        'cadence': [max(0, int(rnd.gauss(activity['average_cadence'], 8))) for _ in range(n)],
+        'watts': [max(0, int(rnd.gauss(watts_avg, watts_avg * 0.25))) for _ in range(n)],
+        'temp': [18] * n,
+        'moving': [True] * n,
+        'altitude': [round(300 + 100 * math.sin(i / 900), 1) for i in range(n)],
+        'latlng': [[50.08 + i * 1e-5, 14.42 + i * 1e-5] for i in range(n)],
+    }
+    return {k: {'data': v, 'series_type': 'time', 'original_size': n, 'resolution': 'high'} for k, v in data.items()}
+
+# ------------------------------------------------------------------------------------------
+# Latency, rate limits, failures
+
+def rate_limit_headers():
+    now = datetime.now(timezone.utc)
+    window = now.replace(minute=now.minute - now.minute % 15, second=0, microsecond=0)
+    with state['lock']:
+        if state['window_15m'] != window:
+            state['window_15m'], state['usage_15m'] = window, 0
+        if state['day'] != now.date():
+            state['day'], state['usage_1d'] = now.date(), 0
+        state['usage_15m'] += 1
+        state['usage_1d'] += 1
+        state['count'] += 1
+        usage = (state['usage_15m'], state['usage_1d'], state['count'])
+    headers = {
+        'X-RateLimit-Limit': f"{opts.limit_15m},{opts.limit_1d}",
+        'X-RateLimit-Usage': f"{usage[0]},{usage[1]}",
+    }
+    return headers, usage
+
+def simulate(handler):
+    """Wraps an API handler with latency, rate-limit headers and 429 bursts."""
+    def wrapped(*args, **kwargs):
+        if opts.latency_ms:
+            time.sleep(max(0, random.gauss(opts.latency_ms, opts.latency_ms * 0.2)) / 1000)
+
+        headers, (usage_15m, usage_1d, count) = rate_limit_headers()
+        over_limit = opts.enforce_limits and (usage_15m > opts.limit_15m or usage_1d > opts.limit_1d)
+        in_burst = opts.throttle_every and (count % opts.throttle_every) < opts.throttle_length
+        if over_limit or in_burst:
+            headers['Retry-After'] = str(opts.retry_after)
+            return Response(json.dumps({'message': 'Rate Limit Exceeded'}), 429, headers, mimetype='application/json')
+
+        res = handler(*args, **kwargs)
+        if isinstance(res, tuple):
+            body, status = res
+        else:
+            body, status = res, 200
+        return Response(json.dumps(body), status, headers, mimetype='application/json')
+    wrapped.__name__ = handler.__name__
+    return wrapped
+
+def proxy(path):
+    """Record mode: forwards to the real Strava API and returns its JSON (or None)."""
+    res = requests.request(
+        request.method, f"{opts.upstream}{path}",
+        headers={'Authorization': request.headers.get('Authorization', '')},
+        params=request.args, data=request.form, timeout=30
+    )
+    return res.json() if res.ok else None, res.status_code
+
+# ------------------------------------------------------------------------------------------
+# API
+
+@app.route('/api/v3/athlete')
+@simulate
+def athlete():
+    if opts.record:
+        body, status = proxy('/api/v3/athlete')
+        if body:
+            save_fixture(body, 'athlete.json')
+        return body, status
+    return load_fixture('athlete.json') if opts.fixtures else {
+        'id': ATHLETE_ID, 'firstname': 'Fake', 'lastname': 'Athlete', 'resource_state': 3
+    }
+
+@app.route('/api/v3/athlete/activities')
+@simulate
+def athlete_activities():
+    if opts.record:
+        body, status = proxy('/api/v3/athlete/activities')
+        for a in body or []:
+            if not os.path.exists(fixture_path('activities', f"{a['id']}.json")):
+                save_fixture(a, 'activities', f"{a['id']}.json")
+        return body, status
+
+    page = int(request.args.get('page', 1))
+    per_page = int(request.args.get('per_page', 30))
+    before = request.args.get('before', type=int)
+    after = request.args.get('after', type=int)
+
+    def epoch(a):
+        return int(datetime.fromisoformat(a['start_date'].replace('Z', '+00:00')).timestamp())
+
+    selected = all_activities()
+    if before:
+        selected = [a for a in selected if epoch(a) < before]
+    if after:
+        # Strava returns 'after' queries oldest first
+        selected = sorted((a for a in selected if epoch(a) > after), key=lambda a: a['start_date'])
+
+    chunk = selected[(page - 1) * per_page: page * per_page]
+    return [{**a, 'resource_state': 2} for a in chunk]
+
+@app.route('/api/v3/activities/<int:activity_id>')
+@simulate
+def activity_detail(activity_id):
+    if opts.record:
+        body, status = proxy(f'/api/v3/activities/{activity_id}')
+        if body:
+            save_fixture(body, 'activities', f"{activity_id}.json")
+        return body, status
+
+    activity = find_activity(activity_id)
+    return (activity, 200) if activity else ({'message': 'Record Not Found'}, 404)
+
+@app.route('/api/v3/activities/<int:activity_id>/streams')
+@simulate
+def activity_streams(activity_id):
+    if opts.record:
+        body, status = proxy(f'/api/v3/activities/{activity_id}/streams')
+        if body:
+            save_fixture(body, 'streams', f"{activity_id}.json")
+        return body, status
+
+    activity = find_activity(activity_id)
+    if not activity or random.Random(activity_id).random() < opts.missing_streams:
+        return {'message': 'Record Not Found'}, 404
+
+    streams = load_fixture('streams', f"{activity_id}.json") if opts.fixtures else synthetic_streams(activity)
+    if streams is None:
+        return {'message': 'Record Not Found'}, 404
+
+    keys = set(request.args.get('keys', ','.join(STREAM_KEYS)).split(',')) | {'time'}
+    return {k: v for k, v in streams.items() if k in keys}
+
+@app.route('/oauth/token', methods=['POST'])
+@simulate
+def oauth_token():
+    expires_at = int(time.time()) + 6 * 3600
+    return {
+        'token_type': 'Bearer', 'access_token': f"fake-{random.getrandbits(64):x}",
+        'refresh_token': request.form.get('refresh_token') or 'fake-refresh',
+        'expires_at': expires_at, 'expires_in': 6 * 3600,
+        'athlete': {'id': ATHLETE_ID, 'firstname': 'Fake', 'lastname': 'Athlete'},
+    }
+
+@app.route('/oauth/deauthorize', methods=['POST'])
+@simulate
+def oauth_deauthorize():
+    return {'access_token': request.headers.get('Authorization', '').replace('Bearer ', '')}
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Local fake Strava API")
+    ap.add_argument('--port', type=int, default=5055)
+    ap.add_argument('--fixtures', help="Replay recorded fixtures from this directory")
+    ap.add_argument('--record', help="Proxy to the real API and save fixtures into this directory")
+    ap.add_argument('--upstream', default='https://www.strava.com')
+    ap.add_argument('--activities', type=int, default=500, help="Synthetic activities to serve")
+    ap.add_argument('--latency-ms', type=float, default=0, help="Mean response latency")
+    ap.add_argument('--missing-streams', type=float, default=0.0, help="Fraction of activities whose streams 404")
+    ap.add_argument('--throttle-every', type=int, default=0, help="Start a 429 burst every N requests")
+    ap.add_argument('--throttle-length', type=int, default=5, help="Requests per 429 burst")
+    ap.add_argument('--retry-after', type=int, default=2, help="Retry-After seconds sent with 429s")
+    ap.add_argument('--limit-15m', type=int, default=100)
+    ap.add_argument('--limit-1d', type=int, default=1000)
+    ap.add_argument('--enforce-limits', action='store_true', help="Answer 429 once the limits are used up")
+    opts = ap.parse_args()
+
+    mode = 'record' if opts.record else ('replay' if opts.fixtures else f"synthetic ({opts.activities} activities)")
+    print(f"🧪 Fake Strava on http://127.0.0.1:{opts.port} - {mode}")
+    app.run(host='127.0.0.1', port=opts.port, threaded=True)
@@ -0,0 +1,27 @@
+# tests/conftest.py
+
+# Unit tests cover the pure functions only; nothing here opens a DB connection or calls Strava.
+# config.py is local to each deployment (DB credentials, Strava secrets) and not in the repo, so
+# when it is missing a placeholder with the settings read at import time is registered.
+#   ./venv/bin/python3 -m pytest -q tests
+
+import os, sys, tempfile, types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+try:
+    import config  # noqa: F401
+except ImportError:
+    config = types.ModuleType('config')
+    base = tempfile.mkdtemp(prefix='cyclingdatahub-tests-')
+    config.__dict__.update({
+        'BASE_PATH': base,
+        'LOG_PATH': os.path.join(base, 'app.log'),
+        'DB_NAME': 'test', 'DB_USER': 'test', 'DB_HOST': 'localhost', 'DB_PORT': 5432,
+        'APP_STRAVA_CLIENT_ID': '0', 'APP_STRAVA_CLIENT_SECRET': '', 'USER_STRAVA_REFRESH_TOKEN': '',
+        'STRAVA_TIMEOUT': 10,
+        'ANALYTICS_RECALC_SIZE': 50, 'CRAWL_BACKFILL_SIZE': 50, 'CRAWL_HISTORY_DAYS': 500,
+    })
+    sys.modules['config'] = config
@@ -0,0 +1,46 @@
+import pytest
+
+from core.database import activity_fingerprint, FINGERPRINT_FIELDS
+
+
+def summary(**overrides):
+    a = {
+        'id': 123, 'name': 'Morning Ride', 'type': 'Ride', 'sport_type': 'Ride',
+        'start_date': '2025-01-01T08:00:00Z', 'distance': 42195.0, 'moving_time': 5400,
+        'elapsed_time': 5600, 'total_elevation_gain': 410.0, 'average_watts': 210.5,
+        'max_watts': 880, 'weighted_average_watts': 228, 'kilojoules': 1136.7,
+        'average_heartrate': 141.2, 'max_heartrate': 176.0, 'average_cadence': 88.1,
+        'device_watts': True, 'trainer': False, 'manual': False,
+        'kudos_count': 3, 'map': {'summary_polyline': 'abc'},
+    }
+    a.update(overrides)
+    return a
+
+
+def test_fingerprint_is_stable():
+    assert activity_fingerprint(summary()) == activity_fingerprint(summary())
+
+
+@pytest.mark.parametrize('edit', [
+    {'name': 'Renamed'},
+    {'description': 'Legs!'},
+    {'gear_id': 'b123'},
+    {'kudos_count': 40},
+    {'resource_state': 3, 'segment_efforts': [{'id': 1}]},  # detail payload extras
+])
+def test_metadata_edits_keep_the_fingerprint(edit):
+    assert activity_fingerprint(summary(**edit)) == activity_fingerprint(summary())
+
+
+@pytest.mark.parametrize('field', FINGERPRINT_FIELDS)
+def test_content_fields_change_the_fingerprint(field):
+    changed = summary(**{field: 'changed'})
+    assert activity_fingerprint(changed) != activity_fingerprint(summary())
+
+
+def test_track_changes_the_fingerprint():
+    assert activity_fingerprint(summary(map={'summary_polyline': 'xyz'})) != activity_fingerprint(summary())
+
+
+def test_missing_and_empty_track_are_the_same():
+    assert activity_fingerprint(summary(map=None)) == activity_fingerprint(summary(map={'summary_polyline': ''}))
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from core.chart_streams import smooth, lttb_indices, snap_resolution, downsample_channel, STREAM_RESOLUTIONS
+
+
+def test_smooth_matches_trailing_mean():
+    values = np.array([1.0, 2.0, 3.0, 4.0, 5.0])
+    window = 2
+    expected = [np.mean(values[max(0, i - window):i + 1]) for i in range(len(values))]
+    np.testing.assert_allclose(smooth(values, window), expected)
+
+
+def test_smooth_without_window_is_identity():
+    values = np.array([3.0, 1.0, 2.0])
+    assert smooth(values, 0) is values
+
+
+@pytest.mark.parametrize('size, n', [(10, 5), (1000, 100), (1001, 3), (5000, 1200)])
+def test_lttb_keeps_endpoints_and_one_point_per_bucket(size, n):
+    rng = np.random.default_rng(size)
+    x = np.arange(size, dtype=np.float64)
+    y = rng.normal(size=size)
+
+    idx = lttb_indices(x, y, n)
+
+    assert len(idx) == n
+    assert idx[0] == 0 and idx[-1] == size - 1
+    assert np.all(np.diff(idx) > 0)
+
+    # Every middle point comes from its own bucket
+    edges = np.linspace(1, size - 1, n - 1).astype(np.int64)
+    for i, k in enumerate(idx[1:-1]):
+        assert edges[i] <= k < edges[i + 1]
+
+
+def test_lttb_keeps_a_spike():
+    x = np.arange(1000, dtype=np.float64)
+    y = np.zeros(1000)
+    y[437] = 1000.0
+    assert 437 in lttb_indices(x, y, 50)
+
+
+@pytest.mark.parametrize('n', [0, 2, 10, 50])
+def test_lttb_returns_everything_when_nothing_to_reduce(n):
+    x = np.arange(10, dtype=np.float64)
+    np.testing.assert_array_equal(lttb_indices(x, x, n), np.arange(10))
+
+
+def test_snap_resolution():
+    assert snap_resolution(1) == STREAM_RESOLUTIONS[0]
+    assert snap_resolution(STREAM_RESOLUTIONS[0]) == STREAM_RESOLUTIONS[0]
+    assert snap_resolution(STREAM_RESOLUTIONS[0] + 1) == STREAM_RESOLUTIONS[1]
+    assert snap_resolution(10 ** 9) == STREAM_RESOLUTIONS[-1]
+
+
+def test_downsample_channel_shape_and_nulls():
+    time_series = list(range(5000))
+    values = [None if i % 100 == 0 else 200 + i % 7 for i in range(5000)]
+
+    data = downsample_channel(time_series, values, 'watts', 300)
+
+    assert len(data['t']) == len(data['v']) == 300
+    assert data['t'][0] == 0 and data['t'][-1] == 4999
+    assert all(isinstance(v, int) for v in data['v'])
+
+
+def test_downsample_channel_uses_the_shorter_series():
+    data = downsample_channel(list(range(10)), [1.5] * 8, 'altitude', 300)
+    assert data['t'] == list(range(8))
+    assert data['v'] == [1.5] * 8
@@ -0,0 +1,64 @@
+import csv, gzip, io, json
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from core import exports
+from core.exports import iter_export, gzip_chunks
+from core.processor import format_activities_to_markdown
+
+ROWS = [
+    {'strava_id': 1, 'name': 'Morning Ride', 'date': date(2025, 1, 1), 'power': Decimal('210.5'), 'hr': None},
+    {'strava_id': 2, 'name': 'Zürich, "loop"', 'date': date(2025, 1, 2), 'power': Decimal('0'), 'hr': 140},
+]
+
+
+def export(rows, export_format, **kwargs):
+    return b''.join(iter_export(iter(rows), export_format, **kwargs)).decode()
+
+
+def test_csv():
+    body = export(ROWS, 'csv')
+    parsed = list(csv.DictReader(io.StringIO(body)))
+    assert list(parsed[0]) == list(ROWS[0])
+    assert parsed[1]['name'] == 'Zürich, "loop"'
+    assert parsed[0]['power'] == '210.5' and parsed[0]['hr'] == ''
+
+
+def test_ndjson():
+    lines = export(ROWS, 'ndjson').splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {'strava_id': 1, 'name': 'Morning Ride', 'date': '2025-01-01', 'power': '210.5', 'hr': None},
+        {'strava_id': 2, 'name': 'Zürich, "loop"', 'date': '2025-01-02', 'power': '0', 'hr': 140},
+    ]
+
+
+def test_json_matches_ndjson_rows():
+    rows = [json.loads(line) for line in export(ROWS, 'ndjson').splitlines()]
+    assert json.loads(export(ROWS, 'json')) == rows
+
+
+@pytest.mark.parametrize('export_format, expected', [('csv', ''), ('ndjson', ''), ('json', '[]'), ('markdown', '')])
+def test_empty_rows(export_format, expected):
+    assert export([], export_format) == expected
+
+
+def test_markdown_matches_the_dump_table():
+    assert export(ROWS, 'markdown') == format_activities_to_markdown(ROWS) + '\n'
+
+
+def test_callers_dumps_is_used():
+    body = export(ROWS, 'json', dumps=lambda row: json.dumps(row['strava_id']))
+    assert body == '[1,2]'
+
+
+def test_small_chunks_and_gzip_round_trip(monkeypatch):
+    monkeypatch.setattr(exports, 'EXPORT_CHUNK_BYTES', 16)
+    rows = ROWS * 50
+    chunks = list(iter_export(iter(rows), 'ndjson'))
+    assert len(chunks) > 1
+
+    body = b''.join(chunks)
+    assert len(body.splitlines()) == len(rows)
+    assert gzip.decompress(b''.join(gzip_chunks(iter(chunks)))) == body
@@ -0,0 +1,81 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+from dateutil.relativedelta import relativedelta
+
+from core import power_progression
+from core.power_progression import sliding_max, months_ago, SEASONAL_WINDOW_DAYS
+
+
+def backwards_scan(dates, values, window_days=SEASONAL_WINDOW_DAYS):
+    """The per-ride scan sliding_max replaced."""
+    out = []
+    for i, d in enumerate(dates):
+        start = d - timedelta(days=window_days)
+        out.append(max(values[j] for j in range(i + 1) if dates[j] >= start))
+    return out
+
+
+def test_sliding_max_matches_backwards_scan():
+    import random
+    rng = random.Random(42)
+    d = date(2024, 1, 1)
+    dates, values = [], []
+    for _ in range(500):
+        d += timedelta(days=rng.choice([0, 0, 1, 2, 5, 40]))  # same-day rides and gaps
+        dates.append(d)
+        values.append(rng.randint(100, 400))
+
+    assert sliding_max(dates, values) == backwards_scan(dates, values)
+
+
+def test_sliding_max_window_edges():
+    dates = [date(2024, 1, 1), date(2024, 1, 31), date(2024, 2, 1)]
+    # 30 days back from Jan 31 still includes Jan 1, from Feb 1 it does not
+    assert sliding_max(dates, [300, 100, 50]) == [300, 300, 100]
+
+
+def test_sliding_max_ties_and_empty():
+    dates = [date(2024, 1, 1)] * 3
+    assert sliding_max(dates, [200, 200, 100]) == [200, 200, 200]
+    assert sliding_max([], []) == []
+
+
+@pytest.mark.parametrize('now, months', [
+    (datetime(2024, 3, 31, 12), 1),
+    (datetime(2024, 5, 31), 3),
+    (datetime(2023, 3, 29), 1),
+    (datetime(2024, 1, 15), 12),
+    (datetime(2024, 1, 15), 13),
+    (datetime(2024, 7, 10), 0),
+])
+def test_months_ago_matches_calendar_months(now, months):
+    assert months_ago(now, months) == now - relativedelta(months=months)
+
+
+def test_build_progression_series(monkeypatch):
+    today = datetime.now().replace(hour=8, minute=0, second=0, microsecond=0)
+    rows = {
+        1: {'date': today - timedelta(days=400), 'name': 'old', 'ftp': 250, 'p5': 900, 'p60': 0, 'p300': None,
+            'p600': None, 'p1200': 300, 'p3600': None},
+        2: {'date': today - timedelta(days=40), 'name': 'a', 'ftp': 250, 'p5': 800, 'p60': 400, 'p300': None,
+            'p600': None, 'p1200': 280, 'p3600': None},
+        3: {'date': today - timedelta(days=5), 'name': 'b', 'ftp': 260, 'p5': 700, 'p60': 450, 'p300': None,
+            'p600': None, 'p1200': 260, 'p3600': None},
+    }
+    monkeypatch.setattr(power_progression, 'get_progression_rows', lambda athlete_id: rows)
+
+    progression, all_time, recent = power_progression.build_progression(1, months_limit=12)
+
+    # The 400-day-old ride is outside the 12 months; rides without a value are left out
+    assert [p['id'] for p in progression['5s']] == ['2', '3']
+    # 35 days apart: the 30-day seasonal record does not carry over
+    assert [p['seasonal_record'] for p in progression['5s']] == [800, 700]
+    assert [p['id'] for p in progression['1m']] == ['2', '3']
+    assert progression['5m'] == []
+    assert all_time['5s'] == 800 and recent['5s'] == 700
+    assert all_time['5m'] == 0
+
+    progression, all_time, _ = power_progression.build_progression(1, months_limit=None)
+    assert [p['id'] for p in progression['5s']] == ['1', '2', '3']
+    assert all_time['5s'] == 900
@@ -0,0 +1,73 @@
+import json
+
+import numpy as np
+import pytest
+
+from core.stream_parser import parse_stream_chunks
+
+RESPONSE = json.dumps({
+    'time': {'data': [0, 1, 2, 5, 6], 'series_type': 'distance', 'original_size': 5, 'resolution': 'high'},
+    'latlng': {'data': [[46.05123, 14.50612], [46.05131, 14.50644], [46.0514, 14.5067],
+                        [46.05152, 14.50701], [-46.05163, -14.50733]],
+               'series_type': 'distance', 'original_size': 5, 'resolution': 'high'},
+    'distance': {'data': [0.0, 4.2, 9.85, 1.5e3, 1234.5], 'series_type': 'distance'},
+    'watts': {'data': [120, None, 305, 1210, 0], 'series_type': 'distance'},
+    'moving': {'data': [False, True, True, False, True], 'series_type': 'distance'},
+    'altitude': {'data': [295.4, 295.6, None, 296.0, 296.2], 'series_type': 'distance', 'note': 'Grödig'},
+}, ensure_ascii=False).encode()
+
+
+def assert_matches_json(streams):
+    expected = json.loads(RESPONSE)
+    assert set(streams) == set(expected)
+
+    np.testing.assert_array_equal(streams['latlng']['data'], np.array(expected['latlng']['data']))
+    assert streams['latlng']['data'].shape == (5, 2)
+
+    assert streams['time']['data'].dtype == np.int64
+    assert streams['time']['data'].tolist() == expected['time']['data']
+
+    watts = streams['watts']['data']
+    assert isinstance(watts, np.ma.MaskedArray) and watts.dtype == np.int64
+    assert watts.tolist() == expected['watts']['data']  # masked values come back as None
+
+    assert streams['moving']['data'].dtype == bool
+    assert streams['moving']['data'].tolist() == expected['moving']['data']
+
+    np.testing.assert_allclose(streams['distance']['data'], expected['distance']['data'])
+    altitude = streams['altitude']['data']
+    assert np.isnan(altitude[2])
+    np.testing.assert_allclose(np.delete(altitude, 2), [295.4, 295.6, 296.0, 296.2])
+
+
+def test_single_chunk():
+    assert_matches_json(parse_stream_chunks([RESPONSE]))
+
+
+@pytest.mark.parametrize('cut', range(1, len(RESPONSE)))
+def test_split_at_every_byte(cut):
+    # Covers splits inside numbers, null/true/false, "data": [, latlng pairs and the UTF-8 'ö'
+    assert_matches_json(parse_stream_chunks([RESPONSE[:cut], RESPONSE[cut:]]))
+
+
+@pytest.mark.parametrize('size', [1, 3, 7, 64])
+def test_small_chunks(size):
+    chunks = [RESPONSE[i:i + size] for i in range(0, len(RESPONSE), size)]
+    assert_matches_json(parse_stream_chunks(chunks))
+
+
+def test_non_int_channels_without_nulls_are_plain_arrays():
+    streams = parse_stream_chunks([b'{"heartrate": {"data": [90, 91]}}'])
+    assert not isinstance(streams['heartrate']['data'], np.ma.MaskedArray)
+    assert streams['heartrate']['data'].tolist() == [90, 91]
+
+
+def test_empty_stream():
+    streams = parse_stream_chunks([b'{"watts": {"data": []}}'])
+    assert len(streams['watts']['data']) == 0
+
+
+@pytest.mark.parametrize('body', [b'{"time": {"data": [0, 1, 2', b'{"latlng": {"data": [[46.0, 14.0], [46.1'])
+def test_truncated_response_raises(body):
+    with pytest.raises(ValueError):
+        parse_stream_chunks([body])